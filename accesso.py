@@ -0,0 +1,70 @@
+import time
+from collections import namedtuple
+from functools import wraps
+from flask import current_app, flash, g, redirect, session, url_for
+from models import db, User
+
+# Dati dell'utente loggato conservati nella cache e passati ai template
+UtenteCorrente = namedtuple('UtenteCorrente', ['id', 'nome', 'cognome', 'email', 'ruolo'])
+
+# Cache dell'identità degli utenti loggati, per non interrogare il database a
+# ogni richiesta. È una per ogni app (in app.extensions), così app create con
+# database diversi (es. nei test) non si scambiano gli utenti. Le voci scadono
+# dopo USER_CACHE_TTL secondi e sono invalidate subito quando un admin
+# modifica o elimina l'utente
+USER_CACHE_TTL = 30
+
+
+def _cache_utenti():
+    return current_app.extensions.setdefault('cache_utenti', {})
+
+
+def _carica_utente(user_id):
+    cache = _cache_utenti()
+    voce = cache.get(user_id)
+    if voce and voce[0] > time.monotonic():
+        return voce[1]
+    user = db.session.get(User, user_id)
+    utente = UtenteCorrente(user.id, user.nome, user.cognome, user.email, user.ruolo) if user else None
+    cache[user_id] = (time.monotonic() + USER_CACHE_TTL, utente)
+    return utente
+
+
+def invalida_utente(user_id):
+    _cache_utenti().pop(user_id, None)
+
+
+# Funzione per ottenere l'utente loggato. Viene caricato solo dalle view che
+# ne hanno bisogno (e dai template), non a ogni richiesta
+def get_current_user():
+    if 'user' not in g:
+        user_id = session.get('user_id')
+        g.user = _carica_utente(user_id) if user_id else None
+    return g.user
+
+
+# Rende disponibile 'current_user' in tutti i template (es. navbar.html)
+def inject_current_user():
+    return {'current_user': get_current_user()}
+
+
+# Funzioni per il controllo dell'autenticazione come admin
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user = get_current_user()
+        if not user or user.ruolo != 'admin':
+            return redirect(url_for('catalogo.home'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+# Funzione per il controllo dell'autenticazione
+def login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Devi effettuare il login per accedere a questa pagina.', 'warning')
+            return redirect(url_for('utenti.login'))
+        return f(*args, **kwargs)
+    return decorated_function
@@ -0,0 +1,283 @@
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from functools import partial
+from flask import current_app
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool
+from models import db, configura_sqlite, incrementa_versione_catalogo, Lotto, Prenotazione
+from prenotazioni import pulisci_eliminate
+from settings import ARCHIVIO_GIORNI
+
+# Archivio dei lotti già consegnati. Le tabelle 'lotti' e 'prenotazioni'
+# crescono sempre: i lotti con data di consegna più vecchia di ARCHIVIO_GIORNI
+# giorni vengono spostati, con le loro prenotazioni, in un file SQLite separato
+# (ARCHIVIO_PATH nella configurazione dell'app) con le stesse colonne. Catalogo, API, elenchi e
+# disponibilità continuano a usare solo le tabelle del database principale,
+# che contengono così soltanto i lotti attivi.
+#
+# L'archivio è collegato con ATTACH solo sulle connessioni di questo modulo,
+# che hanno anche due viste temporanee 'lotti' e 'prenotazioni' con l'unione
+# dei dati attivi e archiviati. SQLite cerca i nomi senza schema prima tra gli
+# oggetti temporanei, quindi le query dell'app (es. i report) eseguite su queste
+# connessioni leggono lo storico completo senza modifiche.
+#
+# Il database principale usa WAL, con cui un commit su più file non è
+# atomico: lo spostamento avviene quindi in due transazioni. Prima i record
+# vengono copiati nel file di destinazione; poi, con il lock di scrittura del
+# database principale, si controlla che le copie siano identiche agli
+# originali e che i totali complessivi non cambino, e solo allora gli
+# originali vengono cancellati. Se il processo si interrompe a metà, i record
+# si trovano in entrambi i file (le viste mostrano quelli attivi) e basta
+# ripetere il comando. Da eseguire periodicamente, es. con cron:
+#   0 3 * * * flask --app app archivia
+
+SCHEMA = 'archivio'
+
+COLONNE_LOTTI = [colonna.name for colonna in Lotto.__table__.columns]
+COLONNE_PRENOTAZIONI = [colonna.name for colonna in Prenotazione.__table__.columns]
+
+# Tabelle dell'archivio, con le colonne dei modelli. 'archiviazioni' registra
+# le operazioni eseguite
+SCHEMA_ARCHIVIO = [
+    f'''CREATE TABLE IF NOT EXISTS {SCHEMA}.lotti (
+        id INTEGER NOT NULL PRIMARY KEY,
+        prodotto_id INTEGER NOT NULL,
+        data_consegna DATE NOT NULL,
+        qta_unita_misura VARCHAR(10) NOT NULL,
+        qta_lotto INTEGER NOT NULL,
+        prezzo_unitario FLOAT NOT NULL,
+        sospeso BOOLEAN
+    )''',
+    f'CREATE INDEX IF NOT EXISTS {SCHEMA}.ix_lotti_data_consegna ON lotti (data_consegna)',
+    f'''CREATE TABLE IF NOT EXISTS {SCHEMA}.prenotazioni (
+        id INTEGER NOT NULL PRIMARY KEY,
+        lotto_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        qta INTEGER NOT NULL
+    )''',
+    f'CREATE INDEX IF NOT EXISTS {SCHEMA}.ix_prenotazioni_lotto_id ON prenotazioni (lotto_id)',
+    f'CREATE INDEX IF NOT EXISTS {SCHEMA}.ix_prenotazioni_user_id ON prenotazioni (user_id)',
+    f'''CREATE TABLE IF NOT EXISTS {SCHEMA}.archiviazioni (
+        id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        eseguita_il DATETIME NOT NULL,
+        operazione VARCHAR(12) NOT NULL,
+        data_da DATE,
+        data_a DATE,
+        lotti INTEGER NOT NULL,
+        prenotazioni INTEGER NOT NULL
+    )''',
+]
+
+# Totali usati per controllare che spostamenti e ripristini non perdano dati
+Totali = namedtuple('Totali', ['lotti', 'qta_lotti', 'prenotazioni', 'qta_prenotata', 'importo'])
+
+_engines = {}
+
+
+def _viste_storico():
+    lotti, prenotazioni = ', '.join(COLONNE_LOTTI), ', '.join(COLONNE_PRENOTAZIONI)
+    return [
+        f'''CREATE TEMP VIEW lotti AS
+            SELECT {lotti} FROM main.lotti
+            UNION ALL
+            SELECT {lotti} FROM {SCHEMA}.lotti WHERE id NOT IN (SELECT id FROM main.lotti)''',
+        f'''CREATE TEMP VIEW prenotazioni AS
+            SELECT {prenotazioni} FROM main.prenotazioni
+            UNION ALL
+            SELECT {prenotazioni} FROM {SCHEMA}.prenotazioni WHERE lotto_id NOT IN (SELECT id FROM main.lotti)''',
+    ]
+
+
+# Collega l'archivio a ogni nuova connessione (creando le tabelle se il file
+# è nuovo) e crea le viste temporanee con lo storico completo
+def _collega_archivio(percorso, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'ATTACH DATABASE ? AS {SCHEMA}', (percorso,))
+    for istruzione in SCHEMA_ARCHIVIO + _viste_storico():
+        cursor.execute(istruzione)
+    cursor.close()
+
+
+# Engine dedicato all'archivio, sullo stesso database dell'app. Senza pool:
+# le connessioni con l'archivio collegato non tornano tra quelle dell'app
+def _engine_archivio():
+    url = db.engine.url
+    percorso = current_app.config['ARCHIVIO_PATH']
+    engine = _engines.get((url, percorso))
+    if engine is None:
+        engine = create_engine(url, poolclass=NullPool, connect_args={'check_same_thread': False})
+        configura_sqlite(engine)
+        event.listen(engine, 'connect', partial(_collega_archivio, percorso))
+        _engines[url, percorso] = engine
+    return engine
+
+
+# Connessione con l'archivio collegato: i nomi 'lotti' e 'prenotazioni' senza
+# schema indicano lo storico completo, 'main.' i dati attivi e 'archivio.'
+# quelli archiviati
+@contextmanager
+def connessione_storico():
+    with _engine_archivio().connect() as conn:
+        yield conn
+
+
+def _esegui(conn, sql, parametri=None):
+    return conn.execute(db.text(sql), parametri or {})
+
+
+# Totali dei lotti di 'schema' ('main', 'archivio' o '' per lo storico
+# completo) che soddisfano la condizione sull'alias 'l'
+def _totali(conn, schema, condizione='1', parametri=None):
+    prefisso = f'{schema}.' if schema else ''
+    lotti = _esegui(conn, f'''
+        SELECT count(*), coalesce(sum(l.qta_lotto), 0) FROM {prefisso}lotti AS l WHERE {condizione}
+    ''', parametri).one()
+    prenotazioni = _esegui(conn, f'''
+        SELECT count(*), coalesce(sum(p.qta), 0), round(total(p.qta * l.prezzo_unitario), 2)
+        FROM {prefisso}prenotazioni AS p JOIN {prefisso}lotti AS l ON l.id = p.lotto_id
+        WHERE {condizione}
+    ''', parametri).one()
+    return Totali(*lotti, *prenotazioni)
+
+
+# Controlla che i lotti selezionati in 'origine', con le loro prenotazioni,
+# siano presenti e identici in 'destinazione' (e che la destinazione non
+# abbia altre prenotazioni per quei lotti)
+def _verifica_copia(conn, origine, destinazione, condizione, parametri):
+    lotti, prenotazioni = ', '.join(COLONNE_LOTTI), ', '.join(COLONNE_PRENOTAZIONI)
+    selezionati = f'SELECT l.id FROM {origine}.lotti AS l WHERE {condizione}'
+    differenze = [
+        f'''SELECT {lotti} FROM {origine}.lotti AS l WHERE {condizione}
+            EXCEPT SELECT {lotti} FROM {destinazione}.lotti''',
+        f'''SELECT {prenotazioni} FROM {origine}.prenotazioni WHERE lotto_id IN ({selezionati})
+            EXCEPT SELECT {prenotazioni} FROM {destinazione}.prenotazioni''',
+        f'''SELECT {prenotazioni} FROM {destinazione}.prenotazioni WHERE lotto_id IN ({selezionati})
+            EXCEPT SELECT {prenotazioni} FROM {origine}.prenotazioni''',
+    ]
+    for sql in differenze:
+        if _esegui(conn, f'SELECT count(*) FROM ({sql})', parametri).scalar():
+            raise RuntimeError(f'I dati copiati in {destinazione} non corrispondono a quelli in {origine}: '
+                               'nessun record è stato cancellato, ripetere l\'operazione.')
+
+
+def _registra(conn, operazione, data_da, data_a, totali):
+    _esegui(conn, f'''
+        INSERT INTO {SCHEMA}.archiviazioni (eseguita_il, operazione, data_da, data_a, lotti, prenotazioni)
+        VALUES (:eseguita_il, :operazione, :data_da, :data_a, :lotti, :prenotazioni)
+    ''', {
+        'eseguita_il': datetime.now().isoformat(sep=' ', timespec='seconds'),
+        'operazione': operazione,
+        'data_da': data_da.isoformat() if data_da else None,
+        'data_a': data_a.isoformat() if data_a else None,
+        'lotti': totali.lotti,
+        'prenotazioni': totali.prenotazioni,
+    })
+    conn.commit()
+
+
+# Sposta nell'archivio i lotti con data di consegna precedente a 'prima_del'
+# (default: oggi meno ARCHIVIO_GIORNI giorni) e le loro prenotazioni.
+# Restituisce i Totali dei record archiviati
+def archivia(prima_del=None):
+    prima_del = prima_del or date.today() - timedelta(days=ARCHIVIO_GIORNI)
+    condizione, parametri = 'l.data_consegna < :limite', {'limite': prima_del.isoformat()}
+    lotti, prenotazioni = ', '.join(COLONNE_LOTTI), ', '.join(COLONNE_PRENOTAZIONI)
+    selezionati = f'SELECT l.id FROM main.lotti AS l WHERE {condizione}'
+
+    with connessione_storico() as conn:
+        # 1. Copia nell'archivio: i dati attivi prevalgono su quelli di una
+        # copia precedente interrotta
+        _esegui(conn, f'''INSERT OR REPLACE INTO {SCHEMA}.lotti ({lotti})
+                          SELECT {lotti} FROM main.lotti AS l WHERE {condizione}''', parametri)
+        _esegui(conn, f'DELETE FROM {SCHEMA}.prenotazioni WHERE lotto_id IN ({selezionati})', parametri)
+        _esegui(conn, f'''INSERT INTO {SCHEMA}.prenotazioni ({prenotazioni})
+                          SELECT {prenotazioni} FROM main.prenotazioni WHERE lotto_id IN ({selezionati})''', parametri)
+        conn.commit()
+
+        # 2. Cancellazione dal database principale. L'incremento della versione
+        # del catalogo prende subito il lock di scrittura: da qui in poi
+        # nessuno può modificare i lotti selezionati
+        incrementa_versione_catalogo(conn)
+        prima = _totali(conn, '')
+        archiviati = _totali(conn, 'main', condizione, parametri)
+        _verifica_copia(conn, 'main', SCHEMA, condizione, parametri)
+        _esegui(conn, f'DELETE FROM main.prenotazioni WHERE lotto_id IN ({selezionati})', parametri)
+        _esegui(conn, f'DELETE FROM main.lotti WHERE id IN ({selezionati})', parametri)
+        if _totali(conn, '') != prima:
+            conn.rollback()
+            raise RuntimeError('I totali cambierebbero dopo l\'archiviazione: operazione annullata.')
+        # Le eliminazioni registrate per la sincronizzazione (comprese quelle
+        # appena archiviate) non servono più: vedi prenotazioni.pulisci_eliminate
+        pulisci_eliminate(conn)
+        conn.commit()
+
+        _registra(conn, 'archiviazione', None, prima_del, archiviati)
+    return archiviati
+
+
+# Riporta tra i lotti attivi i lotti archiviati con data di consegna
+# compresa tra 'data_da' e 'data_a' (se indicate) e le loro prenotazioni.
+# Restituisce i Totali dei record ripristinati
+def ripristina(data_da=None, data_a=None):
+    condizione = 'l.data_consegna BETWEEN :data_da AND :data_a'
+    parametri = {
+        'data_da': (data_da or date.min).isoformat(),
+        'data_a': (data_a or date.max).isoformat(),
+    }
+    lotti, prenotazioni = ', '.join(COLONNE_LOTTI), ', '.join(COLONNE_PRENOTAZIONI)
+    selezionati = f'SELECT l.id FROM {SCHEMA}.lotti AS l WHERE {condizione}'
+
+    with connessione_storico() as conn:
+        # 1. Copia nel database principale dei record che non ci sono già (es.
+        # dopo un ripristino interrotto), con il lock di scrittura preso subito
+        incrementa_versione_catalogo(conn)
+        prima = _totali(conn, '')
+        ripristinati = _totali(conn, SCHEMA, condizione, parametri)
+        _esegui(conn, f'''INSERT INTO main.lotti ({lotti})
+                          SELECT {lotti} FROM {SCHEMA}.lotti AS l
+                          WHERE {condizione} AND id NOT IN (SELECT id FROM main.lotti)''', parametri)
+        _esegui(conn, f'''INSERT INTO main.prenotazioni ({prenotazioni})
+                          SELECT {prenotazioni} FROM {SCHEMA}.prenotazioni
+                          WHERE lotto_id IN ({selezionati}) AND id NOT IN (SELECT id FROM main.prenotazioni)''', parametri)
+        _verifica_copia(conn, SCHEMA, 'main', condizione, parametri)
+        if _totali(conn, '') != prima:
+            conn.rollback()
+            raise RuntimeError('I totali cambierebbero dopo il ripristino: operazione annullata.')
+        conn.commit()
+
+        # 2. Cancellazione dall'archivio
+        _esegui(conn, f'DELETE FROM {SCHEMA}.prenotazioni WHERE lotto_id IN ({selezionati})', parametri)
+        _esegui(conn, f'DELETE FROM {SCHEMA}.lotti WHERE id IN ({selezionati})', parametri)
+        conn.commit()
+
+        _registra(conn, 'ripristino', data_da, data_a, ripristinati)
+    return ripristinati
+
+
+# Totali dei dati attivi, archiviati e dello storico completo, e ultime
+# operazioni registrate
+def stato_archivio(operazioni=10):
+    with connessione_storico() as conn:
+        return {
+            'attivi': _totali(conn, 'main'),
+            'archiviati': _totali(conn, SCHEMA),
+            'storico': _totali(conn, ''),
+            'operazioni': _esegui(conn, f'''
+                SELECT eseguita_il, operazione, data_da, data_a, lotti, prenotazioni
+                FROM {SCHEMA}.archiviazioni ORDER BY id DESC LIMIT :n
+            ''', {'n': operazioni}).all(),
+        }
+
+
+# True se l'utente ha prenotazioni tra quelle archiviate (che restano
+# collegate al suo id, es. per i report). Viene chiamata a ogni eliminazione
+# di un utente: se l'archivio non esiste ancora non ci sono prenotazioni
+# archiviate, e il file non viene creato aprendo la connessione
+def ha_prenotazioni_archiviate(user_id):
+    if not os.path.exists(current_app.config['ARCHIVIO_PATH']):
+        return False
+    with connessione_storico() as conn:
+        return _esegui(conn, f'SELECT 1 FROM {SCHEMA}.prenotazioni WHERE user_id = :user_id LIMIT 1',
+                       {'user_id': user_id}).first() is not None
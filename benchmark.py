@@ -0,0 +1,625 @@
+import argparse
+import http.cookiejar
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+# Benchmark riproducibili dei percorsi del catalogo e delle prenotazioni:
+#   python benchmark.py --output risultati.json [--baseline precedente.json]
+#
+# Il benchmark crea in una cartella temporanea un database con dati sintetici
+# (produttori, prodotti, lotti, utenti e prenotazioni, generati con un seed
+# fisso attraverso i modelli di models.py), poi misura ogni scenario:
+# - con il test client di Flask, nello stesso processo (latenza dell'app
+#   senza la rete), compresa la prenotazione concorrente da più thread;
+# - via HTTP, con l'app servita da werkzeug e le richieste inviate da più
+#   processi in parallelo;
+# - con alcuni micro-benchmark (serializzazione del catalogo, calcolo delle
+#   quantità disponibili, ricerca).
+# Con --scenari si misurano solo gli scenari e i micro-benchmark indicati.
+# Per ogni scenario vengono salvati p50/p95/p99 della latenza, richieste al
+# secondo e istruzioni SQL per richiesta. Con --baseline i risultati vengono
+# confrontati con quelli di un'esecuzione precedente: il comando termina con
+# codice 1 se la latenza p95 o il throughput peggiorano oltre --soglia.
+# Il rate limiting è disattivato durante il benchmark.
+#
+# Viene misurato anche l'avvio di un worker, in processi nuovi: importazione
+# dei moduli, create_app() e prima richiesta, con la memoria (RSS massima)
+# del processo al termine. I valori sono confrontati con OBIETTIVO_AVVIO_MS e
+# OBIETTIVO_MEMORIA_MB, misurati su questa app con Python 3.11 (circa 700 ms
+# e 62 MB, quasi tutti per importare Flask e SQLAlchemy) più un margine: con
+# gunicorn --preload i moduli vengono importati una volta sola nel master e
+# condivisi dai worker, che occupano solo la memoria che modificano
+
+PASSWORD_BENCHMARK = 'Benchmark<1'
+
+# Richieste di riscaldamento non misurate all'inizio di ogni scenario
+RISCALDAMENTO = 10
+
+# Obiettivi per l'avvio di un worker: millisecondi dall'inizio delle
+# importazioni alla fine della prima richiesta, e MB di memoria occupata
+OBIETTIVO_AVVIO_MS = 1000
+OBIETTIVO_MEMORIA_MB = 80
+
+# Obiettivo per la ricerca (/api/cerca): latenza p95 in millisecondi con il
+# test client, da verificare con un catalogo grande, es. 100.000 prodotti:
+#   python benchmark.py --produttori 1000 --prodotti 100 --lotti 1 --utenti 200 \
+#       --scenari api_cerca cerca_lotti --avvii 0
+OBIETTIVO_RICERCA_MS = 50
+
+# Nomi dei prodotti sintetici (seguiti da un numero) e testi cercati dallo
+# scenario 'api_cerca': parole intere, prefissi e più parole
+NOMI_PRODOTTI = ('Mele Golden', 'Pere Williams', 'Olio extravergine', 'Miele di castagno', 'Farina integrale',
+                 'Formaggio stagionato', 'Pomodori San Marzano', 'Zucchine', 'Vino rosso', 'Pane di segale')
+RICERCHE = ('mele', 'mel', 'olio extra', 'miele castagno', 'pomod', 'produttore 1', 'formaggio stag', 'vi')
+
+
+def _email(indice):
+    return f'utente{indice}@benchmark.local'
+
+
+# Scenari HTTP: ricevono 'esegui(metodo, percorso, form=None, corpo_json=None)', che
+# restituisce (stato, json della risposta o None), e un dizionario con lo
+# stato del client (utente, lotto conteso, prenotazione in corso)
+def _api_lotti(esegui, contesto):
+    return esegui('GET', '/api/lotti')
+
+
+def _api_lotti_pagina(esegui, contesto):
+    return esegui('GET', '/api/lotti?limit=50')
+
+
+def _api_prenotazioni(esegui, contesto):
+    return esegui('GET', '/api/prenotazioni')
+
+
+# Sincronizzazione incrementale: la prima richiesta scarica tutte le
+# prenotazioni, le successive solo quelle cambiate dopo la versione ricevuta
+def _api_prenotazioni_sync(esegui, contesto):
+    stato, dati = esegui('GET', f'/api/prenotazioni?since={contesto.get("versione", 0)}')
+    if stato == 200:
+        contesto['versione'] = dati['versione']
+    return stato, dati
+
+
+# Ricerca dei lotti, con un testo diverso a ogni richiesta
+def _api_cerca(esegui, contesto):
+    contesto['ricerca'] = contesto.get('ricerca', -1) + 1
+    testo = RICERCHE[contesto['ricerca'] % len(RICERCHE)]
+    return esegui('GET', '/api/cerca?' + urllib.parse.urlencode({'q': testo}))
+
+
+def _login(esegui, contesto):
+    return esegui('POST', '/login', form={'email': contesto['email'], 'password': PASSWORD_BENCHMARK})
+
+
+# Ogni client crea una prenotazione sullo stesso lotto (che non basta per
+# tutti) e la elimina alla richiesta successiva, con /api/prenotazioni/batch
+def _prenotazione_concorrente(esegui, contesto):
+    if contesto.get('prenotazione_id'):
+        operazione = {'op': 'elimina', 'id': contesto.pop('prenotazione_id')}
+    else:
+        operazione = {'op': 'crea', 'lotto_id': contesto['lotto_conteso'], 'quantita': 1}
+    stato, dati = esegui('POST', '/api/prenotazioni/batch', corpo_json={'operazioni': [operazione]})
+    if stato == 200 and operazione['op'] == 'crea':
+        contesto['prenotazione_id'] = dati['risultati'][0]['id']
+    return stato, dati
+
+
+# nome: (funzione, endpoint misurato, richiede il login, client concorrenti)
+SCENARI = {
+    'api_lotti': (_api_lotti, 'catalogo.get_lotti', False, False),
+    'api_lotti_pagina': (_api_lotti_pagina, 'catalogo.get_lotti', False, False),
+    'api_prenotazioni': (_api_prenotazioni, 'prenotazioni.get_prenotazioni', True, False),
+    'api_prenotazioni_sync': (_api_prenotazioni_sync, 'prenotazioni.get_prenotazioni', True, False),
+    'api_cerca': (_api_cerca, 'catalogo.cerca', False, False),
+    'login': (_login, 'utenti.login', False, False),
+    'prenotazione_concorrente': (_prenotazione_concorrente, 'prenotazioni.batch_prenotazioni', True, True),
+}
+
+# Micro-benchmark (vedi micro_benchmark)
+MICRO = ('query_catalogo_lotti', 'serializza_catalogo', 'to_dict_catalogo', 'get_qta_disponibili', 'cerca_lotti')
+
+
+# Crea un'app che usa i database nella cartella temporanea, senza limiti alle richieste
+def _carica_app(cartella):
+    from app import create_app
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(cartella, 'db.sqlite3'),
+        'ARCHIVIO_PATH': os.path.join(cartella, 'archivio.sqlite3'),
+        'RATELIMIT_STORAGE_URI': 'sqlite:///' + os.path.join(cartella, 'limiti.sqlite3'),
+        'RATELIMIT_ENABLED': False,
+    })
+
+
+# Genera i dati sintetici: 'produttori' produttori con 'prodotti' prodotti
+# ciascuno, 'lotti' lotti per prodotto e 'utenti' utenti con 'prenotazioni'
+# prenotazioni ciascuno su lotti diversi. La quantità di ogni lotto copre le
+# sue prenotazioni. Restituisce gli id dei lotti e il lotto conteso, che ha
+# posto per metà dei client concorrenti
+def genera_dati(produttori, prodotti, lotti, utenti, prenotazioni, concorrenza, seed):
+    from models import db, Produttore, Prodotto, Lotto, User, Prenotazione
+    from password import hash_password
+
+    casuale = random.Random(seed)
+    oggi = date.today()
+
+    produttori_id = db.session.scalars(db.insert(Produttore).returning(Produttore.id), [
+        {'nome_produttore': f'Produttore {i}', 'descrizione': f'Descrizione del produttore {i}',
+         'indirizzo': f'Via dei Campi {i}', 'telefono': f'0{i:09d}', 'email': f'produttore{i}@benchmark.local'}
+        for i in range(produttori)
+    ]).all()
+    prodotti_id = db.session.scalars(db.insert(Prodotto).returning(Prodotto.id), [
+        {'produttore_id': produttore_id, 'nome_prodotto': f'{NOMI_PRODOTTI[(produttore_id + i) % len(NOMI_PRODOTTI)]} {produttore_id}-{i}',
+         'immagine': None}
+        for produttore_id in produttori_id for i in range(prodotti)
+    ]).all()
+
+    password_hash = hash_password(PASSWORD_BENCHMARK)
+    utenti_id = db.session.scalars(db.insert(User).returning(User.id), [
+        {'nome': f'Nome{i}', 'cognome': f'Cognome{i}', 'telefono': f'3{i:09d}', 'email': _email(i),
+         'password': password_hash, 'ruolo': 'utente'}
+        for i in range(utenti)
+    ]).all()
+
+    # Prenotazioni scelte prima dei lotti, per dimensionare qta_lotto
+    numero_lotti = len(prodotti_id) * lotti
+    scelte = [(utente_id, indice, casuale.randint(1, 3))
+              for utente_id in utenti_id
+              for indice in casuale.sample(range(numero_lotti), min(prenotazioni, numero_lotti))]
+    prenotato = defaultdict(int)
+    for _, indice, qta in scelte:
+        prenotato[indice] += qta
+
+    lotti_id = db.session.scalars(db.insert(Lotto).returning(Lotto.id, sort_by_parameter_order=True), [
+        {'prodotto_id': prodotti_id[indice % len(prodotti_id)],
+         'data_consegna': oggi + timedelta(days=casuale.randint(-30, 60)),
+         'qta_unita_misura': casuale.choice(['Kg', 'L', 'pz']),
+         'qta_lotto': prenotato[indice] + casuale.randint(10, 100),
+         'prezzo_unitario': round(casuale.uniform(0.5, 30), 2),
+         'sospeso': casuale.random() < 0.05}
+        for indice in range(numero_lotti)
+    ]).all()
+    db.session.execute(db.insert(Prenotazione), [
+        {'lotto_id': lotti_id[indice], 'user_id': utente_id, 'qta': qta} for utente_id, indice, qta in scelte
+    ])
+
+    conteso = Lotto(prodotto_id=prodotti_id[0], data_consegna=oggi + timedelta(days=7), qta_unita_misura='pz',
+                    qta_lotto=max(concorrenza // 2, 1), prezzo_unitario=1.0, sospeso=False)
+    db.session.add(conteso)
+    db.session.commit()
+    return {'lotti': lotti_id, 'lotto_conteso': conteso.id, 'utenti': len(utenti_id), 'prenotazioni': len(scelte)}
+
+
+# Conta le istruzioni SQL eseguite durante le richieste, per endpoint
+class ContatoreSQL:
+    def __init__(self, app, db):
+        self._lock = threading.Lock()
+        self._richiesta = threading.local()
+        self.reset()
+        from sqlalchemy import event
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._conta)
+        app.before_request(self._inizio)
+        app.teardown_request(self._fine)
+
+    def reset(self):
+        with self._lock:
+            self.per_endpoint = defaultdict(lambda: [0, 0])  # endpoint: [richieste, istruzioni]
+
+    def _conta(self, *args, **kwargs):
+        if getattr(self._richiesta, 'istruzioni', None) is not None:
+            self._richiesta.istruzioni += 1
+
+    def _inizio(self):
+        self._richiesta.istruzioni = 0
+
+    def _fine(self, eccezione):
+        from flask import request
+        istruzioni, self._richiesta.istruzioni = self._richiesta.istruzioni, None
+        with self._lock:
+            voce = self.per_endpoint[request.endpoint]
+            voce[0] += 1
+            voce[1] += istruzioni or 0
+
+    def per_richiesta(self, endpoint):
+        richieste, istruzioni = self.per_endpoint.get(endpoint, (0, 0))
+        return round(istruzioni / richieste, 2) if richieste else None
+
+
+def _percentile(ordinate, p):
+    return ordinate[max(math.ceil(p / 100 * len(ordinate)) - 1, 0)]
+
+
+# Statistiche di uno scenario: durate delle richieste (s), durata complessiva
+# (s) e conteggio degli stati HTTP
+def statistiche(durate, secondi, stati, sql_per_richiesta=None):
+    ordinate = sorted(durate)
+    return {
+        'richieste': len(durate),
+        'p50_ms': round(_percentile(ordinate, 50) * 1000, 3),
+        'p95_ms': round(_percentile(ordinate, 95) * 1000, 3),
+        'p99_ms': round(_percentile(ordinate, 99) * 1000, 3),
+        'media_ms': round(sum(durate) / len(durate) * 1000, 3),
+        'rps': round(len(durate) / secondi, 1),
+        'sql_per_richiesta': sql_per_richiesta,
+        'stati': dict(sorted(stati.items())),
+    }
+
+
+def _esegui_client(client):
+    def esegui(metodo, percorso, form=None, corpo_json=None):
+        risposta = client.open(percorso, method=metodo, data=form, json=corpo_json)
+        return risposta.status_code, risposta.get_json(silent=True)
+    return esegui
+
+
+def _client_con_login(app, contesto):
+    client = app.test_client()
+    stato, _ = _login(_esegui_client(client), contesto)
+    if stato != 302:
+        raise RuntimeError(f'Login non riuscito per {contesto["email"]} (stato {stato})')
+    return client
+
+
+# Esegue uno scenario con il test client: 'richieste' richieste divise tra
+# 'client' thread, ognuno con il proprio utente
+def misura_client(app, contatore, nome, richieste, client, dati):
+    funzione, endpoint, con_login, concorrente = SCENARI[nome]
+    client = client if concorrente else 1
+    contesti = [{'email': _email(i), 'lotto_conteso': dati['lotto_conteso']} for i in range(client)]
+    esecutori = [_esegui_client(_client_con_login(app, c) if con_login else app.test_client()) for c in contesti]
+    for _ in range(RISCALDAMENTO):
+        funzione(esecutori[0], contesti[0])
+
+    contatore.reset()
+    durate, stati = [], defaultdict(int)
+    lock = threading.Lock()
+
+    def lavoratore(esegui, contesto, numero):
+        locali = []
+        for _ in range(numero):
+            inizio = time.perf_counter()
+            stato, _ = funzione(esegui, contesto)
+            locali.append((time.perf_counter() - inizio, stato))
+        with lock:
+            for durata, stato in locali:
+                durate.append(durata)
+                stati[str(stato)] += 1
+
+    inizio = time.perf_counter()
+    thread = [threading.Thread(target=lavoratore, args=(esegui, contesto, richieste // client))
+              for esegui, contesto in zip(esecutori, contesti)]
+    for t in thread:
+        t.start()
+    for t in thread:
+        t.join()
+    return statistiche(durate, time.perf_counter() - inizio, stati, contatore.per_richiesta(endpoint))
+
+
+# Apertura delle richieste HTTP senza seguire i redirect (es. dopo il login)
+class _SenzaRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _esegui_http(base_url):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _SenzaRedirect)
+
+    def esegui(metodo, percorso, form=None, corpo_json=None):
+        corpo, intestazioni = None, {}
+        if form is not None:
+            corpo = urllib.parse.urlencode(form).encode()
+        elif corpo_json is not None:
+            corpo, intestazioni = json.dumps(corpo_json).encode(), {'Content-Type': 'application/json'}
+        richiesta = urllib.request.Request(base_url + percorso, data=corpo, method=metodo, headers=intestazioni)
+        try:
+            with opener.open(richiesta, timeout=60) as risposta:
+                contenuto, stato = risposta.read(), risposta.status
+        except urllib.error.HTTPError as e:
+            contenuto, stato = e.read(), e.code
+        try:
+            return stato, json.loads(contenuto)
+        except ValueError:
+            return stato, None
+    return esegui
+
+
+# Processo del generatore di carico HTTP: esegue 'numero' richieste dello
+# scenario e restituisce le durate e gli stati
+def _lavoratore_http(base_url, nome, numero, contesto, partenza):
+    funzione, _, con_login, _ = SCENARI[nome]
+    esegui = _esegui_http(base_url)
+    if con_login:
+        _login(esegui, contesto)
+    for _ in range(RISCALDAMENTO // 2):
+        funzione(esegui, contesto)
+    partenza.wait()
+
+    durate, stati = [], defaultdict(int)
+    for _ in range(numero):
+        inizio = time.perf_counter()
+        try:
+            stato, _ = funzione(esegui, contesto)
+        except OSError:
+            stato = 'errore'
+        durate.append(time.perf_counter() - inizio)
+        stati[str(stato)] += 1
+    return durate, dict(stati)
+
+
+# Esegue uno scenario via HTTP con 'processi' processi che inviano le
+# richieste in parallelo all'app servita da werkzeug in questo processo
+def misura_http(base_url, contatore, nome, richieste, processi, dati):
+    contesto = multiprocessing.get_context('spawn')
+    endpoint = SCENARI[nome][1]
+    with contesto.Manager() as manager:
+        partenza = manager.Barrier(processi + 1)
+        with contesto.Pool(processi) as pool:
+            risultati = pool.starmap_async(_lavoratore_http, [
+                (base_url, nome, richieste // processi, {'email': _email(i), 'lotto_conteso': dati['lotto_conteso']}, partenza)
+                for i in range(processi)
+            ])
+            partenza.wait()
+            contatore.reset()
+            inizio = time.perf_counter()
+            risultati = risultati.get()
+            secondi = time.perf_counter() - inizio
+
+    durate, stati = [], defaultdict(int)
+    for durate_processo, stati_processo in risultati:
+        durate.extend(durate_processo)
+        for stato, numero in stati_processo.items():
+            stati[stato] += numero
+    return statistiche(durate, secondi, stati, contatore.per_richiesta(endpoint))
+
+
+# Micro-benchmark di una funzione senza richieste HTTP
+def misura_funzione(funzione, ripetizioni):
+    for _ in range(min(RISCALDAMENTO, ripetizioni)):
+        funzione()
+    durate = []
+    inizio = time.perf_counter()
+    for _ in range(ripetizioni):
+        partenza = time.perf_counter()
+        funzione()
+        durate.append(time.perf_counter() - partenza)
+    return statistiche(durate, time.perf_counter() - inizio, {})
+
+
+def micro_benchmark(app, ripetizioni, nomi):
+    from models import db, Lotto, query_catalogo_lotti, get_qta_disponibili
+    from ricerca import cerca_lotti
+    from serializzatori import serializza
+    with app.app_context():
+        lotti_id = db.session.scalars(db.select(Lotto.id)).all()
+        lotti = query_catalogo_lotti() if {'serializza_catalogo', 'to_dict_catalogo'} & set(nomi) else []
+        funzioni = {
+            'query_catalogo_lotti': query_catalogo_lotti,
+            'serializza_catalogo': lambda: [serializza(lotto) for lotto in lotti],
+            'to_dict_catalogo': lambda: [lotto.to_dict() for lotto in lotti],
+            'get_qta_disponibili': lambda: get_qta_disponibili(lotti_id),
+            'cerca_lotti': lambda: [cerca_lotti(testo) for testo in RICERCHE],
+        }
+        return {nome: misura_funzione(funzioni[nome], ripetizioni) for nome in nomi}
+
+
+# Controlla che il lotto conteso non sia stato prenotato oltre la sua quantità
+def verifica_sovraprenotazioni(app, lotto_id):
+    from models import db, Lotto
+    with app.app_context():
+        lotto = db.session.get(Lotto, lotto_id)
+        return max(lotto.qta_prenotata - lotto.qta_lotto, 0)
+
+
+# Codice eseguito in un processo nuovo per misurare l'avvio di un worker.
+# Riceve la configurazione dell'app in JSON e stampa i tempi in JSON
+_CODICE_AVVIO = '''
+import json, resource, sys, time
+inizio = time.perf_counter()
+import app
+importato = time.perf_counter()
+applicazione = app.create_app(json.loads(sys.argv[1]))
+creato = time.perf_counter()
+stato = applicazione.test_client().get('/').status_code
+fine = time.perf_counter()
+
+# Picco di memoria del processo (KiB). Su Linux ru_maxrss comprende anche la
+# memoria del processo padre prima di exec(), quindi si legge VmHWM
+def picco_kib():
+    try:
+        with open('/proc/self/status') as file:
+            for riga in file:
+                if riga.startswith('VmHWM:'):
+                    return int(riga.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+print(json.dumps({
+    'import_ms': (importato - inizio) * 1000,
+    'create_app_ms': (creato - importato) * 1000,
+    'prima_richiesta_ms': (fine - creato) * 1000,
+    'totale_ms': (fine - inizio) * 1000,
+    'rss_mb': picco_kib() / 1024,
+    'moduli': len(sys.modules),
+    'stato': stato,
+}))
+'''
+
+
+# Avvia 'ripetizioni' processi nuovi che creano l'app sul database del
+# benchmark e restituisce la mediana di ogni misura
+def misura_avvio(cartella, ripetizioni):
+    config = json.dumps({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(cartella, 'db.sqlite3'),
+        'ARCHIVIO_PATH': os.path.join(cartella, 'archivio.sqlite3'),
+        'RATELIMIT_ENABLED': False,
+    })
+    misure = []
+    for _ in range(ripetizioni):
+        uscita = subprocess.run([sys.executable, '-c', _CODICE_AVVIO, config], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+        misure.append(json.loads(uscita.strip().splitlines()[-1]))
+    avvio = {chiave: round(_percentile(sorted(m[chiave] for m in misure), 50), 1)
+             for chiave in ('import_ms', 'create_app_ms', 'prima_richiesta_ms', 'totale_ms', 'rss_mb', 'moduli')}
+    avvio['stati'] = sorted({m['stato'] for m in misure})
+    avvio['obiettivo_ms'] = OBIETTIVO_AVVIO_MS
+    avvio['obiettivo_mb'] = OBIETTIVO_MEMORIA_MB
+    return avvio
+
+
+def _commit_git():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def esegui_benchmark(parametri):
+    from werkzeug.serving import make_server
+
+    cartella = tempfile.mkdtemp(prefix='gas-benchmark-')
+    app = _carica_app(cartella)
+    from models import db, init_db
+    with app.app_context():
+        init_db()
+        dati = genera_dati(parametri.produttori, parametri.prodotti, parametri.lotti, parametri.utenti,
+                           parametri.prenotazioni, max(parametri.thread, parametri.processi), parametri.seed)
+    contatore = ContatoreSQL(app, db)
+    print(f'Dati: {len(dati["lotti"])} lotti, {dati["utenti"]} utenti, {dati["prenotazioni"]} prenotazioni')
+
+    risultati = {'client': {}, 'http': {}, 'micro': {}}
+    scenari = [nome for nome in SCENARI if nome in parametri.scenari]
+    for nome in scenari:
+        richieste = parametri.richieste_login if nome == 'login' else parametri.richieste
+        risultati['client'][nome] = misura_client(app, contatore, nome, richieste, parametri.thread, dati)
+        print(f'client {nome}: {risultati["client"][nome]}')
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    try:
+        for nome in scenari:
+            richieste = parametri.richieste_login if nome == 'login' else parametri.richieste
+            risultati['http'][nome] = misura_http(base_url, contatore, nome, richieste, parametri.processi, dati)
+            print(f'http {nome}: {risultati["http"][nome]}')
+    finally:
+        server.shutdown()
+
+    risultati['micro'] = micro_benchmark(app, parametri.ripetizioni, [n for n in MICRO if n in parametri.scenari])
+    for nome, valori in risultati['micro'].items():
+        print(f'micro {nome}: {valori}')
+
+    sovraprenotazioni = verifica_sovraprenotazioni(app, dati['lotto_conteso'])
+    avvio = misura_avvio(cartella, parametri.avvii) if parametri.avvii > 0 else None
+    print(f'avvio: {avvio}')
+    shutil.rmtree(cartella, ignore_errors=True)
+    return {
+        'meta': {
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'commit': _commit_git(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'piattaforma': platform.platform(),
+            'cpu': os.cpu_count(),
+            'parametri': vars(parametri),
+        },
+        'sovraprenotazioni': sovraprenotazioni,
+        'avvio': avvio,
+        'risultati': risultati,
+    }
+
+
+# Confronta i risultati con quelli di un'esecuzione precedente. Restituisce
+# le righe del confronto e l'elenco dei peggioramenti oltre 'soglia' (%)
+# della latenza p95 o delle richieste al secondo
+def confronta(risultati, baseline, soglia):
+    righe, peggioramenti = [], []
+    for modalita, scenari in risultati['risultati'].items():
+        for nome, valori in scenari.items():
+            precedenti = baseline.get('risultati', {}).get(modalita, {}).get(nome)
+            if not precedenti:
+                continue
+            p95 = (valori['p95_ms'] - precedenti['p95_ms']) / precedenti['p95_ms'] * 100
+            rps = (valori['rps'] - precedenti['rps']) / precedenti['rps'] * 100
+            righe.append(f'{modalita:6} {nome:26} p95 {precedenti["p95_ms"]:9.2f} -> {valori["p95_ms"]:9.2f} ms ({p95:+6.1f}%)'
+                         f'   rps {precedenti["rps"]:8.1f} -> {valori["rps"]:8.1f} ({rps:+6.1f}%)'
+                         f'   sql {precedenti["sql_per_richiesta"]} -> {valori["sql_per_richiesta"]}')
+            if p95 > soglia or -rps > soglia:
+                peggioramenti.append(f'{modalita} {nome}')
+    precedente = baseline.get('avvio')
+    if precedente and risultati['avvio']:
+        for chiave in ('totale_ms', 'rss_mb'):
+            variazione = (risultati['avvio'][chiave] - precedente[chiave]) / precedente[chiave] * 100
+            righe.append(f'avvio  {chiave:26} {precedente[chiave]:9.1f} -> {risultati["avvio"][chiave]:9.1f} ({variazione:+6.1f}%)')
+            if variazione > soglia:
+                peggioramenti.append(f'avvio {chiave}')
+    return righe, peggioramenti
+
+
+def _argomenti(argv):
+    parser = argparse.ArgumentParser(description='Benchmark del catalogo e delle prenotazioni.')
+    parser.add_argument('--produttori', type=int, default=20)
+    parser.add_argument('--prodotti', type=int, default=10, help='Prodotti per produttore.')
+    parser.add_argument('--lotti', type=int, default=5, help='Lotti per prodotto.')
+    parser.add_argument('--utenti', type=int, default=500)
+    parser.add_argument('--prenotazioni', type=int, default=10, help='Prenotazioni per utente.')
+    parser.add_argument('--richieste', type=int, default=400, help='Richieste misurate per scenario.')
+    parser.add_argument('--richieste-login', type=int, default=40, help='Richieste misurate per il login.')
+    parser.add_argument('--thread', type=int, default=8, help='Client concorrenti del test client.')
+    parser.add_argument('--processi', type=int, default=4, help='Processi del generatore di carico HTTP.')
+    parser.add_argument('--ripetizioni', type=int, default=20, help='Ripetizioni dei micro-benchmark.')
+    parser.add_argument('--avvii', type=int, default=5, help='Processi avviati per misurare l\'avvio (0 per non misurarlo).')
+    parser.add_argument('--scenari', nargs='+', choices=[*SCENARI, *MICRO], default=[*SCENARI, *MICRO],
+                        help='Scenari e micro-benchmark da misurare (default: tutti).')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark.json', help='File JSON dei risultati.')
+    parser.add_argument('--baseline', help='File JSON di un\'esecuzione precedente da confrontare.')
+    parser.add_argument('--soglia', type=float, default=10.0, help='Peggioramento massimo accettato (%%).')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    parametri = _argomenti(sys.argv[1:])
+    risultati = esegui_benchmark(parametri)
+    with open(parametri.output, 'w', encoding='utf-8') as file:
+        json.dump(risultati, file, indent=2)
+    print(f'Risultati salvati in {parametri.output}')
+    if risultati['sovraprenotazioni']:
+        print(f'ERRORE: il lotto conteso è stato prenotato oltre la quantità di {risultati["sovraprenotazioni"]}')
+        sys.exit(1)
+    avvio = risultati['avvio']
+    if avvio and (avvio['totale_ms'] > OBIETTIVO_AVVIO_MS or avvio['rss_mb'] > OBIETTIVO_MEMORIA_MB):
+        print(f'ERRORE: avvio di {avvio["totale_ms"]} ms e {avvio["rss_mb"]} MB, '
+              f'oltre l\'obiettivo di {OBIETTIVO_AVVIO_MS} ms e {OBIETTIVO_MEMORIA_MB} MB')
+        sys.exit(1)
+    ricerca = risultati['risultati']['client'].get('api_cerca', {}).get('p95_ms', 0)
+    if ricerca > OBIETTIVO_RICERCA_MS:
+        print(f'ERRORE: ricerca con p95 di {ricerca} ms, oltre l\'obiettivo di {OBIETTIVO_RICERCA_MS} ms')
+        sys.exit(1)
+
+    if parametri.baseline:
+        with open(parametri.baseline, encoding='utf-8') as file:
+            righe, peggioramenti = confronta(risultati, json.load(file), parametri.soglia)
+        print('\n'.join(righe))
+        if peggioramenti:
+            print(f'Peggioramenti oltre il {parametri.soglia}%: {", ".join(peggioramenti)}')
+            sys.exit(1)
@@ -0,0 +1,91 @@
+import hashlib
+import threading
+from datetime import date
+from flask import current_app, render_template
+from markupsafe import Markup
+from models import db, opzioni_catalogo, query_catalogo_lotti, get_versione_catalogo, Lotto, Prodotto
+from paginazione import leggi_parametri, applica_keyset, pagina
+from serializzatori import serializza, dumps
+
+# Cache in memoria del JSON di /api/lotti, una voce per ogni valore di 'order':
+#   order -> (versione del catalogo, etag, bytes del JSON)
+# e del frammento HTML con le card dei lotti della home:
+#   'html' -> (versione, html)
+# Una voce è valida finché la versione nel database non cambia, quindi ogni
+# modifica a lotti, prodotti, produttori o prenotazioni la invalida subito.
+# La cache è una per ogni app (in app.extensions): app create con database
+# diversi, es. nei test, non si scambiano i dati
+_lock = threading.Lock()
+
+
+def _cache():
+    return current_app.extensions.setdefault('cache_catalogo', {})
+
+
+# Restituisce (etag, bytes) del catalogo serializzato per l'ordinamento richiesto.
+# La versione viene letta PRIMA dei lotti: se una modifica arriva nel mezzo,
+# i dati salvati sono più recenti della versione e alla richiesta successiva
+# la voce viene comunque ricostruita
+def get_catalogo_json(order='asc'):
+    cache = _cache()
+    versione = get_versione_catalogo()
+    voce = cache.get(order)
+    if voce and voce[0] == versione:
+        return voce[1], voce[2]
+
+    lotti = query_catalogo_lotti(order)
+    body = dumps([serializza(lotto) for lotto in lotti])
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    with _lock:
+        cache[order] = (versione, etag, body)
+    return etag, body
+
+
+# Restituisce l'HTML delle card dei lotti (dal più recente), renderizzato una
+# sola volta per ogni versione del catalogo: finché nessuno modifica lotti o
+# prenotazioni, la home costa una sola query (la lettura della versione)
+def get_catalogo_html():
+    cache = _cache()
+    versione = get_versione_catalogo()
+    voce = cache.get('html')
+    if voce and voce[0] == versione:
+        return voce[1]
+
+    lotti = (Lotto.query.options(*opzioni_catalogo(con_prenotazioni=False))
+             .order_by(Lotto.data_consegna.desc(), Lotto.id.desc()).all())
+    html = Markup(render_template('includes/catalogo_lotti.html', lotti=lotti))
+    with _lock:
+        cache['html'] = (versione, html)
+    return html
+
+
+# Restituisce una pagina del catalogo (vedi /api/lotti con 'limit', 'cursor'
+# o 'fields'). Filtri opzionali nella query string:
+#   prossimi=1        solo i lotti con data di consegna da oggi in poi
+#   sospesi=0         esclude i lotti sospesi
+#   produttore_id=N   solo i lotti dei prodotti del produttore N
+def get_pagina_lotti(order, args):
+    limit, cursore, campi = leggi_parametri(args, Lotto)
+
+    con_prenotazioni = campi is None or any(c.split('.')[0] == 'rel_prenotazioni' for c in campi)
+    query = Lotto.query.options(*opzioni_catalogo(con_prenotazioni))
+
+    if args.get('prossimi') == '1':
+        query = query.filter(Lotto.data_consegna >= date.today())
+    if args.get('sospesi') == '0':
+        query = query.filter(db.or_(Lotto.sospeso.is_(False), Lotto.sospeso.is_(None)))
+    if args.get('produttore_id'):
+        try:
+            produttore_id = int(args['produttore_id'])
+        except ValueError:
+            raise ValueError('Parametro produttore_id non valido.')
+        query = query.filter(Lotto.prodotto_id.in_(
+            db.select(Prodotto.id).where(Prodotto.produttore_id == produttore_id)
+        ))
+
+    lotti = applica_keyset(query, Lotto.data_consegna, Lotto.id, order, limit, cursore).all()
+    return pagina(
+        lotti, limit,
+        chiave=lambda lotto: (lotto.data_consegna, lotto.id),
+        serializza=lambda lotto: serializza(lotto, campi),
+    )
@@ -0,0 +1,141 @@
+import os
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from archivio import archivia, ripristina, stato_archivio
+from immagini import cartella_immagini, genera_varianti, scrivi_manifest_varianti
+from importazione import importa_cartella, CHUNK_DEFAULT
+from migrazioni import verifica_piani_query
+from models import db, init_db, incrementa_versione_catalogo, Prodotto, User
+from statici import build_statici
+from viste_utenti import is_password_strong
+
+# Comandi CLI dell'app (flask --app app <comando>). Le operazioni da eseguire
+# una volta sola, come la creazione del database e degli admin, sono qui e non
+# all'avvio dell'app: creare l'app non scrive mai sul database
+
+# Comando CLI per creare le tabelle, aggiornarne lo schema, popolarle e creare
+# l'admin di default. Da eseguire al primo avvio e dopo ogni aggiornamento:
+#   flask --app app init-db
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    init_db()
+    print('Database inizializzato.')
+
+# Comando CLI che crea un admin, o rende admin un utente già registrato:
+#   flask --app app crea-admin --email mario@esempio.it
+@click.command('crea-admin')
+@click.option('--email', required=True, help='Email dell\'admin.')
+@click.option('--nome', default='Admin', show_default=True)
+@click.option('--cognome', default='', show_default=True)
+@click.option('--password', prompt=True, hide_input=True, confirmation_prompt=True,
+              help='Password (se non indicata viene chiesta).')
+@with_appcontext
+def crea_admin_command(email, nome, cognome, password):
+    user = User.query.filter_by(email=email).first()
+    if user:
+        user.ruolo = 'admin'
+        print(f'{email} è ora admin.')
+    else:
+        if not is_password_strong(password):
+            raise click.BadParameter('la password non soddisfa i requisiti di sicurezza.', param_hint='--password')
+        user = User(nome=nome, cognome=cognome, telefono='', email=email, ruolo='admin')
+        user.set_password(password)
+        db.session.add(user)
+        print(f'Admin {email} creato.')
+    db.session.commit()
+
+# Comando CLI per importare produttori, prodotti, utenti, lotti e prenotazioni
+# da una cartella di file .json, .jsonl o .csv (uno per tabella, es. lotti.csv):
+#   flask --app app importa <cartella> --chunk 1000 --processi 4
+@click.command('importa')
+@click.argument('cartella', type=click.Path(exists=True, file_okay=False))
+@click.option('--chunk', default=CHUNK_DEFAULT, show_default=True, help='Record inseriti per transazione.')
+@click.option('--processi', default=1, show_default=True, help='Processi per calcolare gli hash delle password.')
+@with_appcontext
+def importa_command(cartella, chunk, processi):
+    importa_cartella(cartella, chunk=chunk, processi=processi)
+
+# Comando CLI da eseguire al deploy: salva static/manifest.json e crea le
+# versioni compresse (.gz, .br) di CSS e JavaScript:
+#   flask --app app statici
+@click.command('statici')
+@with_appcontext
+def statici_command():
+    manifest, compressi = build_statici(current_app.static_folder)
+    print(f'Manifest di {len(manifest)} file, {compressi} file compressi creati.')
+
+# Comando CLI che genera le varianti mancanti delle immagini dei prodotti
+# (es. dopo un'importazione o per le immagini caricate prima delle varianti):
+#   flask --app app genera-varianti
+@click.command('genera-varianti')
+@with_appcontext
+def genera_varianti_command():
+    immagini = {p.immagine for p in Prodotto.query.filter(Prodotto.immagine.isnot(None))}
+    creati = 0
+    for nome in sorted(immagini):
+        if os.path.exists(os.path.join(cartella_immagini(), nome)):
+            creati += genera_varianti(nome, manifest=False)
+        else:
+            print(f'Immagine non trovata: {nome}')
+    scrivi_manifest_varianti()
+    incrementa_versione_catalogo(db.session)
+    db.session.commit()
+    print(f'Create {creati} varianti per {len(immagini)} immagini.')
+
+# Comando CLI che fallisce se una delle query più frequenti non usa un indice:
+#   flask --app app verifica-indici
+@click.command('verifica-indici')
+@with_appcontext
+def verifica_indici_command():
+    scansioni = verifica_piani_query()
+    for nome, dettaglio in scansioni.items():
+        print(f'{nome}: {dettaglio}')
+    if scansioni:
+        raise SystemExit(1)
+    print('Tutte le query critiche usano un indice.')
+
+# Comando CLI che sposta nell'archivio i lotti già consegnati e le loro
+# prenotazioni (vedi archivio.py), da eseguire periodicamente:
+#   flask --app app archivia [--prima-del 2024-01-01]
+@click.command('archivia')
+@click.option('--prima-del', type=click.DateTime(formats=['%Y-%m-%d']), help='Data di consegna limite (esclusa).')
+@with_appcontext
+def archivia_command(prima_del):
+    totali = archivia(prima_del.date() if prima_del else None)
+    print(f'Archiviati {totali.lotti} lotti e {totali.prenotazioni} prenotazioni.')
+
+# Comando CLI che riporta tra i lotti attivi i lotti archiviati nel periodo indicato:
+#   flask --app app ripristina --dal 2024-01-01 --al 2024-01-31
+@click.command('ripristina')
+@click.option('--dal', type=click.DateTime(formats=['%Y-%m-%d']), help='Prima data di consegna (compresa).')
+@click.option('--al', type=click.DateTime(formats=['%Y-%m-%d']), help='Ultima data di consegna (compresa).')
+@with_appcontext
+def ripristina_command(dal, al):
+    totali = ripristina(dal.date() if dal else None, al.date() if al else None)
+    print(f'Ripristinati {totali.lotti} lotti e {totali.prenotazioni} prenotazioni.')
+
+# Comando CLI che mostra i totali dei dati attivi e archiviati e le ultime operazioni:
+#   flask --app app stato-archivio
+@click.command('stato-archivio')
+@with_appcontext
+def stato_archivio_command():
+    stato = stato_archivio()
+    for nome in ('attivi', 'archiviati', 'storico'):
+        totali = stato[nome]
+        print(f'{nome}: {totali.lotti} lotti ({totali.qta_lotti} unità), {totali.prenotazioni} prenotazioni '
+              f'({totali.qta_prenotata} unità, {totali.importo:.2f} €)')
+    for operazione in stato['operazioni']:
+        print(f'{operazione.eseguita_il} {operazione.operazione} {operazione.data_da or ""}-{operazione.data_a or ""}: '
+              f'{operazione.lotti} lotti, {operazione.prenotazioni} prenotazioni')
+
+COMANDI = (
+    init_db_command, crea_admin_command, importa_command, statici_command, genera_varianti_command,
+    verifica_indici_command, archivia_command, ripristina_command, stato_archivio_command,
+)
+
+# Aggiunge i comandi al gruppo 'flask' dell'app
+def registra_comandi(app):
+    for comando in COMANDI:
+        app.cli.add_command(comando)
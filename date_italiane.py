@@ -0,0 +1,13 @@
+# Nomi italiani dei giorni della settimana, per formattare le date senza
+# dipendere dalla localizzazione del sistema: locale.setlocale() cambia lo
+# stato di tutto il processo (anche degli altri thread) e fallisce se la
+# locale 'it_IT' non è installata, come accade spesso nei container
+
+# Indicizzati come date.weekday(): 0 = lunedì. Minuscoli come quelli di
+# strftime('%A') con la locale it_IT, usata prima per le stesse date
+GIORNI = ('lunedì', 'martedì', 'mercoledì', 'giovedì', 'venerdì', 'sabato', 'domenica')
+
+
+# Data con il giorno della settimana, es. "giovedì 27/06/2024"
+def data_con_giorno(data):
+    return f'{GIORNI[data.weekday()]} {data.day:02d}/{data.month:02d}/{data.year}'
@@ -0,0 +1,226 @@
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy.orm import Session
+from sqlalchemy import event
+from models import db, Lotto, get_versione_catalogo
+from settings import (SSE_HEARTBEAT, SSE_CODA_MAX, SSE_MAX_CLIENT, SSE_INTERVALLO_CONTROLLO, SSE_DURATA_MAX,
+                      SSE_RICONNESSIONE)
+
+logger = logging.getLogger(__name__)
+
+# Pub/sub in memoria della disponibilità dei lotti, per /api/lotti/eventi.
+#
+# Per ogni app (in app.extensions, come la cache del catalogo) un thread
+# "osservatore" tiene un'istantanea {lotto_id: (qta_disponibile, sospeso)} e
+# la ricalcola quando cambia la versione del catalogo: subito dopo ogni commit
+# di questo processo e ogni SSE_INTERVALLO_CONTROLLO secondi per quelli degli
+# altri processi (worker gunicorn). I lotti cambiati vengono pubblicati come
+# delta compatti
+#   {"id": 3, "qta": 12, "sospeso": false}
+# nella coda di ogni client iscritto. L'osservatore termina quando non ci sono
+# più client e riparte con il primo che si iscrive.
+#
+# I client non usano il database né un thread dedicato: ogni stream attende
+# solo sulla propria coda, ma occupa per tutta la sua durata un worker (con
+# gunicorn sincrono) o un thread (-k gthread). Per questo uno stream dura al
+# massimo SSE_DURATA_MAX secondi: poi si chiude e il browser si ricollega da
+# solo dopo SSE_RICONNESSIONE secondi, ricevendo di nuovo l'istantanea. Con i
+# worker sincroni conviene GAS_SSE_MAX_CLIENT=0: lo stream risponde 503 e le
+# pagine leggono /api/lotti/disponibilita a intervalli (polling).
+# Le code hanno SSE_CODA_MAX eventi: un client troppo lento perde gli eventi
+# in coda e riceve invece l'istantanea completa
+
+_lock_stati = threading.Lock()
+
+
+# Stato del pub/sub di un'app: client iscritti, istantanea e osservatore
+class Disponibilita:
+    def __init__(self, app):
+        self.app = app
+        self.iscritti = set()
+        self.lock = threading.Lock()
+        self.lock_aggiornamento = threading.Lock()
+        self.istantanea = {}
+        self.versione = None
+        self.risveglia = threading.Event()
+        self.osservatore = None
+
+
+def _stato(app):
+    stato = app.extensions.get('disponibilita')
+    if stato is None:
+        with _lock_stati:
+            stato = app.extensions.setdefault('disponibilita', Disponibilita(app))
+    return stato
+
+
+# Client collegato allo stream: coda degli eventi (versione, delta) da inviare
+# e flag che chiede di inviare l'istantanea completa al posto dei delta persi
+class Iscrizione:
+    def __init__(self, stato):
+        self.stato = stato
+        self.coda = queue.Queue(maxsize=SSE_CODA_MAX)
+        self.da_risincronizzare = True
+
+    def invia(self, versione, delta):
+        try:
+            self.coda.put_nowait((versione, delta))
+        except queue.Full:
+            self.da_risincronizzare = True
+            while True:
+                try:
+                    self.coda.get_nowait()
+                except queue.Empty:
+                    break
+            self.coda.put_nowait(None)
+
+
+# Delta di un lotto, nel formato inviato ai client
+def _delta(lotto_id, valori):
+    if valori is None:
+        return {'id': lotto_id, 'qta': None, 'sospeso': True, 'eliminato': True}
+    qta, sospeso = valori
+    return {'id': lotto_id, 'qta': qta, 'sospeso': sospeso}
+
+
+# Disponibilità di tutti i lotti, con una sola query
+def _leggi_disponibilita():
+    righe = db.session.execute(
+        db.select(Lotto.id, Lotto.qta_lotto - Lotto.qta_prenotata, Lotto.sospeso)
+    ).all()
+    return {lotto_id: (qta, bool(sospeso)) for lotto_id, qta, sospeso in righe}
+
+
+# Ricalcola l'istantanea se la versione del catalogo è cambiata e pubblica i
+# lotti modificati a tutti gli iscritti
+def _aggiorna(stato):
+    with stato.lock_aggiornamento:
+        _aggiorna_istantanea(stato)
+
+
+def _aggiorna_istantanea(stato):
+    with stato.app.app_context():
+        try:
+            versione = get_versione_catalogo()
+            if versione == stato.versione:
+                return
+            nuova = _leggi_disponibilita()
+        finally:
+            db.session.remove()
+
+    delta = [_delta(lotto_id, nuova.get(lotto_id))
+             for lotto_id in nuova.keys() | stato.istantanea.keys()
+             if nuova.get(lotto_id) != stato.istantanea.get(lotto_id)]
+    with stato.lock:
+        stato.istantanea, stato.versione = nuova, versione
+        iscritti = list(stato.iscritti)
+    if delta:
+        for iscrizione in iscritti:
+            iscrizione.invia(versione, delta)
+
+
+def _osserva(stato):
+    while True:
+        stato.risveglia.wait(SSE_INTERVALLO_CONTROLLO)
+        stato.risveglia.clear()
+        with stato.lock:
+            if not stato.iscritti:
+                stato.osservatore = None
+                return
+        try:
+            _aggiorna(stato)
+        except Exception:
+            logger.exception('Errore durante l\'aggiornamento della disponibilità')
+
+
+# Dopo ogni commit di questo processo l'osservatore dell'app controlla subito
+# la versione del catalogo, invece di aspettare il controllo periodico
+@event.listens_for(Session, 'after_commit')
+def _dopo_commit(session):
+    if has_app_context():
+        stato = current_app.extensions.get('disponibilita')
+        if stato is not None and stato.osservatore is not None:
+            stato.risveglia.set()
+
+
+# Disponibilità di tutti i lotti per il polling: (versione del catalogo,
+# [delta, ...]). L'istantanea viene ricalcolata solo se la versione è cambiata
+def get_disponibilita(app):
+    stato = _stato(app)
+    _aggiorna(stato)
+    with stato.lock:
+        istantanea, versione = stato.istantanea, stato.versione
+    return versione, [_delta(i, v) for i, v in sorted(istantanea.items())]
+
+
+# Iscrive un nuovo client. Restituisce None se il processo ha già
+# SSE_MAX_CLIENT client collegati
+def iscrivi(app):
+    stato = _stato(app)
+    # La prima istantanea viene calcolata prima di iscrivere il client, che la
+    # riceve all'inizio dello stream invece che come delta
+    if stato.versione is None:
+        _aggiorna(stato)
+    with stato.lock:
+        if len(stato.iscritti) >= SSE_MAX_CLIENT:
+            return None
+        iscrizione = Iscrizione(stato)
+        stato.iscritti.add(iscrizione)
+        if stato.osservatore is None:
+            stato.osservatore = threading.Thread(target=_osserva, args=(stato,), daemon=True,
+                                                 name='disponibilita-lotti')
+            stato.osservatore.start()
+    return iscrizione
+
+
+def annulla_iscrizione(iscrizione):
+    with iscrizione.stato.lock:
+        iscrizione.stato.iscritti.discard(iscrizione)
+
+
+def _evento(nome, dati, versione=None):
+    testo = f'event: {nome}\n'
+    if versione is not None:
+        testo += f'id: {versione}\n'
+    return testo + f'data: {json.dumps(dati, separators=(",", ":"))}\n\n'
+
+
+# Generatore del testo dello stream SSE di un client: all'inizio (e dopo un
+# overflow della coda) l'istantanea completa, poi i delta, e un commento di
+# heartbeat ogni SSE_HEARTBEAT secondi per tenere aperta la connessione.
+# I delta già compresi nell'istantanea inviata (versione non successiva)
+# vengono scartati. Lo stream termina dopo SSE_DURATA_MAX secondi (con una
+# variazione casuale, così i client non si ricollegano tutti insieme)
+def stream_eventi(iscrizione):
+    stato = iscrizione.stato
+    scadenza = time.monotonic() + SSE_DURATA_MAX * random.uniform(0.8, 1.0)
+    versione_inviata = None
+    try:
+        yield f'retry: {SSE_RICONNESSIONE * 1000}\n\n'
+        while True:
+            if iscrizione.da_risincronizzare:
+                iscrizione.da_risincronizzare = False
+                with stato.lock:
+                    istantanea, versione_inviata = stato.istantanea, stato.versione
+                yield _evento('istantanea', [_delta(i, v) for i, v in sorted(istantanea.items())], versione_inviata)
+            rimanente = scadenza - time.monotonic()
+            if rimanente <= 0:
+                return
+            try:
+                elemento = iscrizione.coda.get(timeout=min(SSE_HEARTBEAT, rimanente))
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            if elemento is None:
+                continue
+            versione, delta = elemento
+            if versione_inviata is None or versione > versione_inviata:
+                versione_inviata = versione
+                yield _evento('disponibilita', delta, versione)
+    finally:
+        annulla_iscrizione(iscrizione)
@@ -0,0 +1,151 @@
+import math
+from collections import namedtuple
+from models import db, User, Produttore, Prodotto, Lotto
+from ricerca import filtro_prodotti
+
+# Elenchi delle pagine di amministrazione (lotti, prodotti, produttori,
+# utenti) con ricerca, ordinamento e paginazione fatti da SQLite. Ogni elenco
+# legge con una sola query soltanto le colonne mostrate, compresi i nomi
+# delle tabelle collegate (es. il nome del prodotto di un lotto), più una
+# COUNT per il numero di pagine
+
+PER_PAGINA_DEFAULT = 25
+PER_PAGINA_MAX = 100
+
+# Risultati restituiti al massimo dall'autocompletamento
+SUGGERIMENTI_MAX = 20
+
+# Definizione di un elenco:
+# - colonne: {nome: espressione} selezionate (e disponibili nel template)
+# - join: tabelle collegate da unire, come (modello, condizione)
+# - ricerca: colonne in cui cercare il testo 'q', oppure la colonna con l'id
+#   del prodotto da cercare nell'indice FTS5 (vedi ricerca.filtro_prodotti)
+# - ordinamenti: {nome nella query string: espressione}; '-nome' = decrescente
+# - ordine: ordinamento di default
+Elenco = namedtuple('Elenco', ['modello', 'colonne', 'join', 'ricerca', 'ordinamenti', 'ordine'])
+
+ELENCHI = {
+    'lotti': Elenco(
+        modello=Lotto,
+        colonne={
+            'id': Lotto.id,
+            'nome_prodotto': Prodotto.nome_prodotto,
+            'nome_produttore': Produttore.nome_produttore,
+            'data_consegna': Lotto.data_consegna,
+            'qta_lotto': Lotto.qta_lotto,
+            'qta_unita_misura': Lotto.qta_unita_misura,
+            'prezzo_unitario': Lotto.prezzo_unitario,
+            'sospeso': Lotto.sospeso,
+        },
+        join=[(Prodotto, Prodotto.id == Lotto.prodotto_id), (Produttore, Produttore.id == Prodotto.produttore_id)],
+        ricerca=Lotto.prodotto_id,
+        ordinamenti={'data': Lotto.data_consegna, 'prodotto': Prodotto.nome_prodotto,
+                     'produttore': Produttore.nome_produttore, 'prezzo': Lotto.prezzo_unitario},
+        ordine='-data',
+    ),
+    'prodotti': Elenco(
+        modello=Prodotto,
+        colonne={'id': Prodotto.id, 'nome_prodotto': Prodotto.nome_prodotto, 'nome_produttore': Produttore.nome_produttore},
+        join=[(Produttore, Produttore.id == Prodotto.produttore_id)],
+        ricerca=Prodotto.id,
+        ordinamenti={'nome': Prodotto.nome_prodotto, 'produttore': Produttore.nome_produttore},
+        ordine='nome',
+    ),
+    'produttori': Elenco(
+        modello=Produttore,
+        colonne={'id': Produttore.id, 'nome_produttore': Produttore.nome_produttore,
+                 'email': Produttore.email, 'telefono': Produttore.telefono},
+        join=[],
+        ricerca=[Produttore.nome_produttore, Produttore.email],
+        ordinamenti={'nome': Produttore.nome_produttore, 'email': Produttore.email},
+        ordine='nome',
+    ),
+    'utenti': Elenco(
+        modello=User,
+        colonne={'id': User.id, 'nome': User.nome, 'cognome': User.cognome, 'email': User.email, 'ruolo': User.ruolo},
+        join=[],
+        ricerca=[User.nome, User.cognome, User.email],
+        ordinamenti={'id': User.id, 'nome': User.nome, 'cognome': User.cognome, 'email': User.email, 'ruolo': User.ruolo},
+        ordine='cognome',
+    ),
+}
+
+# Pagina di un elenco, passata al template (vedi includes/elenco.html)
+PaginaElenco = namedtuple('PaginaElenco', ['righe', 'totale', 'pagina', 'pagine', 'per_pagina', 'q', 'ordine'])
+
+
+def _intero(valore, default, minimo, massimo):
+    try:
+        return min(max(int(valore), minimo), massimo)
+    except (TypeError, ValueError):
+        return default
+
+
+# Condizione di ricerca: ogni parola di 'q' deve comparire in almeno una delle
+# colonne (LIKE in SQLite non distingue maiuscole e minuscole). Lotti e
+# prodotti usano invece l'indice di ricerca, senza leggere tutta la tabella
+def _filtro_ricerca(colonne, q):
+    if not isinstance(colonne, list):
+        return filtro_prodotti(colonne, q)
+    condizioni = []
+    for parola in q.split():
+        modello = '%' + parola.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        condizioni.append(db.or_(*[c.like(modello, escape='\\') for c in colonne]))
+    return db.and_(*condizioni)
+
+
+# Query delle righe (ordinate) e del loro numero per l'elenco, con la ricerca 'q'
+def _query_elenco(elenco, q, ordine):
+    query = db.select(*[c.label(n) for n, c in elenco.colonne.items()]).select_from(elenco.modello)
+    conteggio = db.select(db.func.count()).select_from(elenco.modello)
+    for modello, condizione in elenco.join:
+        query = query.join(modello, condizione)
+        conteggio = conteggio.join(modello, condizione)
+    if q:
+        query = query.where(_filtro_ricerca(elenco.ricerca, q))
+        conteggio = conteggio.where(_filtro_ricerca(elenco.ricerca, q))
+
+    colonna = elenco.ordinamenti[ordine.lstrip('-')]
+    if ordine.startswith('-'):
+        query = query.order_by(colonna.desc(), elenco.modello.id.desc())
+    else:
+        query = query.order_by(colonna, elenco.modello.id)
+    return query, conteggio
+
+
+# Restituisce una pagina dell'elenco 'nome' in base ai parametri della query
+# string: q (ricerca), ordina (es. 'prodotto' o '-data'), pagina, per_pagina
+def pagina_elenco(nome, args):
+    elenco = ELENCHI[nome]
+    q = args.get('q', '').strip()
+    ordine = args.get('ordina', elenco.ordine)
+    if ordine.lstrip('-') not in elenco.ordinamenti:
+        ordine = elenco.ordine
+    per_pagina = _intero(args.get('per_pagina'), PER_PAGINA_DEFAULT, 1, PER_PAGINA_MAX)
+
+    query, conteggio = _query_elenco(elenco, q, ordine)
+    totale = db.session.scalar(conteggio)
+    pagine = max(math.ceil(totale / per_pagina), 1)
+    pagina = _intero(args.get('pagina'), 1, 1, pagine)
+    righe = db.session.execute(query.limit(per_pagina).offset((pagina - 1) * per_pagina)).all()
+
+    return PaginaElenco(righe, totale, pagina, pagine, per_pagina, q, ordine)
+
+
+# Testo mostrato nei suggerimenti dell'autocompletamento per ogni tipo
+def _testo_lotto(riga):
+    return f'{riga.nome_prodotto} - {riga.data_consegna.strftime("%d/%m/%Y")} (cod. {riga.id})'
+
+AUTOCOMPLETAMENTO = {
+    'prodotti': ('prodotti', lambda riga: riga.nome_prodotto),
+    'produttori': ('produttori', lambda riga: riga.nome_produttore),
+    'lotti': ('lotti', _testo_lotto),
+}
+
+
+# Suggerimenti per i campi con autocompletamento: [{'id': 1, 'testo': '...'}]
+def suggerimenti(tipo, q):
+    nome, testo = AUTOCOMPLETAMENTO[tipo]
+    elenco = ELENCHI[nome]
+    query, _ = _query_elenco(elenco, q.strip(), elenco.ordine)
+    return [{'id': riga.id, 'testo': testo(riga)} for riga in db.session.execute(query.limit(SUGGERIMENTI_MAX))]
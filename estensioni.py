@@ -0,0 +1,17 @@
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+import limiti  # noqa: F401  (registra lo storage 'sqlite://' per Flask-Limiter)
+
+# Estensioni create senza app e collegate da create_app() con init_app(): i
+# blueprint possono usarle nei decoratori (es. @limiter.limit) già
+# all'importazione, e ogni app creata (es. nei test) ha la sua configurazione.
+# L'istanza di SQLAlchemy ('db') è in models.py, insieme ai modelli
+
+# Limiti alle richieste. Storage, strategia e attivazione vengono letti dalla
+# configurazione dell'app (RATELIMIT_STORAGE_URI, RATELIMIT_STRATEGY,
+# RATELIMIT_ENABLED): i contatori sono in uno storage condiviso, così i limiti
+# valgono per tutti i processi insieme e non per ciascuno
+limiter = Limiter(
+    get_remote_address,
+    default_limits=["200 per day", "50 per hour"],
+)
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+from flask import current_app, g
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow è opzionale: senza, le varianti non vengono generate
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Le immagini dei prodotti sono in UPLOAD_FOLDER (configurazione dell'app,
+# relativa alla cartella dell'app se non è un percorso assoluto), le loro
+# varianti ridimensionate nella sottocartella 'varianti'
+SOTTOCARTELLA_VARIANTI = 'varianti'
+
+# Elenco delle varianti generate, nella cartella delle varianti:
+#   {"3f2a...9c": {"thumb": ["jpg", "webp"], "card": ["jpg", "webp"], ...}, ...}
+# (chiave: nome dell'immagine senza estensione). Viene riscritto da
+# genera_varianti, così varianti_immagine non controlla l'esistenza dei file
+MANIFEST_VARIANTI = 'varianti.json'
+
+# Varianti generate per ogni immagine: nome -> larghezza massima in pixel.
+# Ogni variante viene salvata sia in JPEG sia in WebP
+VARIANTI = {
+    'thumb': 200,
+    'card': 480,
+    'card2x': 960,
+}
+FORMATI = ('jpg', 'webp')
+
+# Dimensione dei blocchi letti dall'upload
+_BLOCCO = 64 * 1024
+
+# Coda delle immagini di cui generare le varianti, elaborata da un thread
+_coda = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+# Manifest delle varianti letti, per cartella: cartella -> (file letto, indice)
+_indici = {}
+
+
+def cartella_immagini():
+    return os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
+
+
+def _cartella_varianti():
+    return os.path.join(cartella_immagini(), SOTTOCARTELLA_VARIANTI)
+
+
+# Salva un file caricato (FileStorage di werkzeug) a blocchi, calcolandone
+# l'hash SHA-256. Il file prende il nome dall'hash (es. '3f2a...9c.jpg'):
+# due upload identici occupano un solo file, e un nome non cambia mai contenuto,
+# quindi può essere messo in cache dal browser senza scadenza.
+# Restituisce il nome del file, relativo alla cartella delle immagini
+def salva_upload(file, estensione):
+    cartella = cartella_immagini()
+    os.makedirs(cartella, exist_ok=True)
+    sha256 = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=cartella, delete=False) as tmp:
+        while True:
+            blocco = file.stream.read(_BLOCCO)
+            if not blocco:
+                break
+            sha256.update(blocco)
+            tmp.write(blocco)
+
+    nome = f'{sha256.hexdigest()[:32]}.{estensione.lower()}'
+    destinazione = os.path.join(cartella, nome)
+    if os.path.exists(destinazione):
+        os.remove(tmp.name)
+    else:
+        os.replace(tmp.name, destinazione)
+        os.chmod(destinazione, 0o644)
+    return nome
+
+
+def _radice(nome):
+    return os.path.splitext(os.path.basename(nome))[0]
+
+
+def _nome_variante(nome, variante, formato):
+    return f'{_radice(nome)}-{variante}.{formato}'
+
+
+# Genera (se mancanti) le varianti JPEG e WebP di un'immagine. Ogni file viene
+# scritto con un nome temporaneo e poi rinominato, quindi non viene mai
+# servito a metà. Con 'manifest' (default) il manifest delle varianti viene
+# aggiornato se sono stati creati file. Restituisce il numero di file creati
+def genera_varianti(nome, manifest=True):
+    if Image is None:
+        return 0
+    cartella = _cartella_varianti()
+    os.makedirs(cartella, exist_ok=True)
+    creati = 0
+    with Image.open(os.path.join(cartella_immagini(), nome)) as originale:
+        immagine = ImageOps.exif_transpose(originale).convert('RGB')
+        for variante, larghezza in VARIANTI.items():
+            copia = immagine.copy()
+            copia.thumbnail((larghezza, larghezza * 4))
+            for formato, opzioni in (('jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+                                     ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4})):
+                destinazione = os.path.join(cartella, _nome_variante(nome, variante, formato))
+                if os.path.exists(destinazione):
+                    continue
+                tmp = destinazione + '.tmp'
+                copia.save(tmp, **opzioni)
+                os.replace(tmp, destinazione)
+                creati += 1
+    if creati and manifest:
+        scrivi_manifest_varianti()
+    return creati
+
+
+# Varianti presenti nella cartella, nel formato di MANIFEST_VARIANTI
+def _scansiona_varianti(cartella):
+    trovate = {}
+    for voce in os.scandir(cartella):
+        radice, _, resto = voce.name.rpartition('-')
+        variante, _, formato = resto.partition('.')
+        if radice and variante in VARIANTI and formato in FORMATI:
+            trovate.setdefault(radice, {}).setdefault(variante, set()).add(formato)
+    return {radice: {variante: [f for f in FORMATI if f in formati] for variante, formati in varianti.items()}
+            for radice, varianti in trovate.items()}
+
+
+# Riscrive il manifest con tutte le varianti presenti nella cartella. Viene
+# ricostruito ogni volta dall'elenco dei file (non aggiornato aggiungendo le
+# nuove varianti): due processi che generano varianti insieme non si
+# cancellano a vicenda le voci, e 'flask genera-varianti' lo riallinea
+def scrivi_manifest_varianti():
+    cartella = _cartella_varianti()
+    os.makedirs(cartella, exist_ok=True)
+    percorso = os.path.join(cartella, MANIFEST_VARIANTI)
+    tmp = f'{percorso}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as file:
+        json.dump(_scansiona_varianti(cartella), file, sort_keys=True)
+    os.replace(tmp, percorso)
+
+
+def _firma(percorso):
+    try:
+        stat = os.stat(percorso)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+# Indice delle varianti generate, letto dal manifest. Il manifest viene
+# ricontrollato (un solo os.stat) una volta per contesto dell'app, cioè per
+# richiesta, e riletto solo se è cambiato. Senza manifest (varianti generate
+# prima del manifest) l'indice è ricavato dall'elenco dei file, una volta
+def _indice_varianti():
+    cartella = _cartella_varianti()
+    voce = _indici.get(cartella)
+    if voce is None or not g.get('varianti_controllate'):
+        g.varianti_controllate = True
+        percorso = os.path.join(cartella, MANIFEST_VARIANTI)
+        firma = _firma(percorso)
+        if voce is None or voce[0] != firma:
+            if firma is not None:
+                with open(percorso, encoding='utf-8') as file:
+                    indice = json.load(file)
+            else:
+                indice = _scansiona_varianti(cartella) if os.path.isdir(cartella) else {}
+            voce = _indici[cartella] = (firma, indice)
+    return voce[1]
+
+
+# Thread che elabora la coda. Dopo ogni immagine incrementa la versione del
+# catalogo, così /api/lotti espone subito le nuove varianti
+def _elabora_coda(app):
+    from models import db, incrementa_versione_catalogo
+    while True:
+        nome = _coda.get()
+        try:
+            with app.app_context():
+                if genera_varianti(nome):
+                    incrementa_versione_catalogo(db.session)
+                    db.session.commit()
+        except Exception:
+            logger.exception(f'Errore durante la generazione delle varianti di {nome}')
+        finally:
+            _coda.task_done()
+
+
+# Mette in coda la generazione delle varianti, da eseguire in background
+def accoda_varianti(nome, app):
+    global _worker
+    if Image is None:
+        logger.warning('Pillow non installato: varianti non generate per %s', nome)
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_elabora_coda, args=(app,), daemon=True, name='varianti-immagini')
+            _worker.start()
+    _coda.put(nome)
+
+
+# Restituisce le varianti generate di un'immagine (dal manifest, senza
+# accedere ai file), con i percorsi relativi alla cartella delle immagini
+# (come Prodotto.immagine), per costruire 'srcset' nel browser:
+#   {'originale': 'x.jpg', 'varianti': [{'nome': 'thumb', 'larghezza': 200,
+#                                         'jpg': 'varianti/x-thumb.jpg', 'webp': ...}, ...]}
+def varianti_immagine(nome):
+    if not nome:
+        return None
+    generate = _indice_varianti().get(_radice(nome), {})
+    varianti = []
+    for variante, larghezza in VARIANTI.items():
+        formati = generate.get(variante)
+        if formati:
+            varianti.append({'nome': variante, 'larghezza': larghezza,
+                             **{formato: f'{SOTTOCARTELLA_VARIANTI}/{_nome_variante(nome, variante, formato)}'
+                                for formato in formati}})
+    return {'originale': nome, 'varianti': varianti}
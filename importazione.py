@@ -0,0 +1,180 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import repeat
+from werkzeug.security import generate_password_hash
+from models import db, User, Produttore, Prodotto, Lotto, Prenotazione, incrementa_versione_catalogo
+from settings import PASSWORD_HASH_METHOD
+
+# Tabelle importabili, nell'ordine che rispetta le chiavi esterne: ogni
+# tabella viene caricata dopo quelle a cui fa riferimento
+ORDINE_IMPORTAZIONE = [
+    ('produttori', Produttore),
+    ('prodotti', Prodotto),
+    ('users', User),
+    ('lotti', Lotto),
+    ('prenotazioni', Prenotazione),
+]
+
+# Formati di file supportati, in ordine di preferenza se ce n'è più di uno
+ESTENSIONI = ('.jsonl', '.json', '.csv')
+
+# Numero di record inseriti (e confermati con un commit) per volta
+CHUNK_DEFAULT = 1000
+
+# Dimensione dei blocchi letti dai file JSON
+_BLOCCO_LETTURA = 64 * 1024
+
+
+# Legge un file JSON che contiene una lista di oggetti, restituendo un oggetto
+# alla volta senza caricare l'intero file in memoria
+def _leggi_json(file):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    inizio_lista = False
+    fine_file = False
+    while True:
+        # Salta spazi, virgole e le parentesi della lista
+        i = 0
+        while i < len(buffer) and (buffer[i] in ' \t\r\n,' or (buffer[i] == '[' and not inizio_lista)):
+            inizio_lista = inizio_lista or buffer[i] == '['
+            i += 1
+        buffer = buffer[i:]
+
+        if buffer.startswith(']'):
+            return
+        try:
+            record, fine = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if fine_file:
+                if buffer.strip():
+                    raise
+                return
+            blocco = file.read(_BLOCCO_LETTURA)
+            fine_file = not blocco
+            buffer += blocco
+            continue
+        yield record
+        buffer = buffer[fine:]
+
+
+# Legge un file JSON Lines (un oggetto per riga)
+def _leggi_jsonl(file):
+    for riga in file:
+        if riga.strip():
+            yield json.loads(riga)
+
+
+# Restituisce i record di un file .json, .jsonl o .csv uno alla volta
+def leggi_record(file_path):
+    with open(file_path, 'r', encoding='utf-8', newline='') as file:
+        if file_path.endswith('.jsonl'):
+            yield from _leggi_jsonl(file)
+        elif file_path.endswith('.json'):
+            yield from _leggi_json(file)
+        elif file_path.endswith('.csv'):
+            yield from csv.DictReader(file)
+        else:
+            raise ValueError(f'Formato non supportato: {file_path}')
+
+
+# Converte i valori di un record nei tipi delle colonne della tabella
+# (i CSV contengono solo stringhe, i JSON hanno le date come stringhe)
+def _converti_record(model, record):
+    risultato = {}
+    for colonna in model.__table__.columns:
+        if colonna.key not in record:
+            continue
+        valore = record[colonna.key]
+        if isinstance(valore, str):
+            tipo = colonna.type.python_type
+            if valore == '' and colonna.nullable:
+                valore = None
+            elif tipo is date:
+                valore = date.fromisoformat(valore)
+            elif tipo is bool:
+                valore = valore.strip().lower() in ('1', 'true', 'si', 'sì')
+            elif tipo in (int, float):
+                valore = tipo(valore)
+        risultato[colonna.key] = valore
+    return risultato
+
+
+# Divide un iterabile in liste di al massimo 'dimensione' elementi
+def _a_blocchi(iterabile, dimensione):
+    blocco = []
+    for elemento in iterabile:
+        blocco.append(elemento)
+        if len(blocco) == dimensione:
+            yield blocco
+            blocco = []
+    if blocco:
+        yield blocco
+
+
+# Importa i record di un file nella tabella di 'model'. Ogni blocco di
+# 'chunk' record viene inserito con una sola executemany e confermato con un
+# commit. Le password degli utenti vengono trasformate in hash, usando
+# 'pool' (se presente) per calcolarle su più processi
+def importa_file(model, file_path, chunk=CHUNK_DEFAULT, pool=None, log=print):
+    tabella = model.__table__
+    totale = 0
+    inizio = time.perf_counter()
+
+    for blocco in _a_blocchi(leggi_record(file_path), chunk):
+        righe = [_converti_record(model, record) for record in blocco]
+
+        if model is User:
+            password = [riga['password'] for riga in righe]
+            metodo = repeat(PASSWORD_HASH_METHOD)
+            hash_password = (pool.map(generate_password_hash, password, metodo, chunksize=16) if pool
+                             else map(generate_password_hash, password, metodo))
+            for riga, hash_pwd in zip(righe, hash_password):
+                riga['password'] = hash_pwd
+
+        db.session.execute(db.insert(tabella), righe)
+        db.session.commit()
+
+        totale += len(righe)
+        durata = time.perf_counter() - inizio
+        log(f'{tabella.name}: {totale} record ({totale / max(durata, 1e-6):.0f} record/s)')
+
+    return totale
+
+
+# Cerca nella cartella il file di una tabella (es. 'lotti.json' o 'lotti.csv')
+def _trova_file(cartella, nome_tabella):
+    for estensione in ESTENSIONI:
+        file_path = os.path.join(cartella, nome_tabella + estensione)
+        if os.path.exists(file_path):
+            return file_path
+    return None
+
+
+# Importa tutti i file presenti in 'cartella' rispettando l'ordine delle
+# chiavi esterne. 'processi' > 1 calcola gli hash delle password in parallelo.
+# Restituisce un dizionario {tabella: numero di record importati}
+def importa_cartella(cartella, chunk=CHUNK_DEFAULT, processi=1, log=print):
+    risultato = {}
+    inizio = time.perf_counter()
+    pool = ProcessPoolExecutor(processi) if processi > 1 else None
+    try:
+        for nome_tabella, model in ORDINE_IMPORTAZIONE:
+            file_path = _trova_file(cartella, nome_tabella)
+            if file_path:
+                risultato[nome_tabella] = importa_file(model, file_path, chunk, pool, log)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    # Gli inserimenti non passano dall'ORM: il catalogo va invalidato qui
+    incrementa_versione_catalogo(db.session)
+    db.session.commit()
+
+    totale = sum(risultato.values())
+    durata = time.perf_counter() - inizio
+    log(f'Importati {totale} record in {durata:.1f} s ({totale / max(durata, 1e-6):.0f} record/s)')
+    return risultato
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from limits.storage import MovingWindowSupport, Storage
+
+# Storage per Flask-Limiter salvato in un file SQLite: i contatori sono
+# condivisi da tutti i processi dell'app sullo stesso host, senza servizi
+# esterni. Si attiva con RATELIMIT_STORAGE_URI = 'sqlite:///percorso/file'
+# (stessa forma degli URI di SQLAlchemy: 'sqlite:////percorso/assoluto').
+#
+# - Finestra fissa (incr/get): una riga per chiave con valore e scadenza
+# - Finestra mobile (acquire_entry): una riga per ogni richiesta accettata,
+#   al massimo 'limit' righe per chiave
+# Le righe scadute vengono eliminate quando si accede alla chiave e, per
+# tutte le chiavi, ogni PULIZIA_OGNI operazioni: la dimensione resta limitata
+
+
+# Numero di operazioni tra una pulizia completa delle righe scadute e l'altra
+PULIZIA_OGNI = 1000
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS contatori (
+    chiave TEXT PRIMARY KEY,
+    valore INTEGER NOT NULL,
+    scadenza REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS eventi (
+    chiave TEXT NOT NULL,
+    istante REAL NOT NULL,
+    scadenza REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_eventi_chiave_istante ON eventi (chiave, istante);
+CREATE INDEX IF NOT EXISTS ix_eventi_scadenza ON eventi (scadenza);
+'''
+
+
+class SQLiteStorage(Storage, MovingWindowSupport):
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        # 'sqlite:///file' -> 'file', 'sqlite:////percorso/file' -> '/percorso/file'
+        self.percorso = uri.split('://', 1)[1][1:]
+        self.timeout = float(options.get('timeout', 5))
+        self._locale = threading.local()
+        self._operazioni = 0
+        with self._transazione() as conn:
+            for istruzione in _SCHEMA.split(';'):
+                if istruzione.strip():
+                    conn.execute(istruzione)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    # Una connessione per thread (e per processo, dopo un fork), in modalità
+    # autocommit: le transazioni vengono aperte esplicitamente con BEGIN IMMEDIATE
+    def _connessione(self):
+        conn = getattr(self._locale, 'conn', None)
+        if conn is None or self._locale.pid != os.getpid():
+            conn = sqlite3.connect(self.percorso, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._locale.conn = conn
+            self._locale.pid = os.getpid()
+        return conn
+
+    # Transazione che blocca subito le scritture degli altri processi, così
+    # la lettura del contatore e il suo aggiornamento sono atomici
+    @contextmanager
+    def _transazione(self):
+        conn = self._connessione()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    # Elimina periodicamente tutte le righe scadute
+    def _pulizia(self, conn, adesso):
+        self._operazioni += 1
+        if self._operazioni % PULIZIA_OGNI == 0:
+            conn.execute('DELETE FROM contatori WHERE scadenza <= ?', (adesso,))
+            conn.execute('DELETE FROM eventi WHERE scadenza <= ?', (adesso,))
+
+    def incr(self, key, expiry, amount=1):
+        adesso = time.time()
+        with self._transazione() as conn:
+            self._pulizia(conn, adesso)
+            riga = conn.execute('SELECT valore, scadenza FROM contatori WHERE chiave = ?', (key,)).fetchone()
+            if riga is None or riga[1] <= adesso:
+                valore, scadenza = amount, adesso + expiry
+            else:
+                valore, scadenza = riga[0] + amount, riga[1]
+            conn.execute('INSERT OR REPLACE INTO contatori (chiave, valore, scadenza) VALUES (?, ?, ?)',
+                         (key, valore, scadenza))
+            return valore
+
+    def get(self, key):
+        riga = self._connessione().execute(
+            'SELECT valore FROM contatori WHERE chiave = ? AND scadenza > ?', (key, time.time())
+        ).fetchone()
+        return riga[0] if riga else 0
+
+    def get_expiry(self, key):
+        adesso = time.time()
+        riga = self._connessione().execute(
+            'SELECT scadenza FROM contatori WHERE chiave = ? AND scadenza > ?', (key, adesso)
+        ).fetchone()
+        return riga[0] if riga else adesso
+
+    def check(self):
+        try:
+            self._connessione().execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._transazione() as conn:
+            eliminati = conn.execute('DELETE FROM contatori').rowcount
+            eliminati += conn.execute('DELETE FROM eventi').rowcount
+            return eliminati
+
+    def clear(self, key):
+        with self._transazione() as conn:
+            conn.execute('DELETE FROM contatori WHERE chiave = ?', (key,))
+            conn.execute('DELETE FROM eventi WHERE chiave = ?', (key,))
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        adesso = time.time()
+        with self._transazione() as conn:
+            self._pulizia(conn, adesso)
+            conn.execute('DELETE FROM eventi WHERE chiave = ? AND istante <= ?', (key, adesso - expiry))
+            (acquisiti,) = conn.execute('SELECT COUNT(*) FROM eventi WHERE chiave = ?', (key,)).fetchone()
+            if acquisiti + amount > limit:
+                return False
+            conn.executemany('INSERT INTO eventi (chiave, istante, scadenza) VALUES (?, ?, ?)',
+                             [(key, adesso, adesso + expiry)] * amount)
+            return True
+
+    def get_moving_window(self, key, limit, expiry):
+        adesso = time.time()
+        inizio, acquisiti = self._connessione().execute(
+            'SELECT MIN(istante), COUNT(*) FROM eventi WHERE chiave = ? AND istante > ?', (key, adesso - expiry)
+        ).fetchone()
+        return (inizio if inizio is not None else adesso), acquisiti
@@ -0,0 +1,293 @@
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import g, has_request_context, request, request_finished, request_started
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from settings import (METRICHE_SOGLIA_SQL, METRICHE_CARTELLA, PROFILER_ATTIVO, PROFILER_INTERVALLO,
+                      PROFILER_SOGLIA, PROFILER_CARTELLA)
+
+logger = logging.getLogger(__name__)
+
+# Strumentazione delle richieste, esposta in formato Prometheus su /metrics
+# (solo con GAS_METRICHE_TOKEN impostato, vedi viste_admin.metrics).
+#
+# I segnali di Flask (request_started, request_finished) misurano la durata
+# di ogni richiesta; gli eventi degli engine di SQLAlchemy contano le
+# istruzioni SQL eseguite durante la richiesta e il tempo passato nel
+# database. Una richiesta che esegue la stessa istruzione più di
+# METRICHE_SOGLIA_SQL volte (tipico di un problema N+1: una query per ogni
+# elemento di una lista) viene segnalata nel log e contata.
+#
+# Le metriche sono in memoria, per processo. Con più worker (gunicorn) ogni
+# processo salva le proprie in METRICHE_CARTELLA (se impostata) e /metrics
+# restituisce la somma di tutti i file: la cartella va svuotata all'avvio del
+# server, come fa il multiprocess mode di prometheus_client.
+#
+# Con PROFILER_ATTIVO un thread campiona ogni PROFILER_INTERVALLO secondi lo
+# stack dei thread che servono una richiesta; le richieste più lente di
+# PROFILER_SOGLIA secondi vengono salvate in PROFILER_CARTELLA nel formato
+# "collapsed" (una riga 'funzione;funzione;... campioni'), pronto per
+# flamegraph.pl o speedscope
+
+# Limiti dei bucket degli istogrammi
+BUCKET_DURATA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKET_ISTRUZIONI = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# Metriche esposte: nome -> (tipo, descrizione, etichette, bucket)
+METRICHE = {
+    'gas_richieste_total': ('counter', 'Richieste servite', ('endpoint', 'metodo', 'stato'), None),
+    'gas_richiesta_durata_secondi': ('histogram', 'Durata delle richieste', ('endpoint', 'metodo'), BUCKET_DURATA),
+    'gas_richiesta_istruzioni_sql': ('histogram', 'Istruzioni SQL per richiesta', ('endpoint', 'metodo'), BUCKET_ISTRUZIONI),
+    'gas_sql_istruzioni_total': ('counter', 'Istruzioni SQL eseguite durante le richieste', ('endpoint',), None),
+    'gas_sql_durata_secondi_total': ('counter', 'Tempo passato nel database durante le richieste', ('endpoint',), None),
+    'gas_richieste_n_piu_1_total': ('counter', 'Richieste che ripetono la stessa istruzione SQL oltre la soglia', ('endpoint',), None),
+    'gas_prenotazioni_total': ('counter', 'Esiti delle operazioni sulle prenotazioni', ('operazione', 'esito'), None),
+}
+
+# Intervallo minimo (s) tra due salvataggi delle metriche di un processo
+INTERVALLO_SALVATAGGIO = 1.0
+
+
+# Contatori e istogrammi in memoria. I valori sono indicizzati per
+# (nome, valori delle etichette); un istogramma è [conteggi dei bucket..., somma]
+class Registro:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.valori = {}
+
+    def incrementa(self, nome, etichette, valore=1):
+        chiave = (nome, tuple(etichette))
+        with self._lock:
+            self.valori[chiave] = self.valori.get(chiave, 0) + valore
+
+    def osserva(self, nome, etichette, valore):
+        limiti = METRICHE[nome][3]
+        chiave = (nome, tuple(etichette))
+        with self._lock:
+            istogramma = self.valori.get(chiave)
+            if istogramma is None:
+                istogramma = self.valori[chiave] = [0] * (len(limiti) + 2)
+            for i, limite in enumerate(limiti):
+                if valore <= limite:
+                    istogramma[i] += 1
+                    break
+            else:
+                istogramma[len(limiti)] += 1
+            istogramma[-1] += valore
+
+    def istantanea(self):
+        with self._lock:
+            return [[nome, list(etichette), valore.copy() if isinstance(valore, list) else valore]
+                    for (nome, etichette), valore in self.valori.items()]
+
+
+registro = Registro()
+
+
+def conta_prenotazione(operazione, esito):
+    registro.incrementa('gas_prenotazioni_total', (operazione, esito))
+
+
+# Stato della richiesta in corso, salvato in g
+class _Richiesta:
+    def __init__(self):
+        self.inizio = time.perf_counter()
+        self.istruzioni = Counter()
+        self.durata_sql = 0.0
+        self.campioni = Counter() if PROFILER_ATTIVO else None
+
+
+def _richiesta_corrente():
+    return g.get('_metriche') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _prima_istruzione(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _richiesta_corrente() is not None:
+        context._inizio_metriche = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _dopo_istruzione(conn, cursor, statement, parameters, context, executemany):
+    stato = _richiesta_corrente()
+    inizio = getattr(context, '_inizio_metriche', None)
+    if stato is not None and inizio is not None:
+        stato.istruzioni[statement] += 1
+        stato.durata_sql += time.perf_counter() - inizio
+
+
+def _inizio_richiesta(sender, **extra):
+    g._metriche = _Richiesta()
+    if PROFILER_ATTIVO:
+        _profiler.segui(g._metriche)
+
+
+def _fine_richiesta(sender, response, **extra):
+    stato = g.pop('_metriche', None)
+    if stato is None:
+        return
+    durata = time.perf_counter() - stato.inizio
+    endpoint = request.endpoint or 'sconosciuto'
+    istruzioni = sum(stato.istruzioni.values())
+
+    registro.incrementa('gas_richieste_total', (endpoint, request.method, str(response.status_code)))
+    registro.osserva('gas_richiesta_durata_secondi', (endpoint, request.method), durata)
+    registro.osserva('gas_richiesta_istruzioni_sql', (endpoint, request.method), istruzioni)
+    registro.incrementa('gas_sql_istruzioni_total', (endpoint,), istruzioni)
+    registro.incrementa('gas_sql_durata_secondi_total', (endpoint,), stato.durata_sql)
+
+    if stato.istruzioni:
+        istruzione, ripetizioni = stato.istruzioni.most_common(1)[0]
+        if ripetizioni > METRICHE_SOGLIA_SQL:
+            registro.incrementa('gas_richieste_n_piu_1_total', (endpoint,))
+            logger.warning('Possibile N+1 in %s %s: %d istruzioni SQL, ripetuta %d volte: %s',
+                           request.method, request.path, istruzioni, ripetizioni, ' '.join(istruzione.split())[:200])
+
+    if PROFILER_ATTIVO:
+        _profiler.smetti(stato)
+        if durata > PROFILER_SOGLIA and stato.campioni:
+            _salva_profilo(endpoint, durata, stato.campioni)
+    _salva_processo()
+
+
+# Campionatore degli stack dei thread che servono una richiesta
+class _Profiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._richieste = {}  # id del thread -> _Richiesta
+        self._thread = None
+
+    def segui(self, stato):
+        with self._lock:
+            self._richieste[threading.get_ident()] = stato
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._campiona, daemon=True, name='profiler-richieste')
+                self._thread.start()
+
+    def smetti(self, stato):
+        with self._lock:
+            if self._richieste.get(threading.get_ident()) is stato:
+                del self._richieste[threading.get_ident()]
+
+    def _campiona(self):
+        while True:
+            time.sleep(PROFILER_INTERVALLO)
+            with self._lock:
+                richieste = dict(self._richieste)
+            if not richieste:
+                continue
+            frame = sys._current_frames()
+            for id_thread, stato in richieste.items():
+                if id_thread in frame:
+                    stato.campioni[_stack(frame[id_thread])] += 1
+
+
+_profiler = _Profiler()
+
+
+# Stack di un frame dalla radice, nel formato collapsed: 'modulo:funzione;...'
+def _stack(frame):
+    funzioni = []
+    while frame is not None:
+        codice = frame.f_code
+        funzioni.append(f'{os.path.basename(codice.co_filename)}:{codice.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(funzioni))
+
+
+def _salva_profilo(endpoint, durata, campioni):
+    os.makedirs(PROFILER_CARTELLA, exist_ok=True)
+    nome = f'{time.strftime("%Y%m%d-%H%M%S")}-{endpoint}-{int(durata * 1000)}ms-{os.getpid()}.folded'
+    with open(os.path.join(PROFILER_CARTELLA, nome), 'w', encoding='utf-8') as file:
+        for stack, numero in campioni.most_common():
+            file.write(f'{stack} {numero}\n')
+    logger.info('Richiesta lenta %s (%.0f ms): profilo salvato in %s', endpoint, durata * 1000, nome)
+
+
+_ultimo_salvataggio = 0.0
+
+
+# Salva le metriche del processo in METRICHE_CARTELLA, al più una volta ogni
+# INTERVALLO_SALVATAGGIO secondi (o sempre, con 'forza')
+def _salva_processo(forza=False):
+    global _ultimo_salvataggio
+    if not METRICHE_CARTELLA or (not forza and time.monotonic() - _ultimo_salvataggio < INTERVALLO_SALVATAGGIO):
+        return
+    _ultimo_salvataggio = time.monotonic()
+    os.makedirs(METRICHE_CARTELLA, exist_ok=True)
+    percorso = os.path.join(METRICHE_CARTELLA, f'{os.getpid()}.json')
+    with open(percorso + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(registro.istantanea(), file)
+    os.replace(percorso + '.tmp', percorso)
+
+
+# Metriche di tutti i processi: {(nome, etichette): valore}
+def _metriche_complessive():
+    if not METRICHE_CARTELLA:
+        return {(nome, tuple(etichette)): valore for nome, etichette, valore in registro.istantanea()}
+    _salva_processo(forza=True)
+    somma = {}
+    for percorso in glob.glob(os.path.join(METRICHE_CARTELLA, '*.json')):
+        try:
+            with open(percorso, encoding='utf-8') as file:
+                valori = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for nome, etichette, valore in valori:
+            chiave = (nome, tuple(etichette))
+            precedente = somma.get(chiave)
+            if precedente is None:
+                somma[chiave] = valore
+            elif isinstance(valore, list):
+                somma[chiave] = [a + b for a, b in zip(precedente, valore)]
+            else:
+                somma[chiave] = precedente + valore
+    return somma
+
+
+def _escape(valore):
+    return str(valore).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etichette(nomi, valori, extra=()):
+    coppie = list(zip(nomi, valori)) + list(extra)
+    return '{' + ','.join(f'{nome}="{_escape(valore)}"' for nome, valore in coppie) + '}'
+
+
+def _numero(valore):
+    return repr(round(valore, 6)) if isinstance(valore, float) else str(valore)
+
+
+# Testo delle metriche nel formato di esposizione di Prometheus (0.0.4)
+def testo_prometheus():
+    per_nome = defaultdict(list)
+    for (nome, etichette), valore in sorted(_metriche_complessive().items()):
+        per_nome[nome].append((etichette, valore))
+
+    righe = []
+    for nome, (tipo, descrizione, nomi_etichette, limiti) in METRICHE.items():
+        righe.append(f'# HELP {nome} {descrizione}')
+        righe.append(f'# TYPE {nome} {tipo}')
+        for etichette, valore in per_nome.get(nome, []):
+            if tipo != 'histogram':
+                righe.append(f'{nome}{_etichette(nomi_etichette, etichette)} {_numero(valore)}')
+                continue
+            cumulato = 0
+            for limite, conteggio in zip(list(limiti) + ['+Inf'], valore[:-1]):
+                cumulato += conteggio
+                righe.append(f'{nome}_bucket{_etichette(nomi_etichette, etichette, [("le", limite)])} {cumulato}')
+            righe.append(f'{nome}_sum{_etichette(nomi_etichette, etichette)} {_numero(valore[-1])}')
+            righe.append(f'{nome}_count{_etichette(nomi_etichette, etichette)} {cumulato}')
+    return '\n'.join(righe) + '\n'
+
+
+# Collega la strumentazione ai segnali dell'app
+def registra_metriche(app):
+    request_started.connect(_inizio_richiesta, app)
+    request_finished.connect(_fine_richiesta, app)
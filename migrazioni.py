@@ -0,0 +1,209 @@
+from models import db
+
+# Istruzioni dei trigger della migrazione 3: incremento del contatore di un
+# utente e registrazione della versione di una prenotazione
+_INCREMENTA_VERSIONE = '''INSERT INTO versioni_prenotazioni (user_id, versione, minima) VALUES ({utente}, 1, 0)
+            ON CONFLICT (user_id) DO UPDATE SET versione = versione + 1'''
+_SEGNA_PRENOTAZIONE = '''INSERT INTO modifiche_prenotazioni (prenotazione_id, user_id, versione, eliminata)
+            SELECT {prenotazione}, {utente}, versione, {eliminata} FROM versioni_prenotazioni WHERE user_id = {utente}
+            ON CONFLICT (prenotazione_id) DO UPDATE SET versione = excluded.versione, eliminata = excluded.eliminata'''
+
+# Le stesse operazioni per tutte le prenotazioni dei lotti indicati
+_SEGNA_PRENOTAZIONI_LOTTI = '''INSERT INTO versioni_prenotazioni (user_id, versione, minima)
+            SELECT DISTINCT user_id, 1, 0 FROM prenotazioni WHERE lotto_id IN ({lotti})
+            ON CONFLICT (user_id) DO UPDATE SET versione = versione + 1;
+            INSERT INTO modifiche_prenotazioni (prenotazione_id, user_id, versione, eliminata)
+            SELECT p.id, p.user_id, v.versione, 0
+            FROM prenotazioni AS p JOIN versioni_prenotazioni AS v ON v.user_id = p.user_id
+            WHERE p.lotto_id IN ({lotti})
+            ON CONFLICT (prenotazione_id) DO UPDATE SET versione = excluded.versione, eliminata = 0;'''
+
+# Colonne dell'indice di ricerca della migrazione 4 e SELECT che le legge da
+# prodotti e produttori
+_COLONNE_RICERCA = 'nome_prodotto, nome_produttore, descrizione, indirizzo'
+_RIGHE_RICERCA = '''SELECT p.id, p.nome_prodotto, r.nome_produttore, r.descrizione, r.indirizzo
+            FROM prodotti AS p JOIN produttori AS r ON r.id = p.produttore_id WHERE {condizione}'''
+
+# Migrazioni dello schema per i database già esistenti: db.create_all() crea
+# le tabelle mancanti ma non modifica quelle esistenti. La versione dello schema
+# è salvata in PRAGMA user_version; ogni elemento della lista porta il database
+# dalla versione i alla versione i + 1
+MIGRAZIONI = [
+    # 1: indici sulle colonne usate da filtri, join e ordinamenti
+    [
+        'CREATE INDEX IF NOT EXISTS ix_lotti_data_consegna ON lotti (data_consegna)',
+        'CREATE INDEX IF NOT EXISTS ix_lotti_prodotto_id ON lotti (prodotto_id)',
+        'CREATE INDEX IF NOT EXISTS ix_prodotti_produttore_id ON prodotti (produttore_id)',
+        'CREATE INDEX IF NOT EXISTS ix_prenotazioni_user_id ON prenotazioni (user_id)',
+    ],
+    # 2: lotti e prenotazioni con AUTOINCREMENT, così gli id dei record spostati
+    # nell'archivio (vedi archivio.py) non vengono riassegnati ai nuovi record.
+    # SQLite non permette di cambiare la chiave primaria: le tabelle vengono
+    # ricreate e i dati copiati
+    [
+        '''CREATE TABLE lotti_nuova (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            prodotto_id INTEGER NOT NULL,
+            data_consegna DATE NOT NULL,
+            qta_unita_misura VARCHAR(10) NOT NULL,
+            qta_lotto INTEGER NOT NULL,
+            prezzo_unitario FLOAT NOT NULL,
+            sospeso BOOLEAN,
+            FOREIGN KEY(prodotto_id) REFERENCES prodotti (id)
+        )''',
+        'INSERT INTO lotti_nuova SELECT id, prodotto_id, data_consegna, qta_unita_misura, qta_lotto, prezzo_unitario, sospeso FROM lotti',
+        'DROP TABLE lotti',
+        'ALTER TABLE lotti_nuova RENAME TO lotti',
+        'CREATE INDEX ix_lotti_data_consegna ON lotti (data_consegna)',
+        'CREATE INDEX ix_lotti_prodotto_id ON lotti (prodotto_id)',
+        '''CREATE TABLE prenotazioni_nuova (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            lotto_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            qta INTEGER NOT NULL,
+            CONSTRAINT lotto_user_unique UNIQUE (lotto_id, user_id),
+            FOREIGN KEY(lotto_id) REFERENCES lotti (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )''',
+        'INSERT INTO prenotazioni_nuova SELECT id, lotto_id, user_id, qta FROM prenotazioni',
+        'DROP TABLE prenotazioni',
+        'ALTER TABLE prenotazioni_nuova RENAME TO prenotazioni',
+        'CREATE INDEX ix_prenotazioni_user_id ON prenotazioni (user_id)',
+    ],
+    # 3: versioni delle prenotazioni di ogni utente per la sincronizzazione
+    # incrementale (vedi prenotazioni.sincronizza). I trigger incrementano il
+    # contatore dell'utente e segnano la prenotazione con la nuova versione a
+    # ogni inserimento, modifica o eliminazione, e quando cambiano i dati del
+    # lotto o del prodotto mostrati con la prenotazione
+    [
+        '''CREATE TABLE IF NOT EXISTS versioni_prenotazioni (
+            user_id INTEGER NOT NULL PRIMARY KEY,
+            versione INTEGER NOT NULL,
+            minima INTEGER NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS modifiche_prenotazioni (
+            prenotazione_id INTEGER NOT NULL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            versione INTEGER NOT NULL,
+            eliminata BOOLEAN NOT NULL
+        )''',
+        '''CREATE INDEX IF NOT EXISTS ix_modifiche_prenotazioni_user_versione
+            ON modifiche_prenotazioni (user_id, versione)''',
+        *(f'''CREATE TRIGGER IF NOT EXISTS prenotazioni_{nome} AFTER {evento} ON prenotazioni BEGIN
+            {_INCREMENTA_VERSIONE.format(utente=f'{riga}.user_id')};
+            {_SEGNA_PRENOTAZIONE.format(prenotazione=f'{riga}.id', utente=f'{riga}.user_id', eliminata=eliminata)};
+        END''' for nome, evento, riga, eliminata in (
+            ('inserimento', 'INSERT', 'NEW', 0),
+            ('modifica', 'UPDATE OF lotto_id, qta', 'NEW', 0),
+            ('eliminazione', 'DELETE', 'OLD', 1),
+        )),
+        f'''CREATE TRIGGER IF NOT EXISTS lotti_modifica_prenotazioni
+            AFTER UPDATE OF prodotto_id, data_consegna, qta_unita_misura, prezzo_unitario ON lotti BEGIN
+            {_SEGNA_PRENOTAZIONI_LOTTI.format(lotti='NEW.id')}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS prodotti_modifica_prenotazioni
+            AFTER UPDATE OF nome_prodotto ON prodotti BEGIN
+            {_SEGNA_PRENOTAZIONI_LOTTI.format(lotti='SELECT id FROM lotti WHERE prodotto_id = NEW.id')}
+        END''',
+    ],
+    # 4: indice FTS5 per la ricerca dei prodotti (vedi ricerca.py), una riga
+    # per prodotto (rowid = id del prodotto) con il nome del prodotto e nome,
+    # descrizione e indirizzo del produttore. Maiuscole e accenti non contano
+    # ('caffe' trova 'Caffè'); gli indici dei prefissi di 2 e 3 caratteri
+    # rendono veloci le ricerche mentre si scrive. Il nome del prodotto pesa
+    # nel punteggio più del nome del produttore, e questo più del resto.
+    # I trigger tengono l'indice allineato a prodotti e produttori
+    [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS ricerca_prodotti USING fts5(
+            nome_prodotto, nome_produttore, descrizione, indirizzo,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )''',
+        """INSERT INTO ricerca_prodotti (ricerca_prodotti, rank) VALUES ('rank', 'bm25(10.0, 4.0, 1.0, 1.0)')""",
+        'DELETE FROM ricerca_prodotti',
+        f'INSERT INTO ricerca_prodotti (rowid, {_COLONNE_RICERCA}) {_RIGHE_RICERCA.format(condizione="1")}',
+        f'''CREATE TRIGGER IF NOT EXISTS prodotti_ricerca_inserimento AFTER INSERT ON prodotti BEGIN
+            INSERT INTO ricerca_prodotti (rowid, {_COLONNE_RICERCA}) {_RIGHE_RICERCA.format(condizione="p.id = NEW.id")};
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS prodotti_ricerca_modifica AFTER UPDATE OF nome_prodotto, produttore_id ON prodotti BEGIN
+            DELETE FROM ricerca_prodotti WHERE rowid = OLD.id;
+            INSERT INTO ricerca_prodotti (rowid, {_COLONNE_RICERCA}) {_RIGHE_RICERCA.format(condizione="p.id = NEW.id")};
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS prodotti_ricerca_eliminazione AFTER DELETE ON prodotti BEGIN
+            DELETE FROM ricerca_prodotti WHERE rowid = OLD.id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS produttori_ricerca_modifica
+            AFTER UPDATE OF nome_produttore, descrizione, indirizzo ON produttori BEGIN
+            UPDATE ricerca_prodotti
+            SET nome_produttore = NEW.nome_produttore, descrizione = NEW.descrizione, indirizzo = NEW.indirizzo
+            WHERE rowid IN (SELECT id FROM prodotti WHERE produttore_id = NEW.id);
+        END''',
+    ],
+]
+
+# Query più frequenti dell'app: con gli indici giusti nessuna deve leggere
+# l'intera tabella (vedi verifica_piani_query)
+QUERY_CRITICHE = {
+    'catalogo ordinato per data': 'SELECT id FROM lotti ORDER BY data_consegna, id LIMIT 50',
+    'pagina successiva del catalogo': "SELECT id FROM lotti WHERE (data_consegna, id) > ('2024-01-01', 1) ORDER BY data_consegna, id LIMIT 51",
+    'lotti di un prodotto': 'SELECT id FROM lotti WHERE prodotto_id = 1',
+    'prodotti di un produttore': 'SELECT id FROM prodotti WHERE produttore_id = 1',
+    'prenotazioni di un utente': 'SELECT id FROM prenotazioni WHERE user_id = 1',
+    'quantità prenotata di un lotto': 'SELECT sum(qta) FROM prenotazioni WHERE lotto_id = 1',
+    'ricerca dei prodotti': "SELECT rowid FROM ricerca_prodotti WHERE ricerca_prodotti MATCH 'mel*'",
+    'prenotazioni cambiate di un utente': 'SELECT prenotazione_id FROM modifiche_prenotazioni WHERE user_id = 1 AND versione > 10',
+}
+
+
+# Funzione per leggere la versione dello schema
+def get_versione_schema():
+    return db.session.execute(db.text('PRAGMA user_version')).scalar()
+
+
+# Funzione per applicare le migrazioni mancanti, una transazione per versione.
+# Ogni migrazione è eseguita sulla connessione sqlite3 in autocommit
+# (isolation_level=None) tra BEGIN IMMEDIATE e COMMIT espliciti: il modulo
+# sqlite3 non apre né chiude transazioni da solo prima delle istruzioni DDL, e
+# la nuova user_version viene scritta nella stessa transazione. Se
+# un'istruzione fallisce la migrazione viene annullata per intero e il database
+# resta alla versione precedente. La versione è riletta dopo BEGIN IMMEDIATE:
+# se nel frattempo un altro processo ha applicato la migrazione non viene
+# ripetuta. Restituisce la versione finale dello schema
+def migra():
+    connessione = db.engine.raw_connection()
+    try:
+        conn = connessione.driver_connection
+        isolamento, conn.isolation_level = conn.isolation_level, None
+        try:
+            versione = conn.execute('PRAGMA user_version').fetchone()[0]
+            for numero, istruzioni in enumerate(MIGRAZIONI[versione:], start=versione + 1):
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if conn.execute('PRAGMA user_version').fetchone()[0] >= numero:
+                        conn.execute('COMMIT')
+                        continue
+                    for istruzione in istruzioni:
+                        conn.execute(istruzione)
+                    conn.execute(f'PRAGMA user_version = {numero}')
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+                print(f'Schema aggiornato alla versione {numero}')
+            return max(conn.execute('PRAGMA user_version').fetchone()[0], len(MIGRAZIONI))
+        finally:
+            conn.isolation_level = isolamento
+    finally:
+        connessione.close()
+
+
+# Funzione per controllare con EXPLAIN QUERY PLAN che le QUERY_CRITICHE usino
+# un indice. Restituisce un dizionario {nome query: riga del piano} con le
+# query che leggono un'intera tabella ('SCAN tabella' senza 'USING ... INDEX')
+def verifica_piani_query():
+    scansioni = {}
+    for nome, sql in QUERY_CRITICHE.items():
+        for riga in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}')):
+            dettaglio = riga[-1]
+            if dettaglio.startswith('SCAN') and 'INDEX' not in dettaglio:
+                scansioni[nome] = dettaglio
+    return scansioni
@@ -1,15 +1,42 @@
 import os
-import json
-from datetime import date
-from pprint import pprint
+from flask import has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from sqlalchemy_serializer import SerializerMixin
-from sqlalchemy.orm import validates
-from werkzeug.security import generate_password_hash, check_password_hash
-from settings import BASE_DIR, DATABASE_PATH
+from sqlalchemy import event
+from sqlalchemy.orm import Session, column_property, joinedload, selectinload, undefer
+from password import hash_password, verifica_password
+from date_italiane import data_con_giorno
+from settings import BASE_DIR, SQLITE_PRAGMAS
+
+# Chiave del database in sola lettura in SQLALCHEMY_BINDS
+BIND_LETTURA = 'lettura'
+
+# Sessione che, durante le richieste GET e HEAD, esegue le SELECT sul database
+# in sola lettura (se configurato). Le scritture (flush) usano sempre il
+# database principale
+class SessioneGAS(FlaskSession):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and BIND_LETTURA in self._db.engines
+                and has_request_context() and request.method in ('GET', 'HEAD')):
+            return self._db.engines[BIND_LETTURA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
 
 # Inizializzazione dell'istanza di SQLAlchemy
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': SessioneGAS})
+
+# Funzione per applicare i PRAGMA di settings.SQLITE_PRAGMAS a ogni nuova
+# connessione dell'engine. Sulle connessioni in sola lettura il journal_mode
+# non può essere cambiato e viene saltato
+def configura_sqlite(engine, sola_lettura=False):
+    @event.listens_for(engine, 'connect')
+    def _applica_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for nome, valore in SQLITE_PRAGMAS.items():
+            if sola_lettura and nome == 'journal_mode':
+                continue
+            cursor.execute(f'PRAGMA {nome}={valore}')
+        cursor.close()
 
 # Modello per la tabella 'users'
 class User(db.Model, SerializerMixin):
@@ -22,12 +49,12 @@ class User(db.Model, SerializerMixin):
     password = db.Column(db.String(150), nullable=False)
     ruolo = db.Column(db.String(10), default='utente')  # Nuovo campo per il ruolo dell'utente (admin o utente)
 
-    @validates('password')
-    def convert_to_hash(self, key, password):
-        return generate_password_hash(password)
+    # L'hash viene calcolato una sola volta, dal servizio in password.py
+    def set_password(self, password):
+        self.password = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        return verifica_password(self.password, password)
     # Relazione con la tabella 'Prenotazione'
     rel_prenotazioni = db.relationship('Prenotazione', back_populates='rel_user')
 
@@ -52,7 +79,7 @@ class Produttore(db.Model, SerializerMixin):
 class Prodotto(db.Model, SerializerMixin):
     __tablename__ = 'prodotti'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    produttore_id = db.Column(db.Integer, db.ForeignKey('produttori.id'), nullable=False)
+    produttore_id = db.Column(db.Integer, db.ForeignKey('produttori.id'), nullable=False, index=True)
     nome_prodotto = db.Column(db.String(50), nullable=False)
     immagine = db.Column(db.String(255))  # Nuovo campo per l'URL dell'immagine
     
@@ -69,22 +96,32 @@ class Prodotto(db.Model, SerializerMixin):
     # che provocano la ricorsione!
     # serialize_only = ('nome_prodotto', 'rel_produttore')
 
+    # Varianti ridimensionate (JPEG e WebP) dell'immagine, per 'srcset' nei
+    # template (vedi includes/catalogo_lotti.html). Non fa parte di to_dict()
+    # e delle API: legge il manifest delle varianti e richiede l'app
+    def get_immagini(self):
+        from immagini import varianti_immagine
+        return varianti_immagine(self.immagine)
+
 # Modello per la tabella 'lotti'
 class Lotto(db.Model, SerializerMixin):
     __tablename__ = 'lotti'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    prodotto_id = db.Column(db.Integer, db.ForeignKey('prodotti.id'), nullable=False)
-    data_consegna = db.Column(db.Date, nullable=False)
+    prodotto_id = db.Column(db.Integer, db.ForeignKey('prodotti.id'), nullable=False, index=True)
+    data_consegna = db.Column(db.Date, nullable=False, index=True)
     qta_unita_misura = db.Column(db.String(10), nullable=False)
     qta_lotto = db.Column(db.Integer, nullable=False)
     prezzo_unitario = db.Column(db.Float, nullable=False)
     sospeso = db.Column(db.Boolean, default=False)
+
+    # Gli id non vengono mai riassegnati, anche dopo l'archiviazione (vedi archivio.py)
+    __table_args__ = {'sqlite_autoincrement': True}
     
      # Relazione con le tabelle 'Prodotto' e 'Prenotazione'
     rel_prodotto = db.relationship('Prodotto', back_populates='rel_lotti')
     rel_prenotazioni = db.relationship('Prenotazione', back_populates='rel_lotto')
 
-    serialize_rules = ('-rel_prodotto.rel_lotti', '-rel_prenotazioni.rel_lotto', 'get_date', 'get_prezzo_str', 'get_qta_disponibile')
+    serialize_rules = ('-rel_prodotto.rel_lotti', '-rel_prenotazioni.rel_lotto', '-qta_prenotata', 'get_date', 'get_prezzo_str', 'get_qta_disponibile')
 
     # serialize_only = (
     #     'data_consegna',
@@ -100,27 +137,24 @@ class Lotto(db.Model, SerializerMixin):
 
      # Funzione per ottenere la quantità disponibile del lotto
     def get_date(self):
-        res_data = self.data_consegna.strftime('%A %d/%m/%Y')
-        return res_data  # es. "Giovedì 27/06/2024"
+        return data_con_giorno(self.data_consegna)  # es. "giovedì 27/06/2024"
 
     # Funzione per ottenere il prezzo come stringa formattata
     def get_prezzo_str(self):
         return f'{self.prezzo_unitario} €/{self.qta_unita_misura}'  # es. "8.50 €/L"
 
      # Funzione per ottenere la data di consegna come stringa formattata
+    # La somma delle prenotazioni è calcolata da SQLite (vedi 'qta_prenotata'),
+    # senza caricare in sessione le singole prenotazioni del lotto
     def get_qta_disponibile(self):
-        qta_prenotata = 0
-        for prenot in self.rel_prenotazioni:
-            qta_prenotata += prenot.qta
-        
-        return self.qta_lotto - qta_prenotata
+        return self.qta_lotto - self.qta_prenotata
 
 # Modello per la tabella 'prenotazioni'
 class Prenotazione(db.Model, SerializerMixin):
     __tablename__ = 'prenotazioni'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     lotto_id = db.Column(db.Integer, db.ForeignKey('lotti.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     qta = db.Column(db.Integer, nullable=False)
 
     # Relazione con le tabelle 'User' e 'Lotto'
@@ -133,50 +167,133 @@ class Prenotazione(db.Model, SerializerMixin):
     # user_id e lotto_id
     __table_args__ = (
         db.UniqueConstraint('lotto_id', 'user_id', name='lotto_user_unique'),
+        {'sqlite_autoincrement': True},
+    )
+
+# Modello per la tabella 'versione_catalogo': una sola riga con un contatore
+# incrementato a ogni modifica di lotti, prodotti, produttori o prenotazioni.
+# Sta nel database, quindi è condiviso da tutti i processi dell'app
+class VersioneCatalogo(db.Model):
+    __tablename__ = 'versione_catalogo'
+    id = db.Column(db.Integer, primary_key=True)
+    versione = db.Column(db.Integer, nullable=False, default=0)
+
+# Modelli per la sincronizzazione incrementale delle prenotazioni di un
+# utente (vedi prenotazioni.sincronizza). Sono aggiornati solo dai trigger di
+# SQLite creati in migrazioni.py, qualunque sia la strada della modifica
+# (ORM, istruzioni in blocco, archiviazione):
+# - 'versioni_prenotazioni': contatore delle modifiche di ciascun utente, e
+#   versione minima da cui è ancora possibile un aggiornamento incrementale
+# - 'modifiche_prenotazioni': versione dell'ultima modifica di ogni
+#   prenotazione, comprese quelle eliminate
+class VersionePrenotazioni(db.Model):
+    __tablename__ = 'versioni_prenotazioni'
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    versione = db.Column(db.Integer, nullable=False, default=0)
+    minima = db.Column(db.Integer, nullable=False, default=0)
+
+class ModificaPrenotazione(db.Model):
+    __tablename__ = 'modifiche_prenotazioni'
+    prenotazione_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    versione = db.Column(db.Integer, nullable=False)
+    eliminata = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (
+        db.Index('ix_modifiche_prenotazioni_user_versione', 'user_id', 'versione'),
     )
 
+# Funzione per leggere la versione corrente del catalogo
+def get_versione_catalogo():
+    return db.session.execute(db.select(VersioneCatalogo.versione).where(VersioneCatalogo.id == 1)).scalar() or 0
+
+# Funzione per incrementare la versione del catalogo, nella stessa transazione
+# della modifica. Accetta una Session o una Connection
+def incrementa_versione_catalogo(conn):
+    query = db.update(VersioneCatalogo).where(VersioneCatalogo.id == 1).values(versione=VersioneCatalogo.versione + 1)
+    if conn.execute(query).rowcount == 0:
+        conn.execute(db.insert(VersioneCatalogo).values(id=1, versione=1))
+
+# Modelli che compongono il catalogo pubblico (/api/lotti)
+MODELLI_CATALOGO = (Lotto, Prodotto, Produttore, Prenotazione)
+
+# Listener: se il flush scrive un oggetto del catalogo, incrementa la versione
+@event.listens_for(Session, 'after_flush')
+def _incrementa_versione_dopo_flush(session, flush_context):
+    modificati = list(session.new) + list(session.deleted) + [o for o in session.dirty if session.is_modified(o)]
+    if any(isinstance(obj, MODELLI_CATALOGO) for obj in modificati):
+        incrementa_versione_catalogo(session.connection())
+
+# Quantità prenotata di ciascun lotto, calcolata con una SUM sulle prenotazioni.
+# È 'deferred': viene letta con una query solo quando serve, oppure insieme al
+# lotto se la query usa undefer(Lotto.qta_prenotata)
+Lotto.qta_prenotata = column_property(
+    db.select(db.func.coalesce(db.func.sum(Prenotazione.qta), 0))
+    .where(Prenotazione.lotto_id == Lotto.id)
+    .correlate_except(Prenotazione)
+    .scalar_subquery(),
+    deferred=True,
+)
+
+# Funzione per ottenere la quantità disponibile di più lotti con una sola query.
+# Restituisce un dizionario {id_lotto: quantità disponibile}
+def get_qta_disponibili(lotto_ids):
+    query = (
+        db.select(Lotto.id, Lotto.qta_lotto - db.func.coalesce(db.func.sum(Prenotazione.qta), 0))
+        .outerjoin(Prenotazione, Prenotazione.lotto_id == Lotto.id)
+        .where(Lotto.id.in_(lotto_ids))
+        .group_by(Lotto.id)
+    )
+    return dict(db.session.execute(query).all())
+
+# Opzioni di caricamento dei lotti del catalogo: prodotto e produttore vengono
+# caricati con una JOIN, la quantità prenotata con una subquery nella stessa
+# SELECT e, se richieste, le prenotazioni (con i relativi utenti) con una sola
+# SELECT ... IN. Il numero di query resta fisso qualunque sia il numero dei lotti
+def opzioni_catalogo(con_prenotazioni=True):
+    opzioni = [
+        joinedload(Lotto.rel_prodotto).joinedload(Prodotto.rel_produttore),
+        undefer(Lotto.qta_prenotata),
+    ]
+    if con_prenotazioni:
+        opzioni.append(selectinload(Lotto.rel_prenotazioni).joinedload(Prenotazione.rel_user))
+    return opzioni
+
+# Funzione per ottenere tutti i lotti del catalogo con un numero fisso di query
+def query_catalogo_lotti(order='asc'):
+    ordinamento = Lotto.data_consegna.desc() if order == 'desc' else Lotto.data_consegna
+    return Lotto.query.options(*opzioni_catalogo()).order_by(ordinamento).all()
+
 # Funzione per inizializzare il database
 def init_db():
-    # Crea le tabelle solo se non esistono già
-    db.create_all()
+    # Crea le tabelle solo se non esistono già (solo sul database principale)
+    db.create_all(bind_key=None)
+
+    # Aggiorna lo schema dei database già esistenti (es. nuovi indici)
+    from migrazioni import migra
+    migra()
 
-    # Popolo le tabelle con i dati se non esiste un record in User
+    # Popolo le tabelle con i dati dei file json se non esiste un record in User.
+    # L'importazione rispetta l'ordine delle chiavi esterne (vedi importazione.py)
     if User.query.first() is None:
-        # Creo una lista con i nomi dei file json e i modelli corrispondenti
-        # in modo da sapere in quale tabella devono essere inseriti i dati di
-        # ciascun file json
-        json_files = [
-            ('lotti.json', Lotto),
-            ('prenotazioni.json', Prenotazione),
-            ('prodotti.json', Prodotto),
-            ('produttori.json', Produttore),
-            ('users.json', User),
-        ]
-
-        # Itero a coppie il nome del file json e il modello corrispondente
-        for filename, model in json_files:
-            # Compone il path al file json
-            file_path = os.path.join(BASE_DIR, 'database', 'data_json', filename)
-
-            # Apro il file json in lettura
-            with open(file_path, 'r') as file:
-                # Leggo il contenuto del file json e ottengo una lista di dizionari
-                lista_record = json.load(file)
-
-            # Itero la lista di dizionari
-            for record_dict in lista_record:
-                # Se la chiave 'data_consegna' è presente nel dizionario
-                if 'data_consegna' in record_dict:
-                    # Converto il valore della 'data_consegna' in un oggetto date
-                    var_data_consegna = date.fromisoformat(record_dict['data_consegna'])
-                    record_dict['data_consegna'] = var_data_consegna
-
-                # Creo un nuovo record del modello corrispondente
-                new_record = model(**record_dict)
-                # Aggiungo il record alla sessione
-                db.session.add(new_record)
-        
-        # Eseguo il commit della sessione per scrivere i dati nel database
+        from importazione import importa_cartella
+        importa_cartella(os.path.join(BASE_DIR, 'database', 'data_json'), log=lambda messaggio: None)
+
+    create_default_admin()
+
+# Funzione per creare un admin di default se non esiste. Viene eseguita una
+# sola volta all'avvio (init_db), non a ogni richiesta
+def create_default_admin():
+    if not User.query.filter_by(email='admin@admin.com').first():
+        default_admin = User(
+            nome='Admin',
+            cognome='Default',
+            telefono='0000000000',
+            email='admin@admin.com',
+            ruolo='admin'
+        )
+        default_admin.set_password('Ciotola<1')
+        db.session.add(default_admin)
         db.session.commit()
 
 if __name__ == '__main__':
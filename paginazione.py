@@ -0,0 +1,93 @@
+import base64
+from datetime import date
+from sqlalchemy import inspect, tuple_
+from serializzatori import metodi_serializzati
+
+# Numero di elementi per pagina se non indicato con 'limit', e massimo consentito
+LIMIT_DEFAULT = 50
+LIMIT_MAX = 200
+
+# Parametri della query string che attivano la risposta paginata delle API
+PARAMETRI_PAGINA = {'limit', 'cursor', 'fields'}
+
+# Campi che non devono mai comparire in una proiezione
+CAMPI_ESCLUSI = {'password', 'qta_prenotata'}
+
+
+# Il cursore è la coppia (data_consegna, id) dell'ultimo elemento restituito,
+# codificata in base64 per poterla passare nella query string
+def codifica_cursore(data_consegna, id):
+    testo = f'{data_consegna.isoformat()}|{id}'
+    return base64.urlsafe_b64encode(testo.encode()).decode()
+
+def decodifica_cursore(cursore):
+    try:
+        data_str, id_str = base64.urlsafe_b64decode(cursore.encode()).decode().split('|')
+        return date.fromisoformat(data_str), int(id_str)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Parametro cursor non valido.')
+
+
+# Controlla che ogni campo di 'fields' (es. 'rel_prodotto.nome_prodotto')
+# esista nel modello: le relazioni possono essere attraversate con il punto,
+# colonne e metodi devono essere l'ultimo elemento. Sono ammessi solo i
+# metodi elencati nelle serialize_rules (es. 'get_date'), mai altri attributi
+# della classe (es. 'to_dict' o 'check_password')
+def valida_campi(model, campi):
+    for campo in campi:
+        mapper = inspect(model)
+        parti = campo.split('.')
+        for i, parte in enumerate(parti):
+            ultima = i == len(parti) - 1
+            if parte in CAMPI_ESCLUSI:
+                raise ValueError(f'Campo non valido: {campo}')
+            if parte in mapper.relationships:
+                mapper = mapper.relationships[parte].mapper
+            elif ultima and (parte in mapper.column_attrs or parte in metodi_serializzati(mapper.class_)):
+                pass
+            else:
+                raise ValueError(f'Campo non valido: {campo}')
+
+
+# Legge dalla query string i parametri comuni di paginazione e proiezione.
+# Restituisce (limit, cursore decodificato o None, tupla dei campi o None)
+def leggi_parametri(args, model):
+    try:
+        limit = int(args.get('limit', LIMIT_DEFAULT))
+    except ValueError:
+        raise ValueError('Parametro limit non valido.')
+    if limit < 1 or limit > LIMIT_MAX:
+        raise ValueError(f'Il parametro limit deve essere compreso tra 1 e {LIMIT_MAX}.')
+
+    cursore = decodifica_cursore(args['cursor']) if args.get('cursor') else None
+
+    campi = None
+    if args.get('fields'):
+        campi = tuple(c.strip() for c in args['fields'].split(',') if c.strip())
+        valida_campi(model, campi)
+
+    return limit, cursore, campi
+
+
+# Applica a 'query' l'ordinamento sulla coppia (col_data, col_id) e la
+# condizione di keyset a partire dal cursore. Viene chiesto un elemento in
+# più del limite per sapere se esiste una pagina successiva
+def applica_keyset(query, col_data, col_id, order, limit, cursore):
+    if cursore:
+        chiave = tuple_(col_data, col_id)
+        query = query.filter(chiave < cursore if order == 'desc' else chiave > cursore)
+    if order == 'desc':
+        query = query.order_by(col_data.desc(), col_id.desc())
+    else:
+        query = query.order_by(col_data, col_id)
+    return query.limit(limit + 1)
+
+
+# Costruisce il corpo della risposta paginata. 'chiave' restituisce la coppia
+# (data_consegna, id) di un elemento, usata per il cursore della pagina successiva
+def pagina(elementi, limit, chiave, serializza):
+    next_cursor = codifica_cursore(*chiave(elementi[limit - 1])) if len(elementi) > limit else None
+    return {
+        'items': [serializza(e) for e in elementi[:limit]],
+        'next_cursor': next_cursor,
+    }
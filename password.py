@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import check_password_hash, generate_password_hash
+from settings import PASSWORD_HASH_METHOD, PASSWORD_PROCESSI, PASSWORD_CODA_PER_PROCESSO
+
+# Servizio per gli hash delle password: è l'unico punto dell'app che li
+# calcola e li verifica (l'importazione in blocco usa un proprio pool, vedi
+# importazione.py). Il calcolo (volutamente lento) avviene in un pool di
+# processi limitato, così non occupa i worker che servono le richieste
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# Limita le richieste in attesa: oltre il limite i thread aspettano qui
+_posti = threading.BoundedSemaphore(max(PASSWORD_PROCESSI, 1) * PASSWORD_CODA_PER_PROCESSO)
+
+
+# Restituisce il pool del processo corrente. Viene creato alla prima
+# richiesta, e ricreato se il processo è stato duplicato con fork (es. worker
+# gunicorn). Il pool viene creato da un thread che serve una richiesta mentre
+# altri thread possono tenere dei lock: i processi del pool non sono copie di
+# questo processo (fork) ma partono dal forkserver, o da zero dove non esiste
+def _get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(PASSWORD_PROCESSI, mp_context=multiprocessing.get_context(metodo))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+# Esegue funzione(*args) nel pool, o direttamente se il pool è disattivato
+def _esegui(funzione, *args):
+    if PASSWORD_PROCESSI <= 0:
+        return funzione(*args)
+    with _posti:
+        return _get_pool().submit(funzione, *args).result()
+
+
+# Restituisce l'hash della password (un solo hash per ogni scrittura). Il
+# metodo viene passato dal processo chiamante, che è quello configurato
+def hash_password(password):
+    return _esegui(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+# Verifica la password rispetto all'hash salvato
+def verifica_password(password_hash, password):
+    return _esegui(check_password_hash, password_hash, password)
+
+
+# True se l'hash è stato calcolato con parametri diversi da quelli attuali
+# (l'hash di werkzeug inizia con il metodo, es. 'scrypt:32768:8:1$salt$...')
+def richiede_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != PASSWORD_HASH_METHOD
+
+
+# Misura latenza e throughput degli hash con i parametri configurati:
+#   python password.py [numero di hash]
+if __name__ == '__main__':
+    import sys
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    hash_password('riscaldamento')
+
+    inizio = time.perf_counter()
+    generate_password_hash('password', method=PASSWORD_HASH_METHOD)
+    latenza = time.perf_counter() - inizio
+
+    inizio = time.perf_counter()
+    with ThreadPoolExecutor(max(PASSWORD_PROCESSI, 1) * 2) as richieste:
+        list(richieste.map(hash_password, ['password'] * n))
+    durata = time.perf_counter() - inizio
+
+    print(f'Metodo: {PASSWORD_HASH_METHOD}, processi: {PASSWORD_PROCESSI}')
+    print(f'Latenza di un hash: {latenza * 1000:.0f} ms')
+    print(f'Throughput: {n / durata:.1f} hash/s ({n} hash in {durata:.1f} s)')
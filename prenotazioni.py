@@ -0,0 +1,348 @@
+import random
+import time
+from collections import namedtuple
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import aliased
+from models import (db, Lotto, Prodotto, Prenotazione, VersionePrenotazioni, ModificaPrenotazione,
+                    get_qta_disponibili, incrementa_versione_catalogo)
+from metriche import conta_prenotazione
+
+# Esiti possibili di una prenotazione
+ESITO_OK = 'ok'
+ESITO_ESAURITO = 'esaurito'          # la quantità richiesta supera quella disponibile
+ESITO_NON_VALIDA = 'non_valida'      # quantità minore di 1
+ESITO_DUPLICATA = 'duplicata'        # l'utente ha già una prenotazione per il lotto
+ESITO_NON_TROVATA = 'non_trovata'    # lotto o prenotazione inesistente (o di un altro utente)
+ESITO_NON_ESEGUITA = 'non_eseguita'  # operazione valida di un batch annullato da un'altra operazione
+
+# Operazioni accettate da esegui_batch e numero massimo di operazioni per batch
+OPERAZIONI_BATCH = ('crea', 'modifica', 'elimina')
+BATCH_MAX = 100
+
+# Risultato restituito dalle funzioni del modulo. 'qta_disponibile' è la
+# quantità che l'utente può ancora prenotare sul lotto
+Esito = namedtuple('Esito', ['stato', 'prenotazione_id', 'qta_disponibile'])
+
+# Numero massimo di tentativi quando SQLite risponde "database is locked"
+MAX_TENTATIVI = 20
+
+
+# Esegue 'operazione' in una transazione, ripetendola se il database è bloccato
+# da un'altra scrittura. SQLite serializza le scritture: ogni istruzione di
+# scrittura vede sempre i dati aggiornati, oppure fallisce e viene ripetuta.
+# 'da_confermare' decide dal risultato se fare commit o rollback.
+# Se l'inserimento viola il vincolo (lotto, utente), perché un'altra richiesta
+# ha appena creato la stessa prenotazione, la transazione viene annullata e
+# viene restituito il risultato di 'su_duplicato'
+def _con_retry(operazione, da_confermare=lambda esito: esito.stato == ESITO_OK,
+               su_duplicato=lambda: Esito(ESITO_DUPLICATA, None, None)):
+    for tentativo in range(MAX_TENTATIVI):
+        try:
+            esito = operazione()
+            if da_confermare(esito):
+                db.session.commit()
+            else:
+                db.session.rollback()
+            return esito
+        except IntegrityError:
+            db.session.rollback()
+            return su_duplicato()
+        except OperationalError as e:
+            db.session.rollback()
+            if 'locked' not in str(e) or tentativo == MAX_TENTATIVI - 1:
+                raise
+            time.sleep(random.uniform(0, 0.01 * (tentativo + 1)))
+
+
+# Crea una prenotazione solo se il lotto ha ancora la quantità richiesta.
+# Il controllo e l'inserimento sono una sola istruzione INSERT ... SELECT,
+# quindi due richieste concorrenti non possono superare qta_lotto
+def prenota(lotto_id, user_id, qta):
+    if qta < 1:
+        return Esito(ESITO_NON_VALIDA, None, None)
+
+    def operazione():
+        disponibile = Lotto.qta_lotto - Lotto.qta_prenotata
+        query = db.insert(Prenotazione).from_select(
+            ['lotto_id', 'user_id', 'qta'],
+            db.select(db.literal(lotto_id), db.literal(user_id), db.literal(qta))
+            .where(Lotto.id == lotto_id, disponibile >= qta),
+        )
+        result = db.session.execute(query)
+        if result.rowcount == 1:
+            incrementa_versione_catalogo(db.session)
+            return Esito(ESITO_OK, result.lastrowid, None)
+
+        qta_disponibile = get_qta_disponibili([lotto_id]).get(lotto_id)
+        if qta_disponibile is None:
+            return Esito(ESITO_NON_TROVATA, None, None)
+        return Esito(ESITO_ESAURITO, None, qta_disponibile)
+
+    esito = _con_retry(operazione)
+    conta_prenotazione('crea', esito.stato)
+    if esito.stato == ESITO_OK:
+        esito = esito._replace(qta_disponibile=get_qta_disponibili([lotto_id])[lotto_id])
+    return esito
+
+
+# Modifica la quantità di una prenotazione dell'utente. La nuova quantità
+# viene confrontata, nella stessa istruzione UPDATE, con la quantità del lotto
+# meno le prenotazioni degli altri utenti
+def modifica(prenotazione_id, user_id, qta):
+    altre = aliased(Prenotazione)
+
+    def operazione():
+        qta_altri = (
+            db.select(db.func.coalesce(db.func.sum(altre.qta), 0))
+            .where(altre.lotto_id == Prenotazione.lotto_id, altre.id != Prenotazione.id)
+            .scalar_subquery()
+        )
+        qta_lotto = db.select(Lotto.qta_lotto).where(Lotto.id == Prenotazione.lotto_id).scalar_subquery()
+        query = (
+            db.update(Prenotazione)
+            .where(
+                Prenotazione.id == prenotazione_id,
+                Prenotazione.user_id == user_id,
+                qta_lotto - qta_altri >= qta,
+            )
+            .values(qta=qta)
+            .execution_options(synchronize_session=False)
+        )
+        if qta >= 1 and db.session.execute(query).rowcount == 1:
+            incrementa_versione_catalogo(db.session)
+            return Esito(ESITO_OK, prenotazione_id, None)
+
+        prenotazione = db.session.get(Prenotazione, prenotazione_id)
+        if not prenotazione or prenotazione.user_id != user_id:
+            return Esito(ESITO_NON_TROVATA, prenotazione_id, None)
+        massimo = get_qta_disponibili([prenotazione.lotto_id])[prenotazione.lotto_id] + prenotazione.qta
+        return Esito(ESITO_NON_VALIDA if qta < 1 else ESITO_ESAURITO, prenotazione_id, massimo)
+
+    esito = _con_retry(operazione)
+    conta_prenotazione('modifica', esito.stato)
+    if esito.stato == ESITO_OK:
+        prenotazione = db.session.get(Prenotazione, prenotazione_id)
+        massimo = get_qta_disponibili([prenotazione.lotto_id])[prenotazione.lotto_id] + prenotazione.qta
+        esito = esito._replace(qta_disponibile=massimo)
+    return esito
+
+
+# Id e quantità delle operazioni del batch arrivano dal JSON del client:
+# sono validi solo gli interi (non i booleani, che in Python sono interi)
+def _intero(valore):
+    return isinstance(valore, int) and not isinstance(valore, bool)
+
+
+# Valida una operazione del batch ({'op': 'crea', 'lotto_id': 3, 'quantita': 2},
+# {'op': 'modifica', 'id': 10, 'quantita': 5} o {'op': 'elimina', 'id': 10})
+# rispetto alla disponibilità 'disponibili' ({lotto_id: qta}) e alle
+# prenotazioni dell'utente, che vengono aggiornate come se fosse già eseguita.
+# Restituisce (Esito, lotto_id)
+def _valida_operazione(operazione, disponibili, per_id, per_lotto):
+    op = operazione.get('op')
+    if op == 'crea':
+        lotto_id, qta = operazione.get('lotto_id'), operazione.get('quantita')
+        if not _intero(lotto_id):
+            return Esito(ESITO_NON_VALIDA, None, None), None
+        if lotto_id not in disponibili:
+            return Esito(ESITO_NON_TROVATA, None, None), lotto_id
+        if not _intero(qta) or qta < 1:
+            return Esito(ESITO_NON_VALIDA, None, disponibili[lotto_id]), lotto_id
+        if lotto_id in per_lotto:
+            return Esito(ESITO_DUPLICATA, per_lotto[lotto_id]['id'], disponibili[lotto_id]), lotto_id
+        if qta > disponibili[lotto_id]:
+            return Esito(ESITO_ESAURITO, None, disponibili[lotto_id]), lotto_id
+        disponibili[lotto_id] -= qta
+        per_lotto[lotto_id] = {'id': None, 'lotto_id': lotto_id, 'qta': qta}
+        return Esito(ESITO_OK, None, disponibili[lotto_id]), lotto_id
+
+    if not _intero(operazione.get('id')):
+        return Esito(ESITO_NON_VALIDA, None, None), None
+    prenotazione = per_id.get(operazione.get('id'))
+    if prenotazione is None:
+        return Esito(ESITO_NON_TROVATA, operazione.get('id'), None), None
+    lotto_id = prenotazione['lotto_id']
+    if op == 'elimina':
+        disponibili[lotto_id] += prenotazione['qta']
+        del per_id[prenotazione['id']], per_lotto[lotto_id]
+        return Esito(ESITO_OK, prenotazione['id'], disponibili[lotto_id]), lotto_id
+
+    qta = operazione.get('quantita')
+    massimo = disponibili[lotto_id] + prenotazione['qta']
+    if not _intero(qta) or qta < 1:
+        return Esito(ESITO_NON_VALIDA, prenotazione['id'], massimo), lotto_id
+    if qta > massimo:
+        return Esito(ESITO_ESAURITO, prenotazione['id'], massimo), lotto_id
+    disponibili[lotto_id] = massimo - qta
+    prenotazione['qta'] = qta
+    return Esito(ESITO_OK, prenotazione['id'], disponibili[lotto_id]), lotto_id
+
+
+# Esegue una lista di operazioni sulle prenotazioni dell'utente in una sola
+# transazione. La prima istruzione (l'incremento della versione del catalogo)
+# prende il lock di scrittura di SQLite, quindi la disponibilità letta dopo
+# non può cambiare fino al commit: tutte le operazioni vengono validate con
+# una query per le prenotazioni e una per la disponibilità, poi applicate con
+# un'istruzione per tipo. Le operazioni sono valutate nell'ordine, ognuna
+# sulla disponibilità lasciata dalle precedenti.
+# Con 'atomico' basta un'operazione non valida per annullare tutte le altre
+# (che risultano ESITO_NON_ESEGUITA); altrimenti vengono applicate quelle valide.
+# Restituisce la lista degli Esito, uno per operazione
+def esegui_batch(user_id, operazioni, atomico=True):
+    def operazione():
+        incrementa_versione_catalogo(db.session)
+
+        ids = [o.get('id') for o in operazioni if o.get('op') != 'crea' and _intero(o.get('id'))]
+        lotti = [o.get('lotto_id') for o in operazioni if o.get('op') == 'crea' and _intero(o.get('lotto_id'))]
+        righe = db.session.execute(
+            db.select(Prenotazione.id, Prenotazione.lotto_id, Prenotazione.qta)
+            .where(Prenotazione.user_id == user_id,
+                   db.or_(Prenotazione.id.in_(ids), Prenotazione.lotto_id.in_(lotti)))
+        ).all()
+        per_id = {r.id: {'id': r.id, 'lotto_id': r.lotto_id, 'qta': r.qta} for r in righe}
+        per_lotto = {p['lotto_id']: p for p in per_id.values()}
+        disponibili = get_qta_disponibili(set(lotti) | {p['lotto_id'] for p in per_id.values()})
+        iniziali = dict(disponibili)
+
+        esiti = []
+        for o in operazioni:
+            esito, lotto_id = (_valida_operazione(o, disponibili, per_id, per_lotto)
+                               if o.get('op') in OPERAZIONI_BATCH else (Esito(ESITO_NON_VALIDA, None, None), None))
+            esiti.append((o, esito, lotto_id))
+
+        if atomico and any(e.stato != ESITO_OK for _, e, _ in esiti):
+            return [e if e.stato != ESITO_OK else e._replace(stato=ESITO_NON_ESEGUITA, qta_disponibile=iniziali[l])
+                    for _, e, l in esiti]
+
+        valide = [(o, e, l) for o, e, l in esiti if e.stato == ESITO_OK]
+        eliminate = [e.prenotazione_id for o, e, _ in valide if o['op'] == 'elimina']
+        modificate = [{'id': e.prenotazione_id, 'qta': o['quantita']} for o, e, _ in valide if o['op'] == 'modifica']
+        create = [(i, {'lotto_id': l, 'user_id': user_id, 'qta': o['quantita']})
+                  for i, (o, e, l) in enumerate(esiti) if e.stato == ESITO_OK and o['op'] == 'crea']
+
+        if eliminate:
+            db.session.execute(db.delete(Prenotazione).where(Prenotazione.id.in_(eliminate))
+                               .execution_options(synchronize_session=False))
+        if modificate:
+            db.session.execute(db.update(Prenotazione), modificate)
+        if create:
+            nuovi_id = db.session.scalars(
+                db.insert(Prenotazione).returning(Prenotazione.id, sort_by_parameter_order=True),
+                [riga for _, riga in create],
+            ).all()
+            for (i, _), nuovo_id in zip(create, nuovi_id):
+                esiti[i] = (esiti[i][0], esiti[i][1]._replace(prenotazione_id=nuovo_id), esiti[i][2])
+
+        # Per le operazioni eseguite 'qta_disponibile' è la quantità rimasta nel
+        # lotto dopo tutto il batch; per quelle rifiutate è la massima consentita
+        return [e._replace(qta_disponibile=disponibili[l]) if e.stato == ESITO_OK else e for _, e, l in esiti]
+
+    # Con una creazione duplicata l'intero batch viene annullato: le creazioni
+    # risultano duplicate, le altre operazioni non eseguite
+    esiti = _con_retry(
+        operazione,
+        da_confermare=lambda esiti: any(e.stato == ESITO_OK for e in esiti),
+        su_duplicato=lambda: [Esito(ESITO_DUPLICATA if o.get('op') == 'crea' else ESITO_NON_ESEGUITA, None, None)
+                              for o in operazioni],
+    )
+    for o, esito in zip(operazioni, esiti):
+        conta_prenotazione(o.get('op') if o.get('op') in OPERAZIONI_BATCH else 'non_valida', esito.stato)
+    return esiti
+
+
+# Colonne di una prenotazione restituite da sincronizza(): i dati del lotto e
+# del prodotto sono appiattiti nella riga e il totale è calcolato da SQLite
+def _colonne_riga():
+    return (
+        Prenotazione.id, Prenotazione.lotto_id, Prenotazione.qta,
+        Lotto.data_consegna, Lotto.prezzo_unitario, Lotto.qta_unita_misura, Prodotto.nome_prodotto,
+        db.func.round(Prenotazione.qta * Lotto.prezzo_unitario, 2).label('totale'),
+    )
+
+
+def _riga(r):
+    return {
+        'id': r.id, 'lotto_id': r.lotto_id, 'qta': r.qta,
+        'data_consegna': r.data_consegna.isoformat(), 'prezzo_unitario': r.prezzo_unitario,
+        'qta_unita_misura': r.qta_unita_misura, 'nome_prodotto': r.nome_prodotto, 'totale': r.totale,
+    }
+
+
+# Versione corrente delle prenotazioni dell'utente e versione minima da cui
+# è possibile un aggiornamento incrementale, (0, 0) se non ne ha mai fatte
+def get_versione_prenotazioni(user_id):
+    riga = db.session.execute(
+        db.select(VersionePrenotazioni.versione, VersionePrenotazioni.minima)
+        .where(VersionePrenotazioni.user_id == user_id)
+    ).first()
+    return (riga.versione, riga.minima) if riga else (0, 0)
+
+
+# Totale in euro e numero delle prenotazioni dell'utente, con una sola query
+def totali_prenotazioni(user_id):
+    totale, numero = db.session.execute(
+        db.select(db.func.coalesce(db.func.sum(db.func.round(Prenotazione.qta * Lotto.prezzo_unitario, 2)), 0),
+                  db.func.count(Prenotazione.id))
+        .join(Prenotazione.rel_lotto)
+        .where(Prenotazione.user_id == user_id)
+    ).one()
+    return {'totale': round(totale, 2), 'numero': numero}
+
+
+# Una prenotazione dell'utente nel formato di sincronizza(), None se non esiste
+def get_riga_prenotazione(prenotazione_id, user_id):
+    riga = db.session.execute(
+        db.select(*_colonne_riga())
+        .join(Prenotazione.rel_lotto).join(Lotto.rel_prodotto)
+        .where(Prenotazione.id == prenotazione_id, Prenotazione.user_id == user_id)
+    ).first()
+    return _riga(riga) if riga else None
+
+
+# Prenotazioni dell'utente cambiate dopo la versione 'dal' (vedi i trigger
+# della migrazione 3 in migrazioni.py):
+#   {"versione": 12, "completo": false, "prenotazioni": [...], "eliminate": [4, 7],
+#    "totale": 35.5, "numero": 3}
+# Con 'dal' 0, maggiore della versione corrente (es. database ripristinato) o
+# minore della versione minima (le eliminazioni più vecchie sono state
+# cancellate, vedi pulisci_eliminate) restituisce tutte le prenotazioni con
+# "completo": true, e il client sostituisce quelle che ha. La versione viene
+# letta per prima: una modifica concorrente può comparire due volte, nella
+# risposta e nella successiva, ma non andare persa
+def sincronizza(user_id, dal=0):
+    versione, minima = get_versione_prenotazioni(user_id)
+    completo = dal <= 0 or dal > versione or dal < minima
+
+    query = (
+        db.select(*_colonne_riga())
+        .join(Prenotazione.rel_lotto).join(Lotto.rel_prodotto)
+        .where(Prenotazione.user_id == user_id)
+        .order_by(Lotto.data_consegna, Prenotazione.id)
+    )
+    eliminate = []
+    if not completo:
+        query = query.join(ModificaPrenotazione, ModificaPrenotazione.prenotazione_id == Prenotazione.id).where(
+            ModificaPrenotazione.versione > dal)
+        eliminate = db.session.scalars(
+            db.select(ModificaPrenotazione.prenotazione_id)
+            .where(ModificaPrenotazione.user_id == user_id, ModificaPrenotazione.versione > dal,
+                   ModificaPrenotazione.eliminata)
+        ).all()
+
+    return {
+        'versione': versione,
+        'completo': completo,
+        'prenotazioni': [_riga(r) for r in db.session.execute(query)],
+        'eliminate': eliminate,
+        **totali_prenotazioni(user_id),
+    }
+
+
+# Cancella le eliminazioni registrate dai trigger, che altrimenti crescono
+# senza limite (es. dopo un'archiviazione). Gli utenti coinvolti avranno una
+# sincronizzazione completa al prossimo aggiornamento. Va eseguita nella
+# transazione che elimina le prenotazioni, sulla connessione 'conn'
+def pulisci_eliminate(conn):
+    conn.execute(db.text('''UPDATE versioni_prenotazioni SET minima = versione
+                            WHERE user_id IN (SELECT user_id FROM modifiche_prenotazioni WHERE eliminata)'''))
+    conn.execute(db.text('DELETE FROM modifiche_prenotazioni WHERE eliminata'))
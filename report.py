@@ -0,0 +1,176 @@
+import csv
+import io
+from datetime import date
+from models import db, User, Produttore, Prodotto, Lotto, Prenotazione
+from archivio import connessione_storico
+
+# Riepiloghi per gli ordini ai produttori, per data di consegna. Tutti i
+# totali sono calcolati da SQLite con GROUP BY: Python riceve solo le righe
+# già aggregate (una per lotto o per produttore), mai le singole prenotazioni.
+# Solo la lista di ritiro ha una riga per prenotazione, e viene letta a
+# blocchi di RIGHE_PER_BLOCCO per scriverla in CSV senza tenerla in memoria
+
+RIGHE_PER_BLOCCO = 2000
+
+# Righe dei lotti mostrate al massimo nella pagina del report: l'elenco
+# completo si scarica in CSV
+RIGHE_PAGINA_MAX = 500
+
+# Colonne dei report, nell'ordine dei file CSV
+COLONNE = {
+    'lotti': ['data_consegna', 'produttore', 'prodotto', 'lotto_id', 'unita_misura', 'prezzo_unitario',
+              'qta_lotto', 'qta_prenotata', 'prenotazioni', 'ricavo', 'riempimento'],
+    'produttori': ['data_consegna', 'produttore', 'lotti', 'prenotazioni', 'ricavo', 'riempimento_medio'],
+    'ritiro': ['data_consegna', 'cognome', 'nome', 'email', 'produttore', 'prodotto', 'lotto_id',
+               'qta', 'unita_misura', 'prezzo_unitario', 'importo'],
+}
+
+
+# Legge dalla query string i filtri comuni ai report: data_da, data_a (ISO,
+# compresi) e produttore_id
+def leggi_filtri(args):
+    try:
+        return {
+            'data_da': date.fromisoformat(args['data_da']) if args.get('data_da') else None,
+            'data_a': date.fromisoformat(args['data_a']) if args.get('data_a') else None,
+            'produttore_id': int(args['produttore_id']) if args.get('produttore_id') else None,
+        }
+    except ValueError:
+        raise ValueError('Filtri non validi: usare data_da/data_a nel formato AAAA-MM-GG e produttore_id numerico.')
+
+
+def _filtra(query, data_da=None, data_a=None, produttore_id=None):
+    if data_da:
+        query = query.where(Lotto.data_consegna >= data_da)
+    if data_a:
+        query = query.where(Lotto.data_consegna <= data_a)
+    if produttore_id:
+        query = query.where(Produttore.id == produttore_id)
+    return query
+
+
+# Totali delle prenotazioni per lotto, calcolati con un solo GROUP BY
+def _prenotazioni_per_lotto():
+    return (
+        db.select(
+            Prenotazione.lotto_id,
+            db.func.sum(Prenotazione.qta).label('qta_prenotata'),
+            db.func.count(Prenotazione.id).label('prenotazioni'),
+        )
+        .group_by(Prenotazione.lotto_id)
+        .subquery()
+    )
+
+
+# Una riga per lotto: quantità prenotata, numero di prenotazioni, ricavo
+# (qta * prezzo_unitario) e riempimento (quantità prenotata / qta_lotto)
+def query_totali_lotti(**filtri):
+    totali = _prenotazioni_per_lotto()
+    qta_prenotata = db.func.coalesce(totali.c.qta_prenotata, 0)
+    query = (
+        db.select(
+            Lotto.data_consegna,
+            Produttore.nome_produttore.label('produttore'),
+            Prodotto.nome_prodotto.label('prodotto'),
+            Lotto.id.label('lotto_id'),
+            Lotto.qta_unita_misura.label('unita_misura'),
+            Lotto.prezzo_unitario,
+            Lotto.qta_lotto,
+            qta_prenotata.label('qta_prenotata'),
+            db.func.coalesce(totali.c.prenotazioni, 0).label('prenotazioni'),
+            db.func.round(qta_prenotata * Lotto.prezzo_unitario, 2).label('ricavo'),
+            db.func.round(qta_prenotata * 1.0 / db.func.nullif(Lotto.qta_lotto, 0), 4).label('riempimento'),
+        )
+        .join(Prodotto, Prodotto.id == Lotto.prodotto_id)
+        .join(Produttore, Produttore.id == Prodotto.produttore_id)
+        .outerjoin(totali, totali.c.lotto_id == Lotto.id)
+        .order_by(Lotto.data_consegna, Produttore.nome_produttore, Prodotto.nome_prodotto, Lotto.id)
+    )
+    return _filtra(query, **filtri)
+
+
+# Una riga per data di consegna e produttore, aggregando le righe dei lotti
+def query_totali_produttori(**filtri):
+    lotti = query_totali_lotti(**filtri).order_by(None).subquery()
+    return (
+        db.select(
+            lotti.c.data_consegna,
+            lotti.c.produttore,
+            db.func.count(lotti.c.lotto_id).label('lotti'),
+            db.func.sum(lotti.c.prenotazioni).label('prenotazioni'),
+            db.func.round(db.func.sum(lotti.c.ricavo), 2).label('ricavo'),
+            db.func.round(db.func.avg(lotti.c.riempimento), 4).label('riempimento_medio'),
+        )
+        .group_by(lotti.c.data_consegna, lotti.c.produttore)
+        .order_by(lotti.c.data_consegna, lotti.c.produttore)
+    )
+
+
+# Lista di ritiro: una riga per prenotazione, ordinata per data e socio
+def query_lista_ritiro(**filtri):
+    query = (
+        db.select(
+            Lotto.data_consegna,
+            User.cognome,
+            User.nome,
+            User.email,
+            Produttore.nome_produttore.label('produttore'),
+            Prodotto.nome_prodotto.label('prodotto'),
+            Lotto.id.label('lotto_id'),
+            Prenotazione.qta,
+            Lotto.qta_unita_misura.label('unita_misura'),
+            Lotto.prezzo_unitario,
+            db.func.round(Prenotazione.qta * Lotto.prezzo_unitario, 2).label('importo'),
+        )
+        .join(Lotto, Lotto.id == Prenotazione.lotto_id)
+        .join(User, User.id == Prenotazione.user_id)
+        .join(Prodotto, Prodotto.id == Lotto.prodotto_id)
+        .join(Produttore, Produttore.id == Prodotto.produttore_id)
+        .order_by(Lotto.data_consegna, User.cognome, User.nome, User.id, Produttore.nome_produttore, Prodotto.nome_prodotto)
+    )
+    return _filtra(query, **filtri)
+
+
+QUERY_REPORT = {
+    'lotti': query_totali_lotti,
+    'produttori': query_totali_produttori,
+    'ritiro': query_lista_ritiro,
+}
+
+
+# Esegue un report e restituisce i blocchi di righe letti dal database. Le
+# query sono eseguite direttamente sulla connessione (senza il caricamento
+# degli oggetti dell'ORM), che per le righe semplici è molto più veloce.
+# Con 'storico' il report comprende anche i lotti archiviati (vedi archivio.py),
+# con 'limite' vengono lette al massimo 'limite' righe
+def blocchi_report(nome, storico=False, limite=None, **filtri):
+    query = QUERY_REPORT[nome](**filtri).limit(limite).execution_options(stream_results=True)
+    if storico:
+        return _blocchi_storico(query)
+    return db.session.connection().execute(query).partitions(RIGHE_PER_BLOCCO)
+
+
+def _blocchi_storico(query):
+    with connessione_storico() as conn:
+        yield from conn.execute(query).partitions(RIGHE_PER_BLOCCO)
+
+
+def righe_report(nome, storico=False, limite=None, **filtri):
+    for blocco in blocchi_report(nome, storico, limite, **filtri):
+        yield from blocco
+
+
+# Genera il CSV di un report un blocco alla volta (intestazione compresa),
+# da restituire come risposta in streaming. Le date vengono scritte da
+# str(), che usa già il formato ISO
+def stream_csv(nome, storico=False, **filtri):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLONNE[nome])
+    for blocco in blocchi_report(nome, storico, **filtri):
+        writer.writerows(blocco)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,84 @@
+import re
+from datetime import date
+from models import db
+
+# Ricerca dei prodotti con l'indice FTS5 'ricerca_prodotti' (creato e tenuto
+# aggiornato dai trigger della migrazione 4, vedi migrazioni.py): nome del
+# prodotto e nome, descrizione e indirizzo del produttore. Ogni parola cercata
+# vale come prefisso ('mel' trova 'Mele' e 'Melanzane') e devono comparire
+# tutte; i risultati sono ordinati per punteggio (bm25). A differenza di una
+# LIKE '%...%' la ricerca non legge tutta la tabella, anche con 100.000 prodotti
+
+# Lotti restituiti da cerca_lotti: default e massimo
+RISULTATI_DEFAULT = 20
+RISULTATI_MAX = 50
+
+# Parole considerate al massimo in una ricerca
+PAROLE_MAX = 8
+
+# Lotti prenotabili dei prodotti trovati: consegna da oggi in poi, non
+# sospesi, con la quantità ancora disponibile. Il filtro sui lotti è dentro la
+# ricerca FTS, così i prodotti senza lotti prenotabili non occupano posti tra
+# i migliori per punteggio; l'ordinamento per punteggio considera tutti i
+# prodotti trovati (un prodotto vecchio molto pertinente non viene escluso),
+# poi vengono letti i lotti dei soli prodotti scelti
+QUERY_LOTTI = '''
+    WITH trovati AS (
+        SELECT rowid AS prodotto_id, rank AS punteggio FROM ricerca_prodotti
+        WHERE ricerca_prodotti MATCH :espressione
+          AND EXISTS (SELECT 1 FROM lotti AS l
+                      WHERE l.prodotto_id = ricerca_prodotti.rowid AND l.data_consegna >= :oggi
+                        AND NOT coalesce(l.sospeso, 0)
+                        AND l.qta_lotto > coalesce((SELECT sum(qta) FROM prenotazioni WHERE lotto_id = l.id), 0))
+        ORDER BY rank
+        LIMIT :limite
+    )
+    SELECT l.id, l.prodotto_id, p.nome_prodotto, r.nome_produttore, l.data_consegna,
+           l.qta_unita_misura, l.prezzo_unitario,
+           l.qta_lotto - coalesce((SELECT sum(qta) FROM prenotazioni WHERE lotto_id = l.id), 0) AS qta_disponibile
+    FROM trovati AS t
+    JOIN lotti AS l ON l.prodotto_id = t.prodotto_id
+    JOIN prodotti AS p ON p.id = l.prodotto_id
+    JOIN produttori AS r ON r.id = p.produttore_id
+    WHERE l.data_consegna >= :oggi AND NOT coalesce(l.sospeso, 0)
+      AND l.qta_lotto > coalesce((SELECT sum(qta) FROM prenotazioni WHERE lotto_id = l.id), 0)
+    ORDER BY t.punteggio, l.data_consegna, l.id
+    LIMIT :limite
+'''
+
+
+# Trasforma il testo cercato in un'espressione FTS5: ogni parola tra
+# virgolette (la sintassi di FTS5 non viene interpretata) e come prefisso.
+# Le parole di un solo carattere (es. '1' in 'lotto 1') valgono solo intere:
+# come prefisso corrisponderebbero a troppe parole dell'indice.
+# None se il testo non contiene parole
+def espressione_fts(testo):
+    parole = re.findall(r'\w+', testo.lower())[:PAROLE_MAX]
+    if not parole:
+        return None
+    return ' '.join(f'"{parola}"*' if len(parola) > 1 else f'"{parola}"' for parola in parole)
+
+
+# Condizione per filtrare una query sugli id dei prodotti trovati, es.
+# query.where(filtro_prodotti(Lotto.prodotto_id, 'mele')) (vedi elenchi.py)
+def filtro_prodotti(colonna, testo):
+    espressione = espressione_fts(testo)
+    if espressione is None:
+        return db.true()
+    trovati = db.select(db.literal_column('rowid')).select_from(db.table('ricerca_prodotti')).where(
+        db.text('ricerca_prodotti MATCH :espressione').bindparams(espressione=espressione))
+    return colonna.in_(trovati)
+
+
+# Lotti prenotabili dei prodotti che corrispondono al testo cercato, dal
+# prodotto più pertinente: [{"id": 12, "prodotto_id": 4, "nome_prodotto": "Mele Golden",
+# "nome_produttore": "...", "data_consegna": "2024-06-27", "qta_unita_misura": "Kg",
+# "prezzo_unitario": 2.5, "qta_disponibile": 40}, ...]
+def cerca_lotti(testo, limite=RISULTATI_DEFAULT):
+    espressione = espressione_fts(testo)
+    if espressione is None:
+        return []
+    righe = db.session.execute(db.text(QUERY_LOTTI), {
+        'espressione': espressione, 'oggi': date.today().isoformat(), 'limite': limite,
+    })
+    return [dict(riga._mapping) for riga in righe]
@@ -0,0 +1,139 @@
+import json
+from datetime import date
+from functools import lru_cache
+from flask import current_app
+from sqlalchemy import inspect
+from models import User, Produttore, Prodotto, Lotto, Prenotazione
+
+try:
+    import orjson
+except ImportError:  # orjson è opzionale: in sua assenza si usa il modulo json
+    orjson = None
+
+# Serializzatori "compilati" per i modelli, equivalenti a SerializerMixin.to_dict().
+# Le serialize_rules vengono interpretate una sola volta (all'import o alla
+# prima richiesta di una proiezione) e trasformate in funzioni che leggono
+# direttamente gli attributi, invece di essere rivalutate per ogni oggetto.
+#
+# Regole equivalenti a quelle di sqlalchemy_serializer per i nostri modelli:
+# - tutte le colonne, tranne quelle escluse con '-campo' nelle serialize_rules
+# - i metodi elencati nelle serialize_rules (es. 'get_date')
+# - tutte le relazioni, tranne quella che riporta al modello padre
+#   (es. '-rel_prodotto.rel_lotti' in Lotto)
+
+
+# Converte i valori delle colonne come fa SerializerMixin (le date in ISO)
+def _converti(valore):
+    if isinstance(valore, date):
+        return valore.isoformat()
+    return valore
+
+
+# Metodi del modello elencati nelle serialize_rules (es. 'get_date'): sono
+# gli unici che possono essere chiamati durante la serializzazione, anche
+# quando il client li chiede con 'fields' (vedi paginazione.valida_campi)
+def metodi_serializzati(model):
+    return [r for r in model.serialize_rules if not r.startswith('-') and '.' not in r]
+
+
+# Campi semplici (colonne escluse e metodi) indicati nelle serialize_rules
+def _regole(model):
+    esclusi = {r[1:] for r in model.serialize_rules if r.startswith('-') and '.' not in r}
+    return esclusi, metodi_serializzati(model)
+
+
+# Costruisce la funzione di serializzazione di 'model'. 'albero' è la
+# proiezione richiesta ({campo: sotto-albero}); se è None vengono serializzati
+# tutti i campi previsti dalle regole. 'relazione_padre' è la relazione da non
+# seguire per evitare la ricorsione
+def _compila(model, albero=None, relazione_padre=None):
+    mapper = inspect(model)
+    esclusi, metodi = _regole(model)
+
+    colonne = [c.key for c in mapper.column_attrs if c.key not in esclusi]
+    relazioni = [r for r in mapper.relationships if r.key != relazione_padre]
+
+    if albero is not None:
+        colonne = [c for c in colonne if c in albero]
+        metodi = [m for m in metodi if m in albero]
+        relazioni = [r for r in mapper.relationships if r.key in albero]
+
+    figli = [
+        (r.key, r.uselist, _compila(r.mapper.class_, albero[r.key] if albero and albero[r.key] else None, r.back_populates))
+        for r in relazioni
+    ]
+
+    def serializza(obj):
+        risultato = {}
+        for chiave in colonne:
+            risultato[chiave] = _converti(getattr(obj, chiave))
+        for nome in metodi:
+            risultato[nome] = getattr(obj, nome)()
+        for chiave, uselist, figlio in figli:
+            valore = getattr(obj, chiave)
+            if uselist:
+                risultato[chiave] = [figlio(v) for v in valore]
+            else:
+                risultato[chiave] = figlio(valore) if valore is not None else None
+        return risultato
+
+    return serializza
+
+
+# Trasforma l'elenco dei campi 'a.b.c' in un albero {a: {b: {c: {}}}}
+def _albero_campi(campi):
+    albero = {}
+    for campo in campi:
+        nodo = albero
+        for parte in campo.split('.'):
+            nodo = nodo.setdefault(parte, {})
+    return albero
+
+
+# Serializzatori completi, costruiti all'import
+SERIALIZZATORI = {model: _compila(model) for model in (User, Produttore, Prodotto, Lotto, Prenotazione)}
+
+
+# Serializzatore per una proiezione ('fields'), costruito alla prima richiesta
+@lru_cache(maxsize=128)
+def _serializzatore_proiezione(model, campi):
+    return _compila(model, _albero_campi(campi))
+
+
+# Serializza un oggetto come obj.to_dict() o, se indicati, come obj.to_dict(only=campi).
+# 'campi' deve essere una tupla (già validata, vedi paginazione.valida_campi)
+def serializza(obj, campi=None):
+    if campi:
+        return _serializzatore_proiezione(type(obj), campi)(obj)
+    return SERIALIZZATORI[type(obj)](obj)
+
+
+# Codifica in JSON con le chiavi ordinate, come jsonify di Flask
+def dumps(dati):
+    if orjson is not None:
+        return orjson.dumps(dati, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(dati, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+# Risposta Flask con il JSON prodotto da dumps(), da usare al posto di jsonify
+def json_response(dati, status=200):
+    return current_app.response_class(dumps(dati), status=status, mimetype='application/json')
+
+
+# Misura i tempi di to_dict() e dei serializzatori sul catalogo (l'output
+# identico è verificato da tests/test_serializzatori.py):
+#   python serializzatori.py
+if __name__ == '__main__':
+    import timeit
+    from app import create_app
+    from models import query_catalogo_lotti
+
+    app = create_app()
+    with app.app_context():
+        lotti = query_catalogo_lotti()
+        n = 50
+        t_mixin = timeit.timeit(lambda: app.json.dumps([l.to_dict() for l in lotti]), number=n) / n
+        t_compilato = timeit.timeit(lambda: dumps([serializza(l) for l in lotti]), number=n) / n
+        print(f'/api/lotti ({len(lotti)} lotti): to_dict + jsonify {t_mixin * 1000:.2f} ms, '
+              f'serializzatori + {"orjson" if orjson else "json"} {t_compilato * 1000:.2f} ms '
+              f'({t_mixin / t_compilato:.1f}x)')
@@ -2,4 +2,96 @@ import os
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
-DATABASE_PATH = os.path.join(BASE_DIR, 'database', 'db.sqlite3')
+DATABASE_PATH = os.environ.get('GAS_DATABASE_PATH', os.path.join(BASE_DIR, 'database', 'db.sqlite3'))
+
+# Database usato in sola lettura dalle richieste GET (catalogo, API, liste).
+# Può essere lo stesso file di DATABASE_PATH (connessioni separate aperte con
+# mode=ro) oppure una sua replica. Se non è impostato si usa DATABASE_PATH
+DATABASE_READONLY_PATH = os.environ.get('GAS_DATABASE_READONLY_PATH')
+
+# PRAGMA applicati a ogni nuova connessione SQLite:
+# - WAL: i lettori non vengono bloccati dalle scritture (e viceversa)
+# - synchronous=NORMAL: sicuro con WAL e molto più veloce di FULL
+# - busy_timeout: attesa (ms) prima di restituire "database is locked"
+# - mmap_size e cache_size (negativo = KiB) riducono le letture da disco
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('GAS_SQLITE_BUSY_TIMEOUT', 5000)),
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,
+    'temp_store': 'MEMORY',
+}
+
+# Pool di connessioni di ciascun processo (worker gunicorn). Con SQLite una
+# sola connessione alla volta può scrivere, quindi un pool piccolo basta
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': int(os.environ.get('GAS_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('GAS_POOL_MAX_OVERFLOW', 5)),
+    'pool_timeout': 10,
+    'pool_recycle': 3600,
+    'connect_args': {'check_same_thread': False},
+}
+
+# Algoritmo e costo degli hash delle password, nel formato di werkzeug
+# (es. 'scrypt:32768:8:1' oppure 'pbkdf2:sha256:600000'). Se viene cambiato,
+# le password vengono ricalcolate con i nuovi parametri al login successivo
+PASSWORD_HASH_METHOD = os.environ.get('GAS_PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+# Processi dedicati al calcolo degli hash (0 = nel thread della richiesta) e
+# numero massimo di calcoli in coda per ogni processo
+PASSWORD_PROCESSI = int(os.environ.get('GAS_PASSWORD_PROCESSI', 2))
+PASSWORD_CODA_PER_PROCESSO = 4
+
+# Storage dei contatori di Flask-Limiter, condiviso tra i processi. Di default
+# un file SQLite (vedi limiti.py); in alternativa un server Redis, es.
+# GAS_RATELIMIT_STORAGE_URI='redis://localhost:6379' (richiede il pacchetto redis)
+RATELIMIT_STORAGE_URI = os.environ.get(
+    'GAS_RATELIMIT_STORAGE_URI',
+    'sqlite:///' + os.path.join(BASE_DIR, 'database', 'limiti.sqlite3'),
+)
+# Strategia a finestra mobile: il limite vale per gli ultimi N secondi/minuti,
+# senza i picchi consentiti a cavallo di due finestre fisse
+RATELIMIT_STRATEGY = 'moving-window'
+
+# Durata (s) della cache del browser per i file statici con l'hash nel nome
+# (es. /static/scripts/lotti.3f2a9c1b2d4e.js): il contenuto di un URL non
+# cambia mai, quindi possono restare in cache per un anno
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+# Notifiche della disponibilità dei lotti via Server-Sent Events (vedi
+# disponibilita.py): intervallo (s) dei messaggi di heartbeat, eventi in coda
+# per ogni client prima di dover ripartire da un'istantanea, client collegati
+# al massimo per processo (0: stream disattivato, le pagine usano il polling;
+# consigliato con i worker sincroni di gunicorn), intervallo (s) con cui si
+# controllano le modifiche fatte dagli altri processi, durata massima (s) di
+# uno stream e attesa (s) del browser prima di ricollegarsi
+SSE_HEARTBEAT = 15
+SSE_CODA_MAX = 32
+SSE_MAX_CLIENT = int(os.environ.get('GAS_SSE_MAX_CLIENT', 5000))
+SSE_INTERVALLO_CONTROLLO = 2
+SSE_DURATA_MAX = int(os.environ.get('GAS_SSE_DURATA_MAX', 300))
+SSE_RICONNESSIONE = 3
+
+# Archivio dei lotti già consegnati (vedi archivio.py): file SQLite separato
+# in cui vengono spostati i lotti con data di consegna più vecchia di
+# ARCHIVIO_GIORNI giorni, con le loro prenotazioni
+ARCHIVIO_PATH = os.environ.get('GAS_ARCHIVIO_PATH', os.path.join(BASE_DIR, 'database', 'archivio.sqlite3'))
+ARCHIVIO_GIORNI = int(os.environ.get('GAS_ARCHIVIO_GIORNI', 30))
+
+# Metriche delle richieste (vedi metriche.py): ripetizioni della stessa
+# istruzione SQL in una richiesta oltre cui viene segnalato un possibile N+1,
+# token richiesto da /metrics (Authorization: Bearer <token>; se non è
+# impostato /metrics risponde 404) e cartella in cui i processi salvano le
+# proprie metriche per sommarle (necessaria con più worker)
+METRICHE_SOGLIA_SQL = int(os.environ.get('GAS_METRICHE_SOGLIA_SQL', 10))
+METRICHE_TOKEN = os.environ.get('GAS_METRICHE_TOKEN')
+METRICHE_CARTELLA = os.environ.get('GAS_METRICHE_CARTELLA')
+
+# Profiler a campionamento delle richieste lente, disattivato di default:
+# GAS_PROFILER=1 salva in PROFILER_CARTELLA gli stack delle richieste più
+# lente di PROFILER_SOGLIA secondi, campionati ogni PROFILER_INTERVALLO secondi
+PROFILER_ATTIVO = os.environ.get('GAS_PROFILER') == '1'
+PROFILER_INTERVALLO = 0.005
+PROFILER_SOGLIA = float(os.environ.get('GAS_PROFILER_SOGLIA', 0.5))
+PROFILER_CARTELLA = os.environ.get('GAS_PROFILER_CARTELLA', os.path.join(BASE_DIR, 'profili'))
@@ -0,0 +1,50 @@
+// Campi con autocompletamento al posto dei <select> con tutte le righe.
+// Il campo di testo mostra il nome, un campo nascosto contiene l'id scelto:
+//   <input type="text" data-autocompleta="prodotti" data-campo="prodotto_id" list="...">
+//   <datalist id="..."></datalist>
+//   <input type="hidden" id="prodotto_id" name="prodotto_id">
+// Con 'data-url' (es. "/gestisci_lotto/0") la scelta apre la pagina dell'elemento
+
+// Attesa (ms) dopo l'ultimo tasto prima di chiedere i suggerimenti al server
+const ATTESA_AUTOCOMPLETAMENTO = 200;
+
+function attivaAutocompletamento(input) {
+    const lista = document.getElementById(input.getAttribute('list'));
+    const campo = input.dataset.campo ? document.getElementById(input.dataset.campo) : null;
+    let suggerimenti = new Map();
+    let timer = null;
+
+    // Se il testo corrisponde a un suggerimento ne salva l'id, altrimenti il
+    // campo non è valido e il form non può essere inviato
+    function seleziona() {
+        const id = suggerimenti.get(input.value);
+        if (campo) {
+            if (id !== undefined) campo.value = id;
+            input.setCustomValidity(campo.value || !input.required ? '' : 'Seleziona un elemento dall\'elenco');
+        }
+        if (id !== undefined && input.dataset.url) {
+            window.location.href = input.dataset.url.replace(/0$/, id);
+        }
+    }
+
+    async function aggiornaSuggerimenti() {
+        const params = new URLSearchParams({ q: input.value });
+        const response = await fetch(`/api/autocompleta/${input.dataset.autocompleta}?${params}`);
+        if (!response.ok) return;
+        const risultati = await response.json();
+
+        suggerimenti = new Map(risultati.map(r => [r.testo, r.id]));
+        lista.replaceChildren(...risultati.map(r => Object.assign(document.createElement('option'), { value: r.testo })));
+        seleziona();
+    }
+
+    input.addEventListener('input', () => {
+        if (campo && !suggerimenti.has(input.value)) campo.value = '';
+        seleziona();
+        clearTimeout(timer);
+        timer = setTimeout(aggiornaSuggerimenti, ATTESA_AUTOCOMPLETAMENTO);
+    });
+    input.addEventListener('change', seleziona);
+}
+
+document.querySelectorAll('[data-autocompleta]').forEach(attivaAutocompletamento);
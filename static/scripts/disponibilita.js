@@ -0,0 +1,41 @@
+// Disponibilità dei lotti mentre la pagina resta aperta, usata dal catalogo e
+// dalle prenotazioni. Il server invia le modifiche con Server-Sent Events
+// (/api/lotti/eventi): lo stream si chiude dopo qualche minuto e il browser si
+// ricollega da solo, ricevendo di nuovo l'istantanea. Se lo stream non è
+// disponibile (browser senza EventSource, troppi client collegati o stream
+// disattivato sul server: risposta 503) la pagina rilegge
+// /api/lotti/disponibilita ogni INTERVALLO_POLLING millisecondi
+
+const INTERVALLO_POLLING = 30000;
+
+// Chiama aggiorna([{id, qta, sospeso}, ...]) con l'istantanea iniziale e a
+// ogni modifica della disponibilità
+function ascoltaDisponibilita(aggiorna) {
+    const polling = () => {
+        const leggi = () => fetch('/api/lotti/disponibilita')
+            .then(response => {
+                if (!response.ok) throw new Error('Errore nel recupero della disponibilità');
+                return response.json();
+            })
+            .then(aggiorna)
+            .catch(error => console.error(error));
+        leggi();
+        setInterval(leggi, INTERVALLO_POLLING);
+    };
+
+    if (!window.EventSource) {
+        polling();
+        return;
+    }
+    const eventi = new EventSource('/api/lotti/eventi');
+    for (const tipo of ['istantanea', 'disponibilita']) {
+        eventi.addEventListener(tipo, evento => aggiorna(JSON.parse(evento.data)));
+    }
+    // Dopo la chiusura normale dello stream il browser si ricollega (stato
+    // CONNECTING); una risposta diversa da 200 lo chiude definitivamente
+    eventi.addEventListener('error', () => {
+        if (eventi.readyState === EventSource.CLOSED) {
+            polling();
+        }
+    });
+}
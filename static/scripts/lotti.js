@@ -1,54 +1,97 @@
-// alert('OK'); // Commentato: alert di test
+// Le card dei lotti sono renderizzate dal server (templates/includes/catalogo_lotti.html).
+// Questo script aggiorna soltanto le quantità disponibili e i pulsanti mentre
+// la pagina resta aperta, senza ricostruire le card: il server invia le
+// modifiche con Server-Sent Events (/api/lotti/eventi), con il polling solo se
+// lo stream non è disponibile (vedi disponibilita.js).
+// La ricerca mostra solo le card dei lotti trovati da /api/cerca, in ordine di pertinenza
 
 // Seleziona l'elemento con id 'row-lotti' e lo assegna alla variabile rowLotti
 const rowLotti = document.querySelector('#row-lotti');
 
-// Fa una fetch di un file JSON dall'API e lo stampa in console
-fetch("/api/lotti?order=desc")
-    // Qui Flask sta lavorando per prepararci la risposta
-    // E alla fine ce la invia
-    .then(response => response.json()) // Converte la risposta in formato JSON
-    .then(data => { // Elabora i dati ricevuti
-        for (lotto of data) { // Itera su ogni lotto ricevuto
-            console.log(lotto); // Stampa il lotto in console (debugging)
-
-            // Variabile per il pulsante da visualizzare
-            let displayButton = '';
-            if(lotto.sospeso) {
-                // Se il lotto è sospeso, crea un pulsante rosso disabilitato
-                displayButton = '<button class="btn btn-danger w-100" disabled>Sospeso</button>';
-            }
-            else if (lotto.get_qta_disponibile == 0) {
-                // Se il lotto è esaurito, crea un pulsante giallo disabilitato
-                displayButton = '<button class="btn btn-warning w-100" disabled>Esaurito</button>';
-            } 
-            else {
-                // Altrimenti, crea un pulsante blu per prenotare il lotto
-                displayButton = `<a class="btn btn-primary w-100" href="/lotto/${lotto.id}">Prenota</a>`;
-            }
-
-            // Aggiunge un nuovo elemento HTML per ogni lotto nella variabile rowLotti
-            rowLotti.innerHTML += `
-               <div class="col-lg-4 col-md-4 col-sm-6 my-2 d-flex align-items-stretch">
-                    <div class="card h-100 d-flex flex-column">
-                        <div class="card-header bg-gas-primary">
-                            <h4 class="card-title text-gas-primary">${lotto.rel_prodotto.nome_prodotto}</h4>
-                            <p class="text-end"><small>(cod. lotto: ${lotto.id})</small></p>
-                        </div>
-                        <div class="card-body flex-grow-1">
-                            <p>Produttore: <b>${lotto.rel_prodotto.rel_produttore.nome_produttore}</b></p>
-                            <p>Data consegna: <b>${lotto.get_date}</b></p>
-                            <p>Q.tà TOT: <b>${lotto.qta_lotto} ${lotto.qta_unita_misura}</b></p>
-                            <p>Q.tà Disp: <b>${lotto.get_qta_disponibile} ${lotto.qta_unita_misura}</b></p>
-                            <p>Prezzo: <b>${lotto.get_prezzo_str}</b></p>
-                        </div>
-                        <img src="/static/imgs/${lotto.rel_prodotto.immagine}" class="rounded card-img-bottom" alt="${lotto.rel_prodotto.nome_prodotto}">
-                        <div class="card-footer">
-                            ${displayButton}
-                        </div>
-                    </div>
-                </div>
-            `;   
+// Crea il pulsante della card in base allo stato del lotto
+function creaPulsante(lotto) {
+    if (lotto.sospeso) {
+        // Se il lotto è sospeso, crea un pulsante rosso disabilitato
+        return Object.assign(document.createElement('button'), { className: 'btn btn-danger w-100', disabled: true, textContent: 'Sospeso' });
+    }
+    if (lotto.qta <= 0) {
+        // Se il lotto è esaurito, crea un pulsante giallo disabilitato
+        return Object.assign(document.createElement('button'), { className: 'btn btn-warning w-100', disabled: true, textContent: 'Esaurito' });
+    }
+    // Altrimenti, crea un pulsante blu per prenotare il lotto
+    return Object.assign(document.createElement('a'), { className: 'btn btn-primary w-100', href: `/lotto/${lotto.id}`, textContent: 'Prenota' });
+}
+
+// Applica le disponibilità ricevute ({id, qta, sospeso}) alle card: prima calcola tutte le
+// modifiche, poi le scrive nel DOM in un solo frame
+function aggiornaCard(lotti) {
+    const card = new Map();
+    for (const elemento of rowLotti.querySelectorAll('[data-lotto-id]')) {
+        card.set(Number(elemento.dataset.lottoId), elemento);
+    }
+
+    const modifiche = [];
+    for (const lotto of lotti) {
+        const elemento = card.get(lotto.id);
+        if (!elemento) continue;
+        const qta = elemento.querySelector('.qta-disponibile');
+        const sospeso = lotto.sospeso ? '1' : '0';
+        if (qta.textContent != String(lotto.qta ?? 0) || elemento.dataset.sospeso != sospeso) {
+            modifiche.push({ elemento, qta, lotto, sospeso });
+        }
+    }
+    if (modifiche.length == 0) return;
+
+    requestAnimationFrame(() => {
+        for (const { elemento, qta, lotto, sospeso } of modifiche) {
+            qta.textContent = lotto.qta ?? 0;
+            elemento.dataset.sospeso = sospeso;
+            elemento.querySelector('.azione-lotto').replaceChildren(creaPulsante(lotto));
         }
     });
+}
 
+// L'istantanea arriva all'apertura (e dopo ogni riconnessione), i delta a
+// ogni prenotazione (vedi disponibilita.js)
+ascoltaDisponibilita(aggiornaCard);
+
+// Ricerca: mentre si scrive (dopo una breve pausa) chiede al server i lotti
+// che corrispondono al testo e nasconde le altre card. Le risposte arrivate
+// dopo una ricerca più recente vengono ignorate
+const campoRicerca = document.querySelector('#cerca-lotti');
+const nessunRisultato = document.querySelector('#nessun-risultato');
+let attesaRicerca, ultimaRicerca = 0;
+
+function mostraRisultati(lotti) {
+    const posizione = lotti && new Map(lotti.map((lotto, i) => [lotto.id, i]));
+    let visibili = 0;
+    for (const elemento of rowLotti.querySelectorAll('[data-lotto-id]')) {
+        const colonna = elemento.parentElement;
+        const indice = posizione ? posizione.get(Number(elemento.dataset.lottoId)) : 0;
+        colonna.classList.toggle('d-none', indice === undefined);
+        colonna.style.order = posizione && indice !== undefined ? indice : '';
+        if (indice !== undefined) visibili++;
+    }
+    nessunRisultato.style.display = posizione && visibili == 0 ? 'block' : 'none';
+}
+
+campoRicerca.addEventListener('input', () => {
+    clearTimeout(attesaRicerca);
+    attesaRicerca = setTimeout(() => {
+        const testo = campoRicerca.value.trim();
+        const numero = ++ultimaRicerca;
+        if (!testo) {
+            mostraRisultati(null);
+            return;
+        }
+        fetch(`/api/cerca?limit=50&q=${encodeURIComponent(testo)}`)
+            .then(response => {
+                if (!response.ok) throw new Error('Errore nella ricerca');
+                return response.json();
+            })
+            .then(lotti => {
+                if (numero == ultimaRicerca) mostraRisultati(lotti);
+            })
+            .catch(error => console.error('Errore nella ricerca:', error));
+    }, 200);
+});
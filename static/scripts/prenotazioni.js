@@ -1,5 +1,13 @@
 // Esegue fetchPrenotazioni quando il DOM è completamente caricato
-document.addEventListener('DOMContentLoaded', fetchPrenotazioni);
+document.addEventListener('DOMContentLoaded', () => fetchPrenotazioni());
+
+// Ultima quantità disponibile ricevuta dal server per ogni lotto
+const disponibilita = new Map();
+
+// Prenotazioni ricevute dal server (id -> riga) e loro versione: dopo il primo
+// caricamento il server invia solo le prenotazioni cambiate (vedi fetchPrenotazioni)
+const prenotazioni = new Map();
+let versionePrenotazioni = 0;
 
 // Oggetto contenente gli endpoint API per le operazioni sulle prenotazioni
 const API_ENDPOINTS = {
@@ -9,16 +17,38 @@ const API_ENDPOINTS = {
 };
 
 /**
- * Recupera le prenotazioni dal server e le renderizza nella pagina.
+ * Si iscrive agli aggiornamenti della disponibilità dei lotti (vedi disponibilita.js)
+ * e aggiorna le card delle prenotazioni senza rileggere le prenotazioni.
+ */
+document.addEventListener('DOMContentLoaded', () => ascoltaDisponibilita(lotti => {
+    for (const lotto of lotti) {
+        disponibilita.set(lotto.id, lotto.qta ?? 0);
+    }
+    mostraDisponibilita();
+}));
+
+/**
+ * Scrive nelle card la quantità ancora disponibile di ciascun lotto.
+ */
+function mostraDisponibilita() {
+    for (const span of document.querySelectorAll('.qta-disponibile[data-lotto-id]')) {
+        const qta = disponibilita.get(Number(span.dataset.lottoId));
+        span.textContent = qta === undefined ? '-' : qta;
+    }
+}
+
+/**
+ * Recupera dal server le prenotazioni cambiate dopo la versione già ricevuta
+ * (tutte al primo caricamento) e aggiorna la pagina.
  * Gestisce anche gli errori in caso di problemi con la richiesta.
  */
 function fetchPrenotazioni() {
-    fetch(API_ENDPOINTS.GET_PRENOTAZIONI)
+    return fetch(`${API_ENDPOINTS.GET_PRENOTAZIONI}?since=${versionePrenotazioni}`)
         .then(response => {
             if (!response.ok) throw new Error('Errore nel recupero delle prenotazioni');
             return response.json();
         })
-        .then(data => renderPrenotazioni(data))
+        .then(applicaModifiche)
         .catch(error => {
             console.error('Errore nel recupero delle prenotazioni:', error);
             alert('Si è verificato un errore nel recupero delle prenotazioni. Riprova più tardi.');
@@ -26,28 +56,56 @@ function fetchPrenotazioni() {
 }
 
 /**
- * Renderizza le prenotazioni nella pagina.
+ * Applica una risposta di sincronizzazione alle prenotazioni ricevute.
+ * Con "completo" il server ha inviato tutte le prenotazioni, che sostituiscono
+ * quelle presenti; altrimenti solo quelle cambiate e gli id di quelle eliminate.
+ * @param {Object} data - {versione, completo, prenotazioni, eliminate, totale, numero}
+ */
+function applicaModifiche(data) {
+    if (data.completo) prenotazioni.clear();
+    for (const prenotazione of data.prenotazioni) prenotazioni.set(prenotazione.id, prenotazione);
+    for (const id of data.eliminate) prenotazioni.delete(id);
+    versionePrenotazioni = data.versione;
+    renderPrenotazioni(data.totale);
+}
+
+/**
+ * Aggiorna le prenotazioni con la risposta di una modifica o eliminazione.
+ * Se la versione non è quella successiva alla nostra, altre modifiche sono
+ * avvenute nel frattempo (es. da un'altra scheda) e vengono richieste al server.
+ * @param {Object} data - Risposta dell'API, con la riga modificata o l'id eliminato
+ */
+function applicaRisposta(data) {
+    if (data.versione !== versionePrenotazioni + 1) {
+        return fetchPrenotazioni();
+    }
+    if (data.prenotazione) {
+        prenotazioni.set(data.prenotazione.id, data.prenotazione);
+    } else {
+        prenotazioni.delete(data.id);
+    }
+    versionePrenotazioni = data.versione;
+    renderPrenotazioni(data.totale);
+}
+
+/**
+ * Renderizza le prenotazioni nella pagina, in ordine di data di consegna.
  * Se non ci sono prenotazioni, mostra un messaggio appropriato.
- * Calcola e visualizza anche il prezzo totale di tutte le prenotazioni.
- * @param {Array} prenotazioni - Array di oggetti prenotazione
+ * @param {number} totale - Prezzo totale di tutte le prenotazioni, calcolato dal server
  */
-function renderPrenotazioni(prenotazioni) {
+function renderPrenotazioni(totale) {
     const container = document.getElementById('prenotazioni-container');
     const noPrenotazioniMessage = document.getElementById('no-prenotazioni-message');
     container.innerHTML = ''; // Pulisce il contenitore prima di aggiungere nuove prenotazioni
-    
-    if (prenotazioni.length === 0) {
-        noPrenotazioniMessage.style.display = 'block';
-        return;
-    }
-    
-    noPrenotazioniMessage.style.display = 'none';
-    const totalPrice = prenotazioni.reduce((total, prenotazione) => {
-        container.appendChild(createPrenotazioneCard(prenotazione));
-        return total + prenotazione.qta * prenotazione.rel_lotto.prezzo_unitario;
-    }, 0);
 
-    document.getElementById('total-price').textContent = `Totale complessivo: ${totalPrice.toFixed(2)} €`;
+    const righe = [...prenotazioni.values()].sort((a, b) =>
+        a.data_consegna.localeCompare(b.data_consegna) || a.id - b.id);
+    for (const prenotazione of righe) {
+        container.appendChild(createPrenotazioneCard(prenotazione));
+    }
+    noPrenotazioniMessage.style.display = righe.length === 0 ? 'block' : 'none';
+    document.getElementById('total-price').textContent = `Totale complessivo: ${totale.toFixed(2)} €`;
+    mostraDisponibilita();
 }
 
 /**
@@ -56,23 +114,23 @@ function renderPrenotazioni(prenotazioni) {
  * @returns {HTMLElement} - Elemento div rappresentante la card della prenotazione
  */
 function createPrenotazioneCard(prenotazione) {
-    const { id, qta, rel_lotto } = prenotazione;
-    const { rel_prodotto, data_consegna, prezzo_unitario } = rel_lotto;
-    
+    const { id, qta, lotto_id, nome_prodotto, data_consegna, prezzo_unitario, totale } = prenotazione;
+
     const card = document.createElement('div');
     card.className = 'card mb-3';
     card.id = `prenotazione-${id}`;
 
     card.innerHTML = `
         <div class="card-body">
-            <h5 class="card-title">${rel_prodotto.nome_prodotto}</h5>
+            <h5 class="card-title">${nome_prodotto}</h5>
             <p class="card-text">
                 Data Consegna: ${formatDate(data_consegna)}<br>
                 Prezzo per Unità: ${prezzo_unitario} €<br>
                 Quantità: <span id="quantity-${id}">${qta}</span><br>
-                Totale parziale: ${(qta * prezzo_unitario).toFixed(2)} €
+                Ancora disponibile: <span class="qta-disponibile" data-lotto-id="${lotto_id}">-</span><br>
+                Totale parziale: ${totale.toFixed(2)} €
             </p>
-            ${createButtonGroup(id, qta)}
+            ${createButtonGroup(id, qta, lotto_id)}
         </div>
     `;
 
@@ -83,12 +141,13 @@ function createPrenotazioneCard(prenotazione) {
  * Crea il gruppo di pulsanti per modificare ed eliminare una prenotazione.
  * @param {number} id - ID della prenotazione
  * @param {number} currentQuantity - Quantità attuale della prenotazione
+ * @param {number} lottoId - ID del lotto prenotato
  * @returns {string} - HTML string per il gruppo di pulsanti
  */
-function createButtonGroup(id, currentQuantity) {
+function createButtonGroup(id, currentQuantity, lottoId) {
     return `
         <div class="btn-group mt-2">
-            <button class="btn btn-primary" onclick="showEditForm(${id}, ${currentQuantity})">Modifica</button>
+            <button class="btn btn-primary" onclick="showEditForm(${id}, ${currentQuantity}, ${lottoId})">Modifica</button>
             <button class="btn btn-danger" onclick="deletePrenotazione(${id})">Elimina</button>
         </div>
     `;
@@ -108,8 +167,9 @@ function formatDate(dateString) {
  * Mostra il form per modificare la quantità di una prenotazione.
  * @param {number} id - ID della prenotazione
  * @param {number} currentQuantity - Quantità attuale della prenotazione
+ * @param {number} lottoId - ID del lotto, per limitare la quantità a quella disponibile
  */
-function showEditForm(id, currentQuantity) {
+function showEditForm(id, currentQuantity, lottoId) {
     const card = document.getElementById(`prenotazione-${id}`);
     const quantitySpan = card.querySelector(`#quantity-${id}`);
     const buttonGroup = card.querySelector('.btn-group');
@@ -120,8 +180,10 @@ function showEditForm(id, currentQuantity) {
 
     // Crea e aggiunge il form di modifica
     const editForm = document.createElement('div');
+    const disponibile = disponibilita.get(lottoId);
+    const max = disponibile === undefined ? '' : `max="${currentQuantity + disponibile}"`;
     editForm.innerHTML = `
-        <input type="number" id="edit-quantity-${id}" value="${currentQuantity}" min="1" class="form-control mb-2">
+        <input type="number" id="edit-quantity-${id}" value="${currentQuantity}" min="1" ${max} class="form-control mb-2">
         <button class="btn btn-success mr-2" onclick="updateQuantity(${id})">Salva</button>
         <button class="btn btn-secondary" onclick="cancelEdit(${id})">Annulla</button>
     `;
@@ -162,7 +224,7 @@ function updateQuantity(id) {
     })
     .then(data => {
         alert(data.message);
-        fetchPrenotazioni(); // Aggiorna la lista delle prenotazioni
+        return applicaRisposta(data); // Aggiorna solo la prenotazione interessata
     })
     .catch(error => {
         console.error('Errore nell\'aggiornamento della quantità:', error);
@@ -189,7 +251,7 @@ function deletePrenotazione(id) {
     })
     .then(data => {
         alert(data.message);
-        fetchPrenotazioni(); // Aggiorna la lista delle prenotazioni
+        return applicaRisposta(data); // Aggiorna solo la prenotazione interessata
     })
     .catch(error => {
         console.error('Errore nell\'eliminazione della prenotazione:', error);
@@ -0,0 +1,203 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+from immagini import MANIFEST_VARIANTI
+from settings import STATIC_MAX_AGE
+
+try:
+    import brotli
+except ImportError:  # brotli è opzionale: senza, vengono creati solo i file .gz
+    brotli = None
+
+# File statici con l'hash del contenuto nell'URL ("fingerprint"):
+#   url_for('static', filename='scripts/lotti.js') -> /static/scripts/lotti.3f2a9c1b2d4e.js
+# Quando un file cambia cambia anche il suo URL, quindi il browser può tenerlo
+# in cache per un anno senza mai chiedere se è stato modificato.
+#
+# Il comando 'flask --app app statici', da eseguire a ogni deploy, salva il
+# manifest {file: file con hash} in static/manifest.json e crea le versioni
+# compresse (.gz e, se è installato brotli, .br) dei file di testo, che
+# vengono servite ai browser che le accettano senza comprimere a ogni
+# richiesta (e che un server web davanti all'app può usare direttamente).
+# All'avvio l'app legge il manifest salvato; se non esiste (o in debug, dove
+# i file cambiano mentre l'app è in esecuzione) l'hash di ogni file viene
+# calcolato solo al primo url_for o alla prima richiesta del file, così
+# l'avvio non legge tutta la cartella static (immagini comprese)
+
+NOME_MANIFEST = 'manifest.json'
+
+# Lunghezza dell'hash nel nome dei file
+LUNGHEZZA_HASH = 12
+
+# Estensioni dei file da comprimere (le immagini sono già compresse)
+ESTENSIONI_COMPRIMIBILI = ('.css', '.js', '.json', '.svg', '.html', '.txt')
+
+# Codifiche precompresse, in ordine di preferenza: (Content-Encoding, estensione)
+CODIFICHE = (('br', '.br'), ('gzip', '.gz'))
+
+# Nomi già basati sul contenuto (immagini caricate e loro varianti, vedi
+# immagini.py): anche questi non cambiano mai e sono messi in cache per un anno
+_NOME_CON_HASH = re.compile(r'(^|/)[0-9a-f]{32}(-\w+)?\.\w+$')
+
+# Nome con l'hash aggiunto dal manifest: (file senza estensione, estensione)
+_NOME_FINGERPRINT = re.compile(rf'^(.*)\.[0-9a-f]{{{LUNGHEZZA_HASH}}}(\.\w+)$')
+
+
+def _hash_file(percorso):
+    sha256 = hashlib.sha256()
+    with open(percorso, 'rb') as file:
+        for blocco in iter(lambda: file.read(64 * 1024), b''):
+            sha256.update(blocco)
+    return sha256.hexdigest()[:LUNGHEZZA_HASH]
+
+
+# Restituisce il manifest dei file in 'cartella': {'scripts/lotti.js': 'scripts/lotti.<hash>.js'}.
+# Sono esclusi il manifest stesso e quello delle varianti delle immagini, le
+# versioni compresse e i file che hanno già un nome basato sul contenuto (le
+# immagini caricate): sono serviti così come sono, e l'avvio dell'app non
+# rilegge tutte le immagini a ogni riavvio
+def costruisci_manifest(cartella):
+    manifest = {}
+    for radice, _, file in os.walk(cartella):
+        for nome in file:
+            percorso = os.path.join(radice, nome)
+            relativo = os.path.relpath(percorso, cartella).replace(os.sep, '/')
+            if _nel_manifest(relativo):
+                manifest[relativo] = _nome_con_hash(relativo, percorso)
+    return dict(sorted(manifest.items()))
+
+
+def _nel_manifest(relativo):
+    nome = relativo.rsplit('/', 1)[-1]
+    return (nome not in (NOME_MANIFEST, MANIFEST_VARIANTI) and not nome.endswith(('.gz', '.br', '.tmp'))
+            and not _NOME_CON_HASH.search(relativo))
+
+
+def _nome_con_hash(relativo, percorso):
+    base, estensione = os.path.splitext(relativo)
+    return f'{base}.{_hash_file(percorso)}{estensione}'
+
+
+# Manifest salvato da build_statici, None se non esiste
+def leggi_manifest(cartella):
+    try:
+        with open(os.path.join(cartella, NOME_MANIFEST), encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+# Crea accanto a ogni file di testo le versioni compresse, se mancano o sono
+# più vecchie del file. Restituisce il numero di file creati
+def comprimi_statici(cartella, manifest):
+    creati = 0
+    for relativo in manifest:
+        if not relativo.endswith(ESTENSIONI_COMPRIMIBILI):
+            continue
+        percorso = os.path.join(cartella, relativo)
+        with open(percorso, 'rb') as file:
+            contenuto = file.read()
+        compressori = [('.gz', lambda dati: gzip.compress(dati, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            compressori.append(('.br', lambda dati: brotli.compress(dati, quality=11)))
+        for estensione, comprimi in compressori:
+            destinazione = percorso + estensione
+            if os.path.exists(destinazione) and os.path.getmtime(destinazione) >= os.path.getmtime(percorso):
+                continue
+            with open(destinazione + '.tmp', 'wb') as file:
+                file.write(comprimi(contenuto))
+            os.replace(destinazione + '.tmp', destinazione)
+            creati += 1
+    return creati
+
+
+# Salva il manifest e le versioni compresse: da eseguire al deploy
+def build_statici(cartella):
+    manifest = costruisci_manifest(cartella)
+    with open(os.path.join(cartella, NOME_MANIFEST), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest, comprimi_statici(cartella, manifest)
+
+
+# Sceglie la versione precompressa da inviare in base ad Accept-Encoding.
+# Restituisce (nome del file da inviare, Content-Encoding o None)
+def _scegli_codifica(cartella, relativo):
+    percorso = os.path.join(cartella, relativo)
+    for codifica, estensione in CODIFICHE:
+        if codifica in request.accept_encodings and os.path.exists(percorso + estensione) \
+                and os.path.getmtime(percorso + estensione) >= os.path.getmtime(percorso):
+            return relativo + estensione, codifica
+    return relativo, None
+
+
+# Registra sull'app il manifest, la sostituzione degli URL in url_for('static')
+# e la view che serve i file con hash con Cache-Control immutable
+def registra_statici(app):
+    cartella = app.static_folder
+    salvato = None if app.debug else leggi_manifest(cartella)
+    # Senza manifest salvato: {file: file con hash, o None se il file non ha
+    # un hash}, riempito man mano che i file vengono usati
+    manifest = dict(salvato or {})
+    originali = {con_hash: relativo for relativo, con_hash in manifest.items()}
+    app.extensions['manifest_statici'] = manifest
+
+    def con_hash(relativo):
+        if relativo in manifest or salvato is not None:
+            return manifest.get(relativo)
+        percorso = safe_join(cartella, relativo)
+        if not percorso or not os.path.isfile(percorso):
+            return None
+        nome = _nome_con_hash(relativo, percorso) if _nel_manifest(relativo) else None
+        if nome:
+            originali[nome] = relativo
+        manifest[relativo] = nome
+        return nome
+
+    # File richiesto con un hash non ancora calcolato da questo processo (es.
+    # la pagina è stata generata da un altro worker): l'hash deve corrispondere
+    def originale(filename):
+        relativo = originali.get(filename)
+        if relativo is None and salvato is None:
+            fingerprint = _NOME_FINGERPRINT.match(filename)
+            if fingerprint and con_hash(''.join(fingerprint.groups())) == filename:
+                relativo = originali[filename]
+        return relativo
+
+    @app.url_defaults
+    def _url_con_hash(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            nome = con_hash(values['filename'])
+            if nome:
+                values['filename'] = nome
+
+    def static(filename):
+        relativo = originale(filename)
+        if relativo is None:
+            if not _NOME_CON_HASH.search(filename):
+                return app.send_static_file(filename)
+            response = send_from_directory(cartella, filename, max_age=STATIC_MAX_AGE)
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+            return response
+
+        if relativo.endswith(ESTENSIONI_COMPRIMIBILI):
+            da_inviare, codifica = _scegli_codifica(cartella, relativo)
+        else:
+            da_inviare, codifica = relativo, None
+        mimetype = mimetypes.guess_type(relativo)[0] or 'application/octet-stream'
+        response = send_from_directory(cartella, da_inviare, mimetype=mimetype, max_age=STATIC_MAX_AGE)
+        if codifica:
+            response.headers['Content-Encoding'] = codifica
+        if relativo.endswith(ESTENSIONI_COMPRIMIBILI):
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = static
+    return manifest
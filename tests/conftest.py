@@ -0,0 +1,69 @@
+import os
+import sys
+import pytest
+
+# I moduli dell'app sono nella cartella principale del repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Hash delle password veloci e calcolati nel thread della richiesta: i test
+# creano molti utenti e non misurano la sicurezza degli hash
+os.environ.setdefault('GAS_PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+os.environ.setdefault('GAS_PASSWORD_PROCESSI', '0')
+
+from app import create_app  # noqa: E402
+from models import db, init_db  # noqa: E402
+
+PASSWORD_TEST = 'Password<1'
+
+
+# Configurazione di un'app con database e archivio nella cartella 'cartella'
+def configurazione_test(cartella, **extra):
+    return {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(cartella, 'db.sqlite3'),
+        'ARCHIVIO_PATH': os.path.join(cartella, 'archivio.sqlite3'),
+        'DATABASE_READONLY_PATH': None,
+        'RATELIMIT_ENABLED': False,
+        'RATELIMIT_STORAGE_URI': 'memory://',
+        'TESTING': True,
+        **extra,
+    }
+
+
+# Crea un'app su un database nuovo, inizializzato con i dati di esempio
+def crea_app_test(cartella, **extra):
+    app = create_app(configurazione_test(cartella, **extra))
+    with app.app_context():
+        init_db()
+    return app
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = crea_app_test(str(tmp_path))
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Crea un utente e restituisce un client con il login già fatto
+@pytest.fixture
+def crea_cliente(app):
+    from models import User
+
+    def crea_cliente(email):
+        with app.app_context():
+            utente = User(nome='Test', cognome='Test', telefono='', email=email, ruolo='utente')
+            utente.set_password(PASSWORD_TEST)
+            db.session.add(utente)
+            db.session.commit()
+        cliente = app.test_client()
+        risposta = cliente.post('/login', data={'email': email, 'password': PASSWORD_TEST})
+        assert risposta.status_code == 302
+        return cliente
+    return crea_cliente
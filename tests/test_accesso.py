@@ -0,0 +1,108 @@
+import time
+from types import SimpleNamespace
+import pytest
+import accesso
+from flask import session
+from accesso import get_current_user, invalida_utente
+from conftest import PASSWORD_TEST, crea_app_test
+from models import db, User
+
+PASSWORD_ADMIN = 'Ciotola<1'
+
+
+@pytest.fixture
+def admin(app):
+    cliente = app.test_client()
+    risposta = cliente.post('/login', data={'email': 'admin@admin.com', 'password': PASSWORD_ADMIN})
+    assert risposta.status_code == 302
+    return cliente
+
+
+def _crea_utente(app, email, ruolo='utente'):
+    with app.app_context():
+        utente = User(nome='Mario', cognome='Rossi', telefono='', email=email, ruolo=ruolo)
+        utente.set_password(PASSWORD_TEST)
+        db.session.add(utente)
+        db.session.commit()
+        return utente.id
+
+
+def _login(app, email):
+    cliente = app.test_client()
+    assert cliente.post('/login', data={'email': email, 'password': PASSWORD_TEST}).status_code == 302
+    return cliente
+
+
+# Utente corrente in una nuova richiesta con 'user_id' nella sessione
+def _utente_corrente(app, user_id):
+    with app.test_request_context():
+        session['user_id'] = user_id
+        return get_current_user()
+
+
+# Un admin declassato a utente non può più usare le pagine di amministrazione
+# dalla richiesta successiva, senza attendere la scadenza della cache
+def test_admin_declassato(app, admin):
+    user_id = _crea_utente(app, 'secondo.admin@test.it', ruolo='admin')
+    secondo = _login(app, 'secondo.admin@test.it')
+    assert secondo.get('/lista_produttori').status_code == 200
+
+    risposta = admin.post('/gestisci_utenti', data={'user_id': user_id, 'action': 'update', 'ruolo': 'utente'})
+    assert risposta.status_code == 200
+    risposta = secondo.get('/lista_produttori')
+    assert risposta.status_code == 302
+    assert _utente_corrente(app, user_id).ruolo == 'utente'
+
+    # e viceversa
+    admin.post('/gestisci_utenti', data={'user_id': user_id, 'action': 'update', 'ruolo': 'admin'})
+    assert secondo.get('/lista_produttori').status_code == 200
+
+
+def test_utente_eliminato(app, admin):
+    user_id = _crea_utente(app, 'eliminato@test.it')
+    socio = _login(app, 'eliminato@test.it')
+    assert socio.get('/').status_code == 200
+    assert _utente_corrente(app, user_id).email == 'eliminato@test.it'
+
+    risposta = admin.post('/gestisci_utenti', data={'user_id': user_id, 'action': 'delete'})
+    assert risposta.status_code == 200
+    assert _utente_corrente(app, user_id) is None
+    assert 'eliminato@test.it' not in socio.get('/').get_data(as_text=True)
+
+
+# Le modifiche fatte senza invalidare la cache sono visibili dopo USER_CACHE_TTL
+# secondi o dopo invalida_utente
+def test_cache_utente(app, monkeypatch):
+    user_id = _crea_utente(app, 'cache@test.it')
+    assert _utente_corrente(app, user_id).nome == 'Mario'
+
+    with app.app_context():
+        db.session.get(User, user_id).nome = 'Luigi'
+        db.session.commit()
+    assert _utente_corrente(app, user_id).nome == 'Mario'
+
+    with app.app_context():
+        invalida_utente(user_id)
+    assert _utente_corrente(app, user_id).nome == 'Luigi'
+
+    with app.app_context():
+        db.session.get(User, user_id).email = 'nuova@test.it'
+        db.session.commit()
+    scadenza = time.monotonic() + accesso.USER_CACHE_TTL + 1
+    monkeypatch.setattr(accesso, 'time', SimpleNamespace(monotonic=lambda: scadenza))
+    assert _utente_corrente(app, user_id).email == 'nuova@test.it'
+
+
+# Ogni app ha la sua cache: lo stesso id può essere un utente diverso
+def test_cache_per_app(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    app_a, app_b = crea_app_test(str(tmp_path / 'a')), crea_app_test(str(tmp_path / 'b'))
+    id_a = _crea_utente(app_a, 'a@test.it')
+    id_b = _crea_utente(app_b, 'b@test.it')
+    assert id_a == id_b
+    assert _utente_corrente(app_a, id_a).email == 'a@test.it'
+    assert _utente_corrente(app_b, id_b).email == 'b@test.it'
+    for app in (app_a, app_b):
+        with app.app_context():
+            db.engine.dispose()
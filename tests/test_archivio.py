@@ -0,0 +1,29 @@
+import os
+from datetime import date, timedelta
+from archivio import archivia, ha_prenotazioni_archiviate
+from models import db, Lotto, Prenotazione, User
+
+
+# Senza archivio non ci sono prenotazioni archiviate, e il controllo (fatto a
+# ogni eliminazione di un utente) non crea il file
+def test_ha_prenotazioni_archiviate_senza_archivio(app):
+    with app.app_context():
+        assert not ha_prenotazioni_archiviate(1)
+    assert not os.path.exists(app.config['ARCHIVIO_PATH'])
+
+
+def test_ha_prenotazioni_archiviate(app):
+    with app.app_context():
+        utenti = [User(nome='A', cognome=str(i), telefono='', email=f'arch{i}@test.it', password='x') for i in range(2)]
+        lotto = Lotto(prodotto_id=1, data_consegna=date.today() - timedelta(days=400), qta_unita_misura='pz',
+                      qta_lotto=10, prezzo_unitario=1.0, sospeso=False)
+        db.session.add_all([*utenti, lotto])
+        db.session.flush()
+        db.session.add(Prenotazione(lotto_id=lotto.id, user_id=utenti[0].id, qta=3))
+        db.session.commit()
+
+        archivia(prima_del=date.today() - timedelta(days=365))
+
+        assert os.path.exists(app.config['ARCHIVIO_PATH'])
+        assert ha_prenotazioni_archiviate(utenti[0].id)
+        assert not ha_prenotazioni_archiviate(utenti[1].id)
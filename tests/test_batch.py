@@ -0,0 +1,53 @@
+import pytest
+
+
+@pytest.mark.parametrize('operazione', [
+    {'op': 'crea', 'lotto_id': [1], 'quantita': 1},
+    {'op': 'crea', 'lotto_id': '1', 'quantita': 1},
+    {'op': 'crea', 'lotto_id': 1, 'quantita': True},
+    {'op': 'modifica', 'id': {'a': 1}, 'quantita': 1},
+    {'op': 'elimina', 'id': [1, 2]},
+    {'op': 'elimina'},
+])
+def test_batch_tipi_non_validi(crea_cliente, operazione):
+    cliente = crea_cliente('batch@test.it')
+    for atomico in (True, False):
+        risposta = cliente.post('/api/prenotazioni/batch', json={'atomico': atomico, 'operazioni': [operazione]})
+        assert risposta.status_code == (409 if atomico else 200)
+        assert risposta.json['risultati'][0]['stato'] == 'non_valida'
+
+
+def test_batch_operazione_non_valida_non_blocca_le_altre(crea_cliente):
+    cliente = crea_cliente('batch@test.it')
+    risposta = cliente.post('/api/prenotazioni/batch', json={'atomico': False, 'operazioni': [
+        {'op': 'crea', 'lotto_id': [1], 'quantita': 1},
+        {'op': 'crea', 'lotto_id': 1, 'quantita': 1},
+    ]})
+    assert risposta.status_code == 200
+    assert [r['stato'] for r in risposta.json['risultati']] == ['non_valida', 'ok']
+
+
+# Una prenotazione creata da un'altra richiesta tra la validazione e
+# l'inserimento fa fallire il vincolo (lotto, utente): simulata facendo
+# ignorare alla validazione le prenotazioni già esistenti
+def test_batch_creazione_duplicata_concorrente(app, crea_cliente, monkeypatch):
+    import prenotazioni
+    cliente = crea_cliente('batch@test.it')
+    risposta = cliente.post('/api/prenotazioni/batch', json={'operazioni': [{'op': 'crea', 'lotto_id': 1, 'quantita': 1}]})
+    assert risposta.status_code == 200
+    esistente = risposta.json['risultati'][0]['id']
+
+    valida = prenotazioni._valida_operazione
+    def valida_senza_esistenti(operazione, disponibili, per_id, per_lotto):
+        per_lotto.pop(operazione.get('lotto_id'), None)
+        return valida(operazione, disponibili, per_id, per_lotto)
+    monkeypatch.setattr(prenotazioni, '_valida_operazione', valida_senza_esistenti)
+
+    risposta = cliente.post('/api/prenotazioni/batch', json={'atomico': False, 'operazioni': [
+        {'op': 'modifica', 'id': esistente, 'quantita': 2},
+        {'op': 'crea', 'lotto_id': 1, 'quantita': 1},
+    ]})
+    assert risposta.status_code == 200
+    assert risposta.json['success'] is False
+    assert [(r['indice'], r['op'], r['stato']) for r in risposta.json['risultati']] == [
+        (0, 'modifica', 'non_eseguita'), (1, 'crea', 'duplicata')]
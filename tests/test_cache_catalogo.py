@@ -0,0 +1,123 @@
+import json
+from datetime import date, timedelta
+import pytest
+from archivio import archivia
+from importazione import importa_cartella
+from models import db, Lotto, Prenotazione, User
+
+PASSWORD_ADMIN = 'Ciotola<1'
+
+
+@pytest.fixture
+def admin(app):
+    cliente = app.test_client()
+    risposta = cliente.post('/login', data={'email': 'admin@admin.com', 'password': PASSWORD_ADMIN})
+    assert risposta.status_code == 302
+    return cliente
+
+
+def _crea_lotto(app, giorni=5):
+    with app.app_context():
+        lotto = Lotto(prodotto_id=1, data_consegna=date.today() + timedelta(days=giorni), qta_unita_misura='pz',
+                      qta_lotto=50, prezzo_unitario=1.0, sospeso=False)
+        db.session.add(lotto)
+        db.session.commit()
+        return lotto.id
+
+
+def _etag(client, url='/api/lotti'):
+    risposta = client.get(url)
+    assert risposta.status_code == 200
+    return risposta.headers['ETag']
+
+
+def test_etag_e_304(client):
+    etag = _etag(client)
+    risposta = client.get('/api/lotti', headers={'If-None-Match': etag})
+    assert risposta.status_code == 304
+    assert risposta.data == b''
+    assert 'no-cache' in risposta.headers['Cache-Control']
+    assert _etag(client) == etag
+    assert _etag(client, '/api/lotti?order=desc') != etag
+
+
+# Scritture di ogni tipo: ognuna deve cambiare l'ETag del catalogo
+
+def _prenota(app, cliente, admin, lotto_id, tmp_path):
+    assert cliente.post(f'/lotto/{lotto_id}', data={'quantita': 2}).status_code == 302
+
+
+def _modifica(app, cliente, admin, lotto_id, tmp_path):
+    with app.app_context():
+        prenotazione_id = Prenotazione.query.filter_by(lotto_id=lotto_id).one().id
+    assert cliente.post('/api/prenotazione/modifica', json={'id': prenotazione_id, 'quantita': 3}).status_code == 200
+
+
+def _elimina(app, cliente, admin, lotto_id, tmp_path):
+    with app.app_context():
+        prenotazione_id = Prenotazione.query.filter_by(lotto_id=lotto_id).one().id
+    assert cliente.post('/api/prenotazione/elimina', json={'id': prenotazione_id}).status_code == 200
+
+
+def _batch(app, cliente, admin, lotto_id, tmp_path):
+    operazioni = [{'op': 'crea', 'lotto_id': lotto_id, 'quantita': 1}]
+    assert cliente.post('/api/prenotazioni/batch', json={'operazioni': operazioni}).status_code == 200
+
+
+def _admin_lotto(app, cliente, admin, lotto_id, tmp_path):
+    risposta = admin.post(f'/gestisci_lotto/{lotto_id}', data={
+        'prodotto_id': 1, 'data_consegna': (date.today() + timedelta(days=5)).isoformat(), 'qta_unita_misura': 'pz',
+        'qta_lotto': 50, 'prezzo_unitario': 1.5, 'sospeso': 'false'})
+    assert risposta.status_code == 302
+
+
+def _admin_sospende(app, cliente, admin, lotto_id, tmp_path):
+    risposta = admin.post(f'/gestisci_lotto/{lotto_id}', data={
+        'prodotto_id': 1, 'data_consegna': (date.today() + timedelta(days=5)).isoformat(), 'qta_unita_misura': 'pz',
+        'qta_lotto': 50, 'prezzo_unitario': 1.0, 'sospeso': 'true'})
+    assert risposta.status_code == 302
+
+
+def _importazione(app, cliente, admin, lotto_id, tmp_path):
+    cartella = tmp_path / 'importazione'
+    cartella.mkdir()
+    (cartella / 'lotti.json').write_text(json.dumps([{
+        'prodotto_id': 1, 'data_consegna': (date.today() + timedelta(days=9)).isoformat(),
+        'qta_unita_misura': 'pz', 'qta_lotto': 5, 'prezzo_unitario': 2.0, 'sospeso': False}]))
+    with app.app_context():
+        assert importa_cartella(str(cartella), log=lambda *_: None) == {'lotti': 1}
+
+
+def _archiviazione(app, cliente, admin, lotto_id, tmp_path):
+    vecchio = _crea_lotto(app, giorni=-400)
+    etag = _etag(app.test_client())
+    with app.app_context():
+        archivia(prima_del=date.today() - timedelta(days=365))
+        assert db.session.get(Lotto, vecchio) is None
+    return etag
+
+
+@pytest.mark.parametrize('scrittura', [_prenota, _modifica, _elimina, _batch, _admin_lotto, _admin_sospende,
+                                       _importazione, _archiviazione], ids=lambda f: f.__name__.strip('_'))
+def test_scritture_invalidano_etag(app, crea_cliente, admin, tmp_path, scrittura):
+    cliente = crea_cliente('etag@test.it')
+    lotto_id = _crea_lotto(app)
+    if scrittura in (_modifica, _elimina):
+        _prenota(app, cliente, admin, lotto_id, tmp_path)
+
+    etag = _etag(cliente)
+    etag = scrittura(app, cliente, admin, lotto_id, tmp_path) or etag
+
+    risposta = cliente.get('/api/lotti', headers={'If-None-Match': etag})
+    assert risposta.status_code == 200
+    assert risposta.headers['ETag'] != etag
+
+
+# Le scritture che non riguardano il catalogo (es. un nuovo utente) non
+# invalidano la cache
+def test_scritture_fuori_dal_catalogo(app, client):
+    etag = _etag(client)
+    with app.app_context():
+        db.session.add(User(nome='N', cognome='N', telefono='', email='nessuno@test.it', password='x'))
+        db.session.commit()
+    assert client.get('/api/lotti', headers={'If-None-Match': etag}).status_code == 304
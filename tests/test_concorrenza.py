@@ -0,0 +1,78 @@
+import threading
+from datetime import date, timedelta
+from models import db, Lotto, Prenotazione, User
+from prenotazioni import prenota, modifica, esegui_batch, ESITO_OK, ESITO_ESAURITO
+
+THREAD = 16
+QTA_LOTTO = 10
+
+
+# Crea un lotto con QTA_LOTTO unità e un utente per thread
+def _prepara(app):
+    with app.app_context():
+        lotto = Lotto(prodotto_id=1, data_consegna=date.today() + timedelta(days=7), qta_unita_misura='pz',
+                      qta_lotto=QTA_LOTTO, prezzo_unitario=1.0, sospeso=False)
+        utenti = [User(nome='T', cognome=str(i), telefono='', email=f'conc{i}@test.it', password='x')
+                  for i in range(THREAD)]
+        db.session.add_all([lotto, *utenti])
+        db.session.commit()
+        return lotto.id, [u.id for u in utenti]
+
+
+# Esegue funzione(i) in THREAD thread che partono insieme, ognuno con il
+# proprio contesto dell'app (e quindi la propria connessione)
+def _in_parallelo(app, funzione):
+    partenza = threading.Barrier(THREAD)
+    risultati, errori = [None] * THREAD, []
+
+    def esegui(i):
+        try:
+            with app.app_context():
+                partenza.wait()
+                risultati[i] = funzione(i)
+        except Exception as e:
+            errori.append(e)
+
+    threads = [threading.Thread(target=esegui, args=(i,)) for i in range(THREAD)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errori, errori
+    return risultati
+
+
+def _qta_prenotata(app, lotto_id):
+    with app.app_context():
+        return db.session.scalar(
+            db.select(db.func.coalesce(db.func.sum(Prenotazione.qta), 0)).where(Prenotazione.lotto_id == lotto_id))
+
+
+def test_prenotazioni_concorrenti_non_superano_il_lotto(app):
+    lotto_id, utenti = _prepara(app)
+    esiti = _in_parallelo(app, lambda i: prenota(lotto_id, utenti[i], 1 + i % 3))
+
+    assert _qta_prenotata(app, lotto_id) <= QTA_LOTTO
+    assert {e.stato for e in esiti} <= {ESITO_OK, ESITO_ESAURITO}
+    assert sum(1 + i % 3 for i, e in enumerate(esiti) if e.stato == ESITO_OK) == _qta_prenotata(app, lotto_id)
+    assert any(e.stato == ESITO_ESAURITO for e in esiti)
+
+
+def test_modifiche_e_batch_concorrenti_non_superano_il_lotto(app):
+    lotto_id, utenti = _prepara(app)
+    # Metà degli utenti ha già una unità; tutti cercano poi di prenotarne di più
+    iniziali = {}
+    with app.app_context():
+        for utente_id in utenti[:THREAD // 2]:
+            iniziali[utente_id] = prenota(lotto_id, utente_id, 1).prenotazione_id
+    assert _qta_prenotata(app, lotto_id) == THREAD // 2
+
+    def aumenta(i):
+        utente_id = utenti[i]
+        if utente_id in iniziali:
+            return modifica(iniziali[utente_id], utente_id, 3)
+        return esegui_batch(utente_id, [{'op': 'crea', 'lotto_id': lotto_id, 'quantita': 2}])[0]
+
+    esiti = _in_parallelo(app, aumenta)
+    assert _qta_prenotata(app, lotto_id) <= QTA_LOTTO
+    assert any(e.stato == ESITO_OK for e in esiti)
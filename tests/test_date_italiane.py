@@ -0,0 +1,9 @@
+from datetime import date
+from date_italiane import data_con_giorno
+
+
+# Stesso testo di strftime('%A %d/%m/%Y') con la locale it_IT
+def test_data_con_giorno():
+    assert data_con_giorno(date(2024, 6, 27)) == 'giovedì 27/06/2024'
+    assert data_con_giorno(date(2024, 6, 30)) == 'domenica 30/06/2024'
+    assert data_con_giorno(date(2025, 1, 6)) == 'lunedì 06/01/2025'
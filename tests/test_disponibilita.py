@@ -0,0 +1,141 @@
+import json
+import time
+from datetime import date, timedelta
+import pytest
+import disponibilita
+from conftest import crea_app_test
+from disponibilita import iscrivi, stream_eventi
+from models import db, Lotto, User
+from prenotazioni import prenota
+
+
+@pytest.fixture(autouse=True)
+def attese_brevi(monkeypatch):
+    monkeypatch.setattr(disponibilita, 'SSE_HEARTBEAT', 0.2)
+    monkeypatch.setattr(disponibilita, 'SSE_INTERVALLO_CONTROLLO', 0.1)
+
+
+def _crea_lotto(app, qta_lotto=10):
+    with app.app_context():
+        lotto = Lotto(prodotto_id=1, data_consegna=date.today() + timedelta(days=5), qta_unita_misura='pz',
+                      qta_lotto=qta_lotto, prezzo_unitario=1.0, sospeso=False)
+        utente = User(nome='D', cognome='D', telefono='', email=f'disp{time.monotonic_ns()}@test.it', password='x')
+        db.session.add_all([lotto, utente])
+        db.session.commit()
+        return lotto.id, utente.id
+
+
+# Legge dallo stream il prossimo evento (saltando gli heartbeat):
+# (nome, id, dati), o None se lo stream è terminato
+def _prossimo_evento(stream, tentativi=50):
+    for _ in range(tentativi):
+        try:
+            testo = next(stream)
+        except StopIteration:
+            return None
+        if testo.startswith('event:'):
+            campi = dict(riga.split(': ', 1) for riga in testo.strip().split('\n'))
+            return campi['event'], campi.get('id'), json.loads(campi['data'])
+    pytest.fail('Nessun evento ricevuto')
+
+
+def test_iscrizione_riceve_istantanea(app):
+    lotto_id, _ = _crea_lotto(app, qta_lotto=7)
+    iscrizione = iscrivi(app)
+    stream = stream_eventi(iscrizione)
+    assert next(stream).startswith('retry: ')
+    nome, _, dati = _prossimo_evento(stream)
+    assert nome == 'istantanea'
+    assert {'id': lotto_id, 'qta': 7, 'sospeso': False} in dati
+    stream.close()
+
+
+def test_prenotazione_invia_delta(app):
+    lotto_id, utente_id = _crea_lotto(app)
+    stream = stream_eventi(iscrivi(app))
+    _prossimo_evento(stream)
+
+    with app.app_context():
+        prenota(lotto_id, utente_id, 3)
+    nome, versione, dati = _prossimo_evento(stream)
+    assert nome == 'disponibilita'
+    assert dati == [{'id': lotto_id, 'qta': 7, 'sospeso': False}]
+    with app.app_context():
+        assert int(versione) == disponibilita.get_versione_catalogo()
+    stream.close()
+
+
+def test_troppi_client_rifiutati(app, client, monkeypatch):
+    monkeypatch.setattr(disponibilita, 'SSE_MAX_CLIENT', 2)
+    iscrizioni = [iscrivi(app), iscrivi(app)]
+    assert all(iscrizioni)
+    assert iscrivi(app) is None
+    assert client.get('/api/lotti/eventi').status_code == 503
+
+    # Chiuso uno stream, il posto si libera
+    stream = stream_eventi(iscrizioni[0])
+    next(stream)
+    stream.close()
+    assert iscrivi(app) is not None
+
+
+def test_disconnessione_annulla_iscrizione(app):
+    stato = disponibilita._stato(app)
+    stream = stream_eventi(iscrivi(app))
+    _prossimo_evento(stream)
+    assert len(stato.iscritti) == 1
+    stream.close()
+    assert not stato.iscritti
+
+    # Senza iscritti l'osservatore termina
+    for _ in range(50):
+        if stato.osservatore is None:
+            break
+        time.sleep(0.05)
+    assert stato.osservatore is None
+
+
+def test_stream_termina_dopo_durata_massima(app, monkeypatch):
+    monkeypatch.setattr(disponibilita, 'SSE_DURATA_MAX', 0.3)
+    stato = disponibilita._stato(app)
+    stream = stream_eventi(iscrivi(app))
+    assert _prossimo_evento(stream)[0] == 'istantanea'
+    assert _prossimo_evento(stream) is None
+    assert not stato.iscritti
+
+
+# Ogni app ha i propri iscritti: le prenotazioni su un'app (un altro
+# database) non arrivano ai client dell'altra
+def test_stato_separato_per_app(app, tmp_path):
+    (tmp_path / 'altra').mkdir()
+    altra = crea_app_test(str(tmp_path / 'altra'))
+    lotto_id, utente_id = _crea_lotto(app)
+    stream_altra = stream_eventi(iscrivi(altra))
+    _prossimo_evento(stream_altra)
+    stream = stream_eventi(iscrivi(app))
+    _prossimo_evento(stream)
+
+    with app.app_context():
+        prenota(lotto_id, utente_id, 1)
+    assert _prossimo_evento(stream)[0] == 'disponibilita'
+    assert all(not testo.startswith('event:') for testo in (next(stream_altra) for _ in range(3)))
+    assert disponibilita._stato(app) is not disponibilita._stato(altra)
+    stream.close()
+    stream_altra.close()
+    with altra.app_context():
+        db.engine.dispose()
+
+
+def test_polling_disponibilita(app, client):
+    lotto_id, utente_id = _crea_lotto(app)
+    risposta = client.get('/api/lotti/disponibilita')
+    assert risposta.status_code == 200
+    assert {'id': lotto_id, 'qta': 10, 'sospeso': False} in risposta.get_json()
+    etag = risposta.headers['ETag']
+    assert client.get('/api/lotti/disponibilita', headers={'If-None-Match': etag}).status_code == 304
+
+    with app.app_context():
+        prenota(lotto_id, utente_id, 4)
+    risposta = client.get('/api/lotti/disponibilita', headers={'If-None-Match': etag})
+    assert risposta.status_code == 200
+    assert {'id': lotto_id, 'qta': 6, 'sospeso': False} in risposta.get_json()
@@ -0,0 +1,108 @@
+from datetime import date, timedelta
+import pytest
+from elenchi import pagina_elenco, PER_PAGINA_DEFAULT, SUGGERIMENTI_MAX
+from models import db, Lotto, Prodotto, Produttore
+
+PASSWORD_ADMIN = 'Ciotola<1'
+PRODUTTORI = 30
+CONSEGNA = date.today() + timedelta(days=4)
+
+
+@pytest.fixture
+def admin(app):
+    cliente = app.test_client()
+    risposta = cliente.post('/login', data={'email': 'admin@admin.com', 'password': PASSWORD_ADMIN})
+    assert risposta.status_code == 302
+    return cliente
+
+
+# PRODUTTORI produttori 'Fattoria Zeta NN', ognuno con il prodotto
+# 'Susine NN' e un lotto. Restituisce gli id dei produttori
+@pytest.fixture
+def produttori(app):
+    with app.app_context():
+        produttori = [Produttore(nome_produttore=f'Fattoria Zeta {i:02d}', descrizione='', indirizzo='',
+                                 telefono='', email=f'zeta{i:02d}@test.it') for i in range(PRODUTTORI)]
+        db.session.add_all(produttori)
+        db.session.flush()
+        prodotti = [Prodotto(produttore_id=p.id, nome_prodotto=f'Susine {i:02d}') for i, p in enumerate(produttori)]
+        db.session.add_all(prodotti)
+        db.session.flush()
+        db.session.add_all([Lotto(prodotto_id=p.id, data_consegna=CONSEGNA, qta_unita_misura='kg', qta_lotto=10,
+                                  prezzo_unitario=1.0, sospeso=False) for p in prodotti])
+        db.session.commit()
+        return [p.id for p in produttori]
+
+
+def test_pagina_elenco(app, produttori):
+    with app.test_request_context():
+        pagina = pagina_elenco('produttori', {'q': 'zeta'})
+        assert (pagina.totale, pagina.pagine, pagina.pagina) == (PRODUTTORI, 2, 1)
+        assert len(pagina.righe) == PER_PAGINA_DEFAULT
+        assert pagina.righe[0].nome_produttore == 'Fattoria Zeta 00'
+        assert pagina.righe[0]._fields == ('id', 'nome_produttore', 'email', 'telefono')
+
+        pagina = pagina_elenco('produttori', {'q': 'zeta', 'pagina': '2'})
+        assert [r.nome_produttore for r in pagina.righe] == [f'Fattoria Zeta {i}' for i in range(25, PRODUTTORI)]
+
+        # Ordine decrescente, più parole, numero di pagina fuori dall'intervallo
+        pagina = pagina_elenco('produttori', {'q': 'zeta', 'ordina': '-email', 'per_pagina': '3', 'pagina': '99'})
+        assert (pagina.pagina, pagina.pagine) == (10, 10)
+        assert [r.email for r in pagina.righe] == ['zeta02@test.it', 'zeta01@test.it', 'zeta00@test.it']
+        assert pagina_elenco('produttori', {'q': 'fattoria 07'}).totale == 1
+
+        # Parametri non validi: valori di default
+        pagina = pagina_elenco('produttori', {'ordina': 'password', 'per_pagina': 'tanti'})
+        assert (pagina.ordine, pagina.per_pagina) == ('nome', PER_PAGINA_DEFAULT)
+
+        # Lotti e prodotti cercano nell'indice FTS, anche per nome del produttore
+        assert pagina_elenco('prodotti', {'q': 'susine'}).totale == PRODUTTORI
+        lotti = pagina_elenco('lotti', {'q': 'zeta 05'})
+        assert [(r.nome_prodotto, r.nome_produttore) for r in lotti.righe] == [('Susine 05', 'Fattoria Zeta 05')]
+
+
+@pytest.mark.parametrize('url, testo', [
+    ('/lista_produttori?q=zeta&per_pagina=10&pagina=3', 'Fattoria Zeta 29'),
+    ('/lista_prodotti?q=susine&ordina=-nome', 'Susine 29'),
+    ('/lista_lotti?q=susine&ordina=prodotto', 'Susine 00'),
+    ('/gestisci_utenti?q=admin', 'admin@admin.com'),
+])
+def test_liste(admin, produttori, url, testo):
+    risposta = admin.get(url)
+    assert risposta.status_code == 200
+    assert testo in risposta.get_data(as_text=True)
+
+
+def test_liste_solo_admin(client, crea_cliente):
+    socio = crea_cliente('socio@test.it')
+    for url in ('/lista_produttori', '/lista_prodotti', '/lista_lotti', '/gestisci_utenti', '/api/autocompleta/prodotti'):
+        assert client.get(url).status_code == 302
+        assert socio.get(url).status_code == 302
+
+
+def test_autocompleta(admin, produttori):
+    risultati = admin.get('/api/autocompleta/produttori?q=zeta').get_json()
+    assert len(risultati) == SUGGERIMENTI_MAX
+    assert risultati[0] == {'id': produttori[0], 'testo': 'Fattoria Zeta 00'}
+
+    risultati = admin.get('/api/autocompleta/prodotti?q=susine 07').get_json()
+    assert [r['testo'] for r in risultati] == ['Susine 07']
+
+    lotto, = admin.get('/api/autocompleta/lotti?q=zeta 03').get_json()
+    assert lotto['testo'] == f'Susine 03 - {CONSEGNA.strftime("%d/%m/%Y")} (cod. {lotto["id"]})'
+
+    assert admin.get('/api/autocompleta/prodotti?q=nessuno').get_json() == []
+    assert admin.get('/api/autocompleta/utenti?q=admin').status_code == 404
+
+
+# La pagina di modifica non elenca tutti i produttori: si cercano con l'autocompletamento
+def test_gestisci_produttore(admin, produttori):
+    testo = admin.get(f'/gestisci_produttore/{produttori[3]}').get_data(as_text=True)
+    assert 'value="Fattoria Zeta 03"' in testo
+    assert 'Fattoria Zeta 04' not in testo
+    assert 'data-autocompleta="produttori"' in testo
+
+    risposta = admin.post(f'/gestisci_produttore/{produttori[3]}', data={
+        'nome_produttore': 'Fattoria Zeta Tre', 'descrizione': '', 'indirizzo': '', 'telefono': '', 'email': 'tre@test.it'})
+    assert risposta.status_code == 302
+    assert admin.get('/api/autocompleta/produttori?q=tre').get_json() == [{'id': produttori[3], 'testo': 'Fattoria Zeta Tre'}]
@@ -0,0 +1,95 @@
+import io
+import json
+import os
+import pytest
+from werkzeug.datastructures import FileStorage
+from conftest import crea_app_test
+import immagini
+from immagini import (genera_varianti, salva_upload, scrivi_manifest_varianti, varianti_immagine, MANIFEST_VARIANTI,
+                      VARIANTI)
+from models import db
+
+pytest.importorskip('PIL')
+from PIL import Image  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = crea_app_test(str(tmp_path), UPLOAD_FOLDER=str(tmp_path / 'imgs'))
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+# Carica un'immagine PNG come farebbe il form dell'admin
+def _carica(app, colore='red'):
+    dati = io.BytesIO()
+    Image.new('RGB', (1200, 800), colore).save(dati, format='PNG')
+    dati.seek(0)
+    with app.app_context():
+        return salva_upload(FileStorage(stream=dati, filename='foto.png'), 'png')
+
+
+def test_upload_nella_cartella_configurata(app):
+    nome = _carica(app)
+    assert os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], nome))
+
+
+def test_varianti_dal_manifest_senza_accedere_ai_file(app, monkeypatch):
+    nome = _carica(app)
+    with app.app_context():
+        assert genera_varianti(nome) == len(VARIANTI) * 2
+    cartella_varianti = os.path.join(app.config['UPLOAD_FOLDER'], 'varianti')
+    with open(os.path.join(cartella_varianti, MANIFEST_VARIANTI)) as file:
+        assert set(json.load(file)[os.path.splitext(nome)[0]]) == set(VARIANTI)
+
+    stat = os.stat
+    controlli = []
+    monkeypatch.setattr(immagini.os, 'stat', lambda *a, **k: controlli.append(a) or stat(*a, **k))
+    monkeypatch.setattr(immagini.os.path, 'exists', lambda percorso: pytest.fail(f'os.path.exists({percorso})'))
+    with app.app_context():
+        for _ in range(20):
+            risultato = varianti_immagine(nome)
+    # Un solo controllo del manifest per contesto, non uno per immagine o variante
+    assert len(controlli) == 1
+    assert risultato['originale'] == nome
+    assert [v['nome'] for v in risultato['varianti']] == list(VARIANTI)
+    for variante in risultato['varianti']:
+        for formato in ('jpg', 'webp'):
+            assert os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], variante[formato]))
+
+
+# Le varianti generate (anche da un altro processo) compaiono alla richiesta
+# successiva, perché il manifest è cambiato
+def test_nuove_varianti_visibili_alla_richiesta_successiva(app):
+    prima, seconda = _carica(app, 'red'), _carica(app, 'blue')
+    with app.app_context():
+        genera_varianti(prima)
+    with app.app_context():
+        assert varianti_immagine(seconda)['varianti'] == []
+    with app.app_context():
+        genera_varianti(seconda)
+    with app.app_context():
+        assert len(varianti_immagine(seconda)['varianti']) == len(VARIANTI)
+        assert len(varianti_immagine(prima)['varianti']) == len(VARIANTI)
+
+
+# Varianti generate prima del manifest: l'indice viene ricavato dai file, e
+# scrivi_manifest_varianti (usata da 'flask genera-varianti') crea il manifest
+def test_varianti_senza_manifest(app):
+    nome = _carica(app)
+    with app.app_context():
+        genera_varianti(nome, manifest=False)
+    manifest = os.path.join(app.config['UPLOAD_FOLDER'], 'varianti', MANIFEST_VARIANTI)
+    assert not os.path.exists(manifest)
+    with app.app_context():
+        assert len(varianti_immagine(nome)['varianti']) == len(VARIANTI)
+        scrivi_manifest_varianti()
+    assert os.path.exists(manifest)
+
+
+def test_immagine_senza_varianti(app):
+    with app.app_context():
+        assert varianti_immagine(None) is None
+        assert varianti_immagine('inesistente.jpg') == {'originale': 'inesistente.jpg', 'varianti': []}
@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+import pytest
+from sqlalchemy import event
+from conftest import crea_app_test
+from models import db, Lotto, Prenotazione, BIND_LETTURA
+from settings import SQLITE_PRAGMAS
+
+LETTORI = 4
+SCRITTORI = 4
+LOTTI = 5
+LETTURE = 10
+
+
+# App con il database in sola lettura configurato sullo stesso file del
+# database principale, come in produzione con GAS_DATABASE_READONLY_PATH
+@pytest.fixture
+def app(tmp_path):
+    app = crea_app_test(str(tmp_path), DATABASE_READONLY_PATH=os.path.join(str(tmp_path), 'db.sqlite3'))
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def _crea_lotti(app, numero, qta_lotto=1000):
+    with app.app_context():
+        lotti = [Lotto(prodotto_id=1, data_consegna=date.today() + timedelta(days=1 + i), qta_unita_misura='pz',
+                       qta_lotto=qta_lotto, prezzo_unitario=1.0, sospeso=False) for i in range(numero)]
+        db.session.add_all(lotti)
+        db.session.commit()
+        return [l.id for l in lotti]
+
+
+# Nome del bind ('lettura' o None per il database principale) di ogni
+# istruzione SQL eseguita nel blocco
+def _bind_istruzioni(app, funzione):
+    with app.app_context():
+        engines = {engine: nome for nome, engine in db.engines.items()}
+    istruzioni = []
+    def registra(conn, cursor, statement, parameters, context, executemany):
+        istruzioni.append((engines[conn.engine], statement.split()[0].upper()))
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', registra)
+    try:
+        funzione()
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', registra)
+    return istruzioni
+
+
+def test_get_e_head_leggono_dal_database_in_sola_lettura(app, crea_cliente):
+    cliente = crea_cliente('lettore@test.it')
+    lotto_id = _crea_lotti(app, 1)[0]
+
+    for metodo in (cliente.get, cliente.head):
+        for url in ('/api/lotti', '/api/prenotazioni', f'/lotto/{lotto_id}'):
+            istruzioni = _bind_istruzioni(app, lambda: metodo(url))
+            assert istruzioni
+            assert {bind for bind, _ in istruzioni} == {BIND_LETTURA}, (metodo, url, istruzioni)
+
+    # Le richieste POST leggono e scrivono sul database principale
+    istruzioni = _bind_istruzioni(app, lambda: cliente.post(f'/lotto/{lotto_id}', data={'quantita': 2}))
+    assert 'INSERT' in {tipo for _, tipo in istruzioni}
+    assert {bind for bind, _ in istruzioni} == {None}
+
+
+def test_connessione_in_sola_lettura_non_scrive(app):
+    with app.app_context():
+        with db.engines[BIND_LETTURA].connect() as conn:
+            with pytest.raises(Exception, match='readonly'):
+                conn.exec_driver_sql("UPDATE lotti SET sospeso = 1")
+
+
+def test_letture_e_scritture_concorrenti(app, crea_cliente):
+    lotti = _crea_lotti(app, LOTTI)
+    scrittori = [crea_cliente(f'scrittore{i}@test.it') for i in range(SCRITTORI)]
+    lettori = [crea_cliente(f'lettore{i}@test.it') for i in range(LETTORI)]
+    partenza = threading.Barrier(SCRITTORI + LETTORI)
+    errori = []
+
+    def scrivi(cliente):
+        partenza.wait()
+        for lotto_id in lotti:
+            risposta = cliente.post(f'/lotto/{lotto_id}', data={'quantita': 1})
+            if risposta.status_code != 302:
+                errori.append(('scrittura', lotto_id, risposta.status_code))
+
+    def leggi(cliente):
+        partenza.wait()
+        for i in range(LETTURE):
+            url = '/api/lotti' if i % 2 else '/api/prenotazioni'
+            risposta = cliente.get(url)
+            if risposta.status_code != 200:
+                errori.append(('lettura', url, risposta.status_code))
+
+    threads = ([threading.Thread(target=scrivi, args=(c,)) for c in scrittori]
+               + [threading.Thread(target=leggi, args=(c,)) for c in lettori])
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errori, errori
+    with app.app_context():
+        assert Prenotazione.query.filter(Prenotazione.lotto_id.in_(lotti)).count() == SCRITTORI * LOTTI
+    # Al termine le letture vedono tutte le scritture
+    disponibili = {l['id']: l['get_qta_disponibile'] for l in lettori[0].get('/api/lotti').get_json()}
+    assert all(disponibili[lotto_id] == 1000 - SCRITTORI for lotto_id in lotti)
+
+
+def test_busy_timeout_su_tutte_le_connessioni(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            with engine.connect() as conn:
+                assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == SQLITE_PRAGMAS['busy_timeout']
+
+
+# Una scrittura mentre un altro processo tiene il lock di scrittura attende
+# che venga rilasciato (busy_timeout) invece di fallire con "database is locked"
+def test_scrittura_attende_il_lock(app, crea_cliente):
+    cliente = crea_cliente('attesa@test.it')
+    lotto_id = _crea_lotti(app, 1)[0]
+    attesa = 0.5
+    assert SQLITE_PRAGMAS['busy_timeout'] > attesa * 1000 * 2
+
+    with app.app_context():
+        percorso = db.engine.url.database
+    esterna = sqlite3.connect(percorso, isolation_level=None, check_same_thread=False)
+    esterna.execute('BEGIN IMMEDIATE')
+    rilascio = threading.Timer(attesa, esterna.commit)
+    rilascio.start()
+    try:
+        inizio = time.perf_counter()
+        risposta = cliente.post(f'/lotto/{lotto_id}', data={'quantita': 1})
+        durata = time.perf_counter() - inizio
+    finally:
+        rilascio.join()
+        esterna.close()
+
+    assert risposta.status_code == 302
+    assert durata >= attesa * 0.8
+    with app.app_context():
+        assert Prenotazione.query.filter_by(lotto_id=lotto_id).count() == 1
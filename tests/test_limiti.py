@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+import pytest
+from conftest import configurazione_test, crea_app_test
+from models import db
+
+PROCESSI = 4
+RICHIESTE = 30
+# Limite di default di estensioni.limiter che vale per /api/lotti
+LIMITE_ORARIO = 50
+
+
+# Eseguito in un processo separato: crea la sua app, con lo storage dei
+# limiti condiviso, e restituisce i codici delle risposte a /api/lotti
+def _richieste(cartella, storage_uri, strategia, partenza):
+    from app import create_app
+    app = create_app(configurazione_test(cartella, RATELIMIT_ENABLED=True, RATELIMIT_STORAGE_URI=storage_uri,
+                                         RATELIMIT_STRATEGY=strategia))
+    cliente = app.test_client()
+    partenza.wait()
+    codici = [cliente.get('/api/lotti').status_code for _ in range(RICHIESTE)]
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    return codici
+
+
+@pytest.mark.parametrize('strategia', ['moving-window', 'fixed-window'])
+def test_limite_condiviso_tra_processi(tmp_path, strategia):
+    cartella = str(tmp_path)
+    app = crea_app_test(cartella)
+    with app.app_context():
+        db.engine.dispose()
+    storage_uri = 'sqlite:///' + os.path.join(cartella, 'limiti.sqlite3')
+
+    contesto = multiprocessing.get_context('spawn')
+    with contesto.Manager() as manager, contesto.Pool(PROCESSI) as pool:
+        partenza = manager.Barrier(PROCESSI)
+        risultati = pool.starmap(_richieste, [(cartella, storage_uri, strategia, partenza)] * PROCESSI)
+
+    codici = [codice for codici in risultati for codice in codici]
+    assert set(codici) == {200, 429}
+    # Il limite vale per tutti i processi insieme: con un contatore per
+    # processo le risposte accettate sarebbero PROCESSI * RICHIESTE
+    assert codici.count(200) == LIMITE_ORARIO
@@ -0,0 +1,26 @@
+import pytest
+import viste_admin
+
+TOKEN = 'token-di-prova'
+
+
+def test_metriche_senza_token_non_esposte(client, monkeypatch):
+    monkeypatch.setattr(viste_admin, 'METRICHE_TOKEN', None)
+    client.get('/api/lotti')
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 404
+
+
+@pytest.mark.parametrize('intestazione', [None, 'Bearer sbagliato', TOKEN, f'Basic {TOKEN}'])
+def test_metriche_token_errato(client, monkeypatch, intestazione):
+    monkeypatch.setattr(viste_admin, 'METRICHE_TOKEN', TOKEN)
+    headers = {'Authorization': intestazione} if intestazione else {}
+    assert client.get('/metrics', headers=headers).status_code == 401
+
+
+def test_metriche_con_token(client, monkeypatch):
+    monkeypatch.setattr(viste_admin, 'METRICHE_TOKEN', TOKEN)
+    client.get('/api/lotti')
+    risposta = client.get('/metrics', headers={'Authorization': f'Bearer {TOKEN}'})
+    assert risposta.status_code == 200
+    assert risposta.mimetype == 'text/plain'
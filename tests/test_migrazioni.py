@@ -0,0 +1,77 @@
+import sqlite3
+import pytest
+import migrazioni
+from migrazioni import MIGRAZIONI, migra, get_versione_schema, verifica_piani_query
+from models import db
+
+
+def _conta(tabella):
+    return db.session.execute(db.text(f'SELECT count(*) FROM {tabella}')).scalar()
+
+
+def _tabelle():
+    return set(db.session.execute(db.text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+
+
+# Riporta il database allo schema precedente alle migrazioni: senza trigger,
+# tabelle delle versioni e indice di ricerca, con user_version 0
+def _schema_versione_zero():
+    for (nome,) in db.session.execute(db.text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).all():
+        db.session.execute(db.text(f'DROP TRIGGER {nome}'))
+    for tabella in ('ricerca_prodotti', 'versioni_prenotazioni', 'modifiche_prenotazioni'):
+        db.session.execute(db.text(f'DROP TABLE {tabella}'))
+    db.session.execute(db.text('PRAGMA user_version = 0'))
+    db.session.commit()
+
+
+def test_database_nuovo_alla_versione_corrente(app):
+    with app.app_context():
+        assert get_versione_schema() == len(MIGRAZIONI)
+        assert migra() == len(MIGRAZIONI)
+
+
+# Tutte le migrazioni, a partire dalla versione 0, conservano i dati e creano
+# l'indice di ricerca
+def test_migrazioni_da_versione_zero(app):
+    with app.app_context():
+        conteggi = {tabella: _conta(tabella) for tabella in ('users', 'lotti', 'prenotazioni', 'prodotti')}
+        _schema_versione_zero()
+
+        assert migra() == len(MIGRAZIONI)
+        assert get_versione_schema() == len(MIGRAZIONI)
+        assert {tabella: _conta(tabella) for tabella in conteggi} == conteggi
+        assert _conta('ricerca_prodotti') == conteggi['prodotti']
+        assert not {'lotti_nuova', 'prenotazioni_nuova'} & _tabelle()
+
+
+# Una migrazione che fallisce a metà viene annullata per intero, compresa la
+# user_version; una volta corretta viene applicata
+def test_migrazione_fallita_annullata(app, monkeypatch):
+    versione = len(MIGRAZIONI)
+    monkeypatch.setattr(migrazioni, 'MIGRAZIONI', [*MIGRAZIONI, [
+        'CREATE TABLE prova_migrazione (id INTEGER PRIMARY KEY)',
+        'INSERT INTO prova_migrazione VALUES (1)',
+        'SELECT * FROM tabella_inesistente',
+    ]])
+    with app.app_context():
+        with pytest.raises(sqlite3.OperationalError, match='tabella_inesistente'):
+            migra()
+        assert get_versione_schema() == versione
+        assert 'prova_migrazione' not in _tabelle()
+
+        migrazioni.MIGRAZIONI[-1].pop()
+        assert migra() == versione + 1
+        assert get_versione_schema() == versione + 1
+        assert _conta('prova_migrazione') == 1
+
+
+def test_query_critiche_usano_indici(app):
+    with app.app_context():
+        assert verifica_piani_query() == {}
+
+
+def test_query_critiche_usano_indici_dopo_le_migrazioni(app):
+    with app.app_context():
+        _schema_versione_zero()
+        migra()
+        assert verifica_piani_query() == {}
@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
+from sqlalchemy import event
+from models import db, Lotto, Prenotazione, User
+
+# Numero massimo di istruzioni SQL per richiesta, qualunque sia il numero di
+# lotti e prenotazioni (compresa la lettura dell'utente loggato)
+MAX_ISTRUZIONI = 6
+
+
+# Conta le istruzioni SQL eseguite nel blocco, su tutti gli engine dell'app
+@contextmanager
+def conta_istruzioni(app):
+    istruzioni = []
+    def conta(conn, cursor, statement, parameters, context, executemany):
+        istruzioni.append(statement)
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', conta)
+    try:
+        yield istruzioni
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', conta)
+
+
+# Aggiunge 'numero' lotti, ognuno prenotato dall'utente 'email' e da un altro utente
+def _aggiungi_lotti(app, email, numero):
+    with app.app_context():
+        utente = User.query.filter_by(email=email).one()
+        altro = User(nome='Altro', cognome='Utente', telefono='', email=f'altro{numero}@test.it', password='x')
+        db.session.add(altro)
+        lotti = [Lotto(prodotto_id=1 + i % 5, data_consegna=date.today() + timedelta(days=i), qta_unita_misura='pz',
+                       qta_lotto=10, prezzo_unitario=2.5, sospeso=False) for i in range(numero)]
+        db.session.add_all(lotti)
+        db.session.flush()
+        db.session.add_all([Prenotazione(lotto_id=l.id, user_id=u.id, qta=1) for l in lotti for u in (utente, altro)])
+        db.session.commit()
+
+
+def _istruzioni_per(app, cliente, url):
+    with conta_istruzioni(app) as istruzioni:
+        risposta = cliente.get(url)
+    assert risposta.status_code == 200
+    return len(istruzioni)
+
+
+URL = ['/api/lotti', '/api/lotti?limit=50', '/api/lotti?limit=50&fields=id,get_qta_disponibile,rel_prodotto.nome_prodotto',
+       '/api/prenotazioni', '/api/prenotazioni?limit=50', '/api/prenotazioni?since=0']
+
+
+def test_numero_query_costante(app, crea_cliente):
+    cliente = crea_cliente('query@test.it')
+    _aggiungi_lotti(app, 'query@test.it', 3)
+    prima = {url: _istruzioni_per(app, cliente, url) for url in URL}
+
+    # Dopo l'aggiunta il catalogo in cache non è più valido e viene riletto
+    _aggiungi_lotti(app, 'query@test.it', 30)
+    dopo = {url: _istruzioni_per(app, cliente, url) for url in URL}
+
+    assert dopo == prima
+    assert max(dopo.values()) <= MAX_ISTRUZIONI, dopo
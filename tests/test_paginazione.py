@@ -0,0 +1,16 @@
+import pytest
+
+
+@pytest.mark.parametrize('campi', ['__class__', 'id,to_dict', 'rel_prenotazioni.rel_user.check_password',
+                                   'rel_prodotto.rel_produttore.query', 'password', 'inesistente'])
+def test_fields_rifiuta_attributi_non_esposti(client, campi):
+    risposta = client.get('/api/lotti', query_string={'fields': campi})
+    assert risposta.status_code == 400
+
+
+def test_fields_accetta_colonne_relazioni_e_metodi(client):
+    risposta = client.get('/api/lotti', query_string={'fields': 'id,get_date,rel_prodotto.nome_prodotto', 'limit': 2})
+    assert risposta.status_code == 200
+    for lotto in risposta.json['items']:
+        assert set(lotto) == {'id', 'get_date', 'rel_prodotto'}
+        assert set(lotto['rel_prodotto']) == {'nome_prodotto'}
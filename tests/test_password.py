@@ -0,0 +1,80 @@
+import json
+import pytest
+from werkzeug.security import check_password_hash, generate_password_hash
+import password
+from conftest import PASSWORD_TEST
+from importazione import importa_cartella
+from models import db, User
+from settings import PASSWORD_HASH_METHOD
+
+METODO_VECCHIO = 'pbkdf2:sha256:500'
+
+
+def _crea_utente(app, email, password_hash):
+    with app.app_context():
+        db.session.add(User(nome='P', cognome='P', telefono='', email=email, password=password_hash))
+        db.session.commit()
+
+
+def _hash_salvato(app, email):
+    with app.app_context():
+        return User.query.filter_by(email=email).one().password
+
+
+def _login(client, email):
+    return client.post('/login', data={'email': email, 'password': PASSWORD_TEST})
+
+
+# Al login un hash calcolato con parametri vecchi viene sostituito da uno con
+# i parametri attuali, e la password continua a funzionare
+def test_login_aggiorna_hash_vecchio(app, client):
+    assert METODO_VECCHIO != PASSWORD_HASH_METHOD
+    _crea_utente(app, 'vecchio@test.it', generate_password_hash(PASSWORD_TEST, method=METODO_VECCHIO))
+    assert password.richiede_rehash(_hash_salvato(app, 'vecchio@test.it'))
+
+    assert _login(client, 'vecchio@test.it').headers['Location'] == '/'
+    nuovo = _hash_salvato(app, 'vecchio@test.it')
+    assert nuovo.startswith(PASSWORD_HASH_METHOD + '$')
+    assert not password.richiede_rehash(nuovo)
+    assert check_password_hash(nuovo, PASSWORD_TEST)
+
+    assert _login(app.test_client(), 'vecchio@test.it').headers['Location'] == '/'
+
+
+def test_login_non_riscrive_hash_attuale(app, client):
+    attuale = generate_password_hash(PASSWORD_TEST, method=PASSWORD_HASH_METHOD)
+    _crea_utente(app, 'attuale@test.it', attuale)
+    assert _login(client, 'attuale@test.it').headers['Location'] == '/'
+    assert _hash_salvato(app, 'attuale@test.it') == attuale
+
+
+def test_login_password_errata_non_riscrive(app, client):
+    vecchio = generate_password_hash(PASSWORD_TEST, method=METODO_VECCHIO)
+    _crea_utente(app, 'errata@test.it', vecchio)
+    client.post('/login', data={'email': 'errata@test.it', 'password': 'Sbagliata<1'})
+    assert _hash_salvato(app, 'errata@test.it') == vecchio
+
+
+# Il pool non duplica con fork il processo (e i suoi thread) che lo crea
+def test_pool_senza_fork(monkeypatch):
+    monkeypatch.setattr(password, 'PASSWORD_PROCESSI', 1)
+    monkeypatch.setattr(password, '_pool', None)
+    try:
+        password_hash = password.hash_password(PASSWORD_TEST)
+        assert password.verifica_password(password_hash, PASSWORD_TEST)
+        assert password._pool._mp_context.get_start_method() in ('forkserver', 'spawn')
+    finally:
+        password._pool.shutdown()
+
+
+@pytest.mark.parametrize('processi', [1, 2])
+def test_importazione_calcola_hash(app, tmp_path, processi):
+    (tmp_path / 'users.json').write_text(json.dumps([
+        {'nome': 'I', 'cognome': str(i), 'telefono': '', 'email': f'imp{i}@test.it', 'password': PASSWORD_TEST}
+        for i in range(3)]))
+    with app.app_context():
+        importa_cartella(str(tmp_path), processi=processi, log=lambda *_: None)
+    for i in range(3):
+        password_hash = _hash_salvato(app, f'imp{i}@test.it')
+        assert password_hash.startswith(PASSWORD_HASH_METHOD + '$')
+        assert check_password_hash(password_hash, PASSWORD_TEST)
@@ -0,0 +1,123 @@
+import csv
+import io
+from datetime import date, timedelta
+import pytest
+import viste_admin
+from archivio import archivia
+from models import db, Lotto, Prenotazione, User
+from report import righe_report, COLONNE
+
+PASSWORD_ADMIN = 'Ciotola<1'
+OGGI = date.today()
+PASSATO = OGGI - timedelta(days=400)
+
+
+@pytest.fixture
+def admin(app):
+    cliente = app.test_client()
+    risposta = cliente.post('/login', data={'email': 'admin@admin.com', 'password': PASSWORD_ADMIN})
+    assert risposta.status_code == 302
+    return cliente
+
+
+# Lotti del prodotto 1 (produttore 1) con le prenotazioni di due soci:
+# {data di consegna: [(qta_lotto, prezzo_unitario, [qta prenotate])]}
+def _crea_lotti(app, lotti):
+    with app.app_context():
+        prima = min(lotti).isoformat()
+        soci = [User(nome='Socio', cognome=str(i), telefono='', email=f'report{i}-{prima}@test.it', password='x')
+                for i in range(2)]
+        db.session.add_all(soci)
+        ids = []
+        for data_consegna, righe in lotti.items():
+            for qta_lotto, prezzo, prenotate in righe:
+                lotto = Lotto(prodotto_id=1, data_consegna=data_consegna, qta_unita_misura='kg',
+                              qta_lotto=qta_lotto, prezzo_unitario=prezzo, sospeso=False)
+                db.session.add(lotto)
+                db.session.flush()
+                db.session.add_all([Prenotazione(lotto_id=lotto.id, user_id=soci[i].id, qta=qta)
+                                    for i, qta in enumerate(prenotate)])
+                ids.append(lotto.id)
+        db.session.commit()
+        return ids
+
+
+def _filtri(data_consegna):
+    return {'data_da': data_consegna, 'data_a': data_consegna}
+
+
+def test_righe_report(app):
+    consegna = OGGI + timedelta(days=3)
+    primo, secondo = _crea_lotti(app, {consegna: [(10, 2.5, [3, 1]), (20, 1.0, [])]})
+    with app.app_context():
+        lotti = list(righe_report('lotti', **_filtri(consegna)))
+        assert [(r.lotto_id, r.qta_prenotata, r.prenotazioni, r.ricavo, r.riempimento) for r in lotti] == [
+            (primo, 4, 2, 10.0, 0.4), (secondo, 0, 0, 0.0, 0.0)]
+
+        produttori, = righe_report('produttori', **_filtri(consegna))
+        assert (produttori.lotti, produttori.prenotazioni, produttori.ricavo, produttori.riempimento_medio) == \
+            (2, 2, 10.0, 0.2)
+
+        ritiro = list(righe_report('ritiro', **_filtri(consegna)))
+        assert [(r.cognome, r.lotto_id, r.qta, r.importo) for r in ritiro] == [('0', primo, 3, 7.5), ('1', primo, 1, 2.5)]
+
+        assert len(list(righe_report('lotti', limite=1, **_filtri(consegna)))) == 1
+        assert list(righe_report('lotti', produttore_id=2, **_filtri(consegna))) == []
+
+
+# Con 'storico' i lotti archiviati compaiono insieme a quelli attivi, senza duplicati
+def test_righe_report_storico(app):
+    archiviato, = _crea_lotti(app, {PASSATO: [(10, 1.0, [2, 2])]})
+    attivo, = _crea_lotti(app, {OGGI: [(10, 1.0, [5])]})
+    with app.app_context():
+        archivia(prima_del=OGGI - timedelta(days=365))
+
+        filtri = {'data_da': PASSATO, 'data_a': OGGI}
+        assert [r.lotto_id for r in righe_report('lotti', **filtri)] == [attivo]
+        storico = list(righe_report('lotti', storico=True, **filtri))
+        assert [(r.lotto_id, r.qta_prenotata, r.prenotazioni) for r in storico] == [(archiviato, 4, 2), (attivo, 5, 1)]
+        assert [r.qta for r in righe_report('ritiro', storico=True, **filtri)] == [2, 2, 5]
+
+
+def test_report_csv(app, admin):
+    consegna = OGGI + timedelta(days=3)
+    lotto, = _crea_lotti(app, {consegna: [(10, 2.5, [3, 1])]})
+    parametri = {'data_da': consegna.isoformat(), 'data_a': consegna.isoformat()}
+
+    for nome in COLONNE:
+        risposta = admin.get(f'/report/{nome}.csv', query_string=parametri)
+        assert risposta.status_code == 200
+        assert risposta.mimetype == 'text/csv'
+        assert risposta.headers['Content-Disposition'] == f'attachment; filename=report-{nome}.csv'
+        righe = list(csv.reader(io.StringIO(risposta.get_data(as_text=True))))
+        assert righe[0] == COLONNE[nome]
+        assert len(righe) == {'lotti': 2, 'produttori': 2, 'ritiro': 3}[nome]
+
+    righe = list(csv.DictReader(io.StringIO(admin.get('/report/lotti.csv', query_string=parametri).get_data(as_text=True))))
+    assert (righe[0]['lotto_id'], righe[0]['data_consegna'], righe[0]['qta_prenotata'], righe[0]['ricavo']) == \
+        (str(lotto), consegna.isoformat(), '4', '10.0')
+
+    assert admin.get('/report/altro.csv').status_code == 404
+    assert admin.get('/report/lotti.csv', query_string={'data_da': 'ieri'}).status_code == 400
+
+
+def test_report_csv_solo_admin(app, crea_cliente):
+    assert app.test_client().get('/report/lotti.csv').status_code == 302
+    assert crea_cliente('socio@test.it').get('/report/lotti.csv').status_code == 302
+
+
+# La pagina mostra al massimo RIGHE_PAGINA_MAX lotti e rimanda al CSV
+def test_report_pagina_limitata(app, admin, monkeypatch):
+    consegna = OGGI + timedelta(days=3)
+    _crea_lotti(app, {consegna: [(10, 1.0, [1])] * 3})
+    parametri = {'data_da': consegna.isoformat(), 'data_a': consegna.isoformat()}
+
+    testo = admin.get('/report', query_string=parametri).get_data(as_text=True)
+    assert testo.count('cod. lotto') == 3
+    assert "l'elenco completo" not in testo
+
+    monkeypatch.setattr(viste_admin, 'RIGHE_PAGINA_MAX', 2)
+    testo = admin.get('/report', query_string=parametri).get_data(as_text=True)
+    assert testo.count('cod. lotto') == 2
+    assert "l'elenco completo" in testo
+    assert '/report/lotti.csv?' in testo
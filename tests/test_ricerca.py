@@ -0,0 +1,56 @@
+from datetime import date, timedelta
+from models import db, Lotto, Prenotazione, Prodotto, User
+from ricerca import cerca_lotti
+
+
+# Prodotto 'nome' con un lotto per ogni (quantità, quantità prenotata, sospeso)
+def _prodotto_con_lotti(nome, lotti):
+    prodotto = Prodotto(produttore_id=1, nome_prodotto=nome)
+    utente = User(nome='R', cognome='R', telefono='', email=f'{nome.replace(" ", "")}@test.it', password='x')
+    db.session.add_all([prodotto, utente])
+    db.session.flush()
+    ids = []
+    for qta_lotto, prenotata, sospeso in lotti:
+        lotto = Lotto(prodotto_id=prodotto.id, data_consegna=date.today() + timedelta(days=2), qta_unita_misura='pz',
+                      qta_lotto=qta_lotto, prezzo_unitario=1.0, sospeso=sospeso)
+        db.session.add(lotto)
+        db.session.flush()
+        if prenotata:
+            db.session.add(Prenotazione(lotto_id=lotto.id, user_id=utente.id, qta=prenotata))
+        ids.append(lotto.id)
+    db.session.commit()
+    return ids
+
+
+# Solo i lotti con quantità ancora disponibile, non sospesi
+def test_ricerca_esclude_lotti_esauriti(app):
+    with app.app_context():
+        disponibile, esaurito, sospeso = _prodotto_con_lotti('Zucchine Tonde', [(10, 4, False), (5, 5, False), (10, 0, True)])
+        _prodotto_con_lotti('Zucchine Lunghe', [(3, 3, False)])
+
+        risultati = cerca_lotti('zucchine')
+        assert [(r['id'], r['qta_disponibile']) for r in risultati] == [(disponibile, 6)]
+
+
+def test_ricerca_senza_parole(app):
+    with app.app_context():
+        assert cerca_lotti(' ,; ') == []
+
+
+
+# Il prodotto più pertinente viene trovato anche se è il più vecchio tra
+# migliaia di prodotti con lotti prenotabili che corrispondono alla ricerca
+def test_ricerca_ordina_tutti_i_prodotti_trovati(app):
+    with app.app_context():
+        pertinente = _prodotto_con_lotti('Cavolo Nero', [(10, 0, False)])[0]
+        prodotti = db.session.execute(db.insert(Prodotto).returning(Prodotto.id), [
+            {'produttore_id': 1, 'nome_prodotto': f'Cesto {i} con cavolo e verdure di stagione assortite'}
+            for i in range(2500)]).scalars().all()
+        db.session.execute(db.insert(Lotto), [
+            {'prodotto_id': prodotto_id, 'data_consegna': date.today() + timedelta(days=2), 'qta_unita_misura': 'pz',
+             'qta_lotto': 10, 'prezzo_unitario': 1.0, 'sospeso': False} for prodotto_id in prodotti])
+        db.session.commit()
+
+        risultati = cerca_lotti('cavolo', limite=5)
+        assert len(risultati) == 5
+        assert risultati[0]['id'] == pertinente
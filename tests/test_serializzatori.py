@@ -0,0 +1,56 @@
+import pytest
+from datetime import date, timedelta
+from models import db, Lotto, Prenotazione, Prodotto, User
+from serializzatori import SERIALIZZATORI, serializza
+
+
+# Aggiunge ai dati di esempio un lotto sospeso, uno senza prenotazioni e
+# prenotazioni di più utenti, per coprire anche i valori meno comuni
+def _aggiungi_dati(app):
+    with app.app_context():
+        utenti = [User(nome='N', cognome=str(i), telefono=None, email=f'ser{i}@test.it', password='x')
+                  for i in range(2)]
+        lotti = [Lotto(prodotto_id=1, data_consegna=date.today() + timedelta(days=3), qta_unita_misura='Kg',
+                       qta_lotto=10, prezzo_unitario=1.25, sospeso=sospeso) for sospeso in (True, False, None)]
+        db.session.add_all([*utenti, *lotti])
+        db.session.flush()
+        db.session.add_all([Prenotazione(lotto_id=lotti[0].id, user_id=u.id, qta=2) for u in utenti])
+        db.session.commit()
+
+
+# I serializzatori compilati producono lo stesso output di to_dict() per
+# tutti i record di tutti i modelli
+@pytest.mark.parametrize('model', list(SERIALIZZATORI), ids=lambda model: model.__name__)
+def test_output_identico_a_to_dict(app, model):
+    _aggiungi_dati(app)
+    with app.app_context():
+        oggetti = model.query.all()
+        assert oggetti
+        for obj in oggetti:
+            assert serializza(obj) == obj.to_dict(), f'{model.__name__} {obj.id}'
+
+
+@pytest.mark.parametrize('model, campi', [
+    (Lotto, ('id', 'get_qta_disponibile', 'rel_prodotto.nome_prodotto')),
+    (Lotto, ('data_consegna', 'rel_prodotto.rel_produttore.nome_produttore')),
+    (Prenotazione, ('id', 'qta', 'rel_lotto.data_consegna', 'rel_lotto.rel_prodotto.nome_prodotto')),
+])
+def test_proiezione_identica_a_to_dict_only(app, model, campi):
+    _aggiungi_dati(app)
+    with app.app_context():
+        for obj in model.query.all():
+            assert serializza(obj, campi) == obj.to_dict(only=campi), f'{model.__name__} {obj.id}'
+
+
+
+# Le varianti delle immagini servono solo ai template (vedi Prodotto.get_immagini):
+# non compaiono in to_dict() né nelle API
+def test_api_senza_varianti_immagini(app, client):
+    lotti = client.get('/api/lotti').get_json()
+    assert lotti and all('get_immagini' not in lotto['rel_prodotto'] for lotto in lotti)
+    assert client.get('/api/lotti?limit=5&fields=id,rel_prodotto.get_immagini').status_code == 400
+
+    with app.app_context():
+        prodotto = Prodotto.query.first()
+        assert 'get_immagini' not in prodotto.to_dict()
+        assert 'get_immagini' not in serializza(prodotto)
@@ -0,0 +1,123 @@
+from datetime import date, timedelta
+from models import db, Lotto, Prenotazione, User
+from prenotazioni import pulisci_eliminate
+
+DATA_CONSEGNA = date.today() + timedelta(days=10)
+
+
+def _crea_lotti(app, numero):
+    with app.app_context():
+        lotti = [Lotto(prodotto_id=1, data_consegna=DATA_CONSEGNA + timedelta(days=i), qta_unita_misura='Kg',
+                       qta_lotto=100, prezzo_unitario=2.5, sospeso=False) for i in range(numero)]
+        db.session.add_all(lotti)
+        db.session.commit()
+        return [l.id for l in lotti]
+
+
+def _id_prenotazione(app, email, lotto_id):
+    with app.app_context():
+        utente = User.query.filter_by(email=email).one()
+        return Prenotazione.query.filter_by(user_id=utente.id, lotto_id=lotto_id).one().id
+
+
+def _sincronizza(cliente, dal):
+    risposta = cliente.get(f'/api/prenotazioni?since={dal}')
+    assert risposta.status_code == 200
+    return risposta.get_json()
+
+
+def _riga(app, prenotazione_id, qta, prezzo=2.5):
+    with app.app_context():
+        prenotazione = db.session.get(Prenotazione, prenotazione_id)
+        lotto, nome = prenotazione.rel_lotto, prenotazione.rel_lotto.rel_prodotto.nome_prodotto
+        return {'id': prenotazione_id, 'lotto_id': lotto.id, 'qta': qta, 'data_consegna': lotto.data_consegna.isoformat(),
+                'prezzo_unitario': prezzo, 'qta_unita_misura': 'Kg', 'nome_prodotto': nome,
+                'totale': round(qta * prezzo, 2)}
+
+
+def _delta(risposta):
+    return risposta['versione'], risposta['completo'], risposta['prenotazioni'], risposta['eliminate']
+
+
+def test_sincronizzazione_incrementale(app, crea_cliente):
+    cliente, altro = crea_cliente('sync@test.it'), crea_cliente('altro@test.it')
+    l1, l2, l3 = _crea_lotti(app, 3)
+
+    assert _delta(_sincronizza(cliente, 0)) == (0, True, [], [])
+
+    # Due prenotazioni: versioni 1 e 2
+    assert cliente.post(f'/lotto/{l1}', data={'quantita': 2}).status_code == 302
+    assert cliente.post(f'/lotto/{l2}', data={'quantita': 4}).status_code == 302
+    p1, p2 = _id_prenotazione(app, 'sync@test.it', l1), _id_prenotazione(app, 'sync@test.it', l2)
+    risposta = _sincronizza(cliente, 0)
+    assert _delta(risposta) == (2, True, [_riga(app, p1, 2), _riga(app, p2, 4)], [])
+    assert (risposta['totale'], risposta['numero']) == (15.0, 2)
+    assert _delta(_sincronizza(cliente, 1)) == (2, False, [_riga(app, p2, 4)], [])
+
+    # Le prenotazioni di un altro utente non cambiano la versione né il delta
+    assert altro.post(f'/lotto/{l1}', data={'quantita': 1}).status_code == 302
+    assert altro.post(f'/lotto/{l3}', data={'quantita': 1}).status_code == 302
+    assert _delta(_sincronizza(cliente, 2)) == (2, False, [], [])
+
+    # Modifica: versione 3, solo la prenotazione modificata
+    risposta = cliente.post('/api/prenotazione/modifica', json={'id': p1, 'quantita': 5})
+    assert risposta.status_code == 200 and risposta.get_json()['versione'] == 3
+    assert _delta(_sincronizza(cliente, 2)) == (3, False, [_riga(app, p1, 5)], [])
+
+    # Eliminazione: versione 4, riportata tra le eliminate
+    risposta = cliente.post('/api/prenotazione/elimina', json={'id': p2})
+    assert risposta.status_code == 200 and risposta.get_json()['versione'] == 4
+    assert _delta(_sincronizza(cliente, 3)) == (4, False, [], [p2])
+    assert _delta(_sincronizza(cliente, 2)) == (4, False, [_riga(app, p1, 5)], [p2])
+
+    # Il prezzo del lotto cambia: il trigger segna le prenotazioni di tutti
+    # gli utenti del lotto, ognuno con la propria versione
+    with app.app_context():
+        db.session.get(Lotto, l1).prezzo_unitario = 3.0
+        db.session.commit()
+    risposta = _sincronizza(cliente, 4)
+    assert _delta(risposta) == (5, False, [_riga(app, p1, 5, prezzo=3.0)], [])
+    assert (risposta['totale'], risposta['numero']) == (15.0, 1)
+    p_altro = _id_prenotazione(app, 'altro@test.it', l1)
+    assert _delta(_sincronizza(altro, 2)) == (3, False, [_riga(app, p_altro, 1, prezzo=3.0)], [])
+
+    # Le modifiche ai lotti senza prenotazioni dell'utente non lo riguardano
+    with app.app_context():
+        db.session.get(Lotto, l3).prezzo_unitario = 9.0
+        db.session.commit()
+    assert _delta(_sincronizza(cliente, 5)) == (5, False, [], [])
+
+    # L'eliminazione di un altro utente non compare
+    assert altro.post('/api/prenotazione/elimina', json={'id': p_altro}).status_code == 200
+    assert _delta(_sincronizza(cliente, 5)) == (5, False, [], [])
+    assert p_altro in _sincronizza(altro, 3)['eliminate']
+
+
+def test_sincronizzazione_completa(app, crea_cliente):
+    cliente = crea_cliente('completa@test.it')
+    l1, l2 = _crea_lotti(app, 2)
+    cliente.post(f'/lotto/{l1}', data={'quantita': 1})
+    cliente.post(f'/lotto/{l2}', data={'quantita': 1})
+    p1, p2 = _id_prenotazione(app, 'completa@test.it', l1), _id_prenotazione(app, 'completa@test.it', l2)
+    cliente.post('/api/prenotazione/elimina', json={'id': p2})
+
+    # Versione futura (es. database ripristinato): tutte le prenotazioni
+    assert _delta(_sincronizza(cliente, 99)) == (3, True, [_riga(app, p1, 1)], [])
+
+    # Dopo la pulizia delle eliminazioni le versioni precedenti non bastano
+    # più per un aggiornamento incrementale
+    with app.app_context():
+        pulisci_eliminate(db.session.connection())
+        db.session.commit()
+    assert _delta(_sincronizza(cliente, 2)) == (3, True, [_riga(app, p1, 1)], [])
+    assert _delta(_sincronizza(cliente, 3)) == (3, False, [], [])
+
+    # La modifica successiva riparte in modo incrementale
+    cliente.post('/api/prenotazione/modifica', json={'id': p1, 'quantita': 2})
+    assert _delta(_sincronizza(cliente, 3)) == (4, False, [_riga(app, p1, 2)], [])
+
+
+def test_since_non_valido(app, crea_cliente):
+    cliente = crea_cliente('since@test.it')
+    for valore in ('-1', 'abc', ''):
+        assert cliente.get(f'/api/prenotazioni?since={valore}').status_code == 400
@@ -0,0 +1,97 @@
+import json
+import pytest
+from flask import Flask, url_for
+import statici
+from statici import registra_statici, build_statici, NOME_MANIFEST
+
+
+@pytest.fixture
+def cartella(tmp_path):
+    (tmp_path / 'scripts').mkdir()
+    (tmp_path / 'scripts' / 'lotti.js').write_text('console.log("lotti");\n' * 100)
+    (tmp_path / 'styles.css').write_text('body { color: black; }\n')
+    return tmp_path
+
+
+# Conta i file letti per calcolarne l'hash
+@pytest.fixture
+def hash_calcolati(monkeypatch):
+    calcolati = []
+    hash_file = statici._hash_file
+    def conta(percorso):
+        calcolati.append(percorso)
+        return hash_file(percorso)
+    monkeypatch.setattr(statici, '_hash_file', conta)
+    return calcolati
+
+
+def _crea_app(cartella, debug=False):
+    app = Flask(__name__, static_folder=str(cartella), static_url_path='/static')
+    app.debug = debug
+    registra_statici(app)
+    return app
+
+
+def _url(app, filename):
+    with app.test_request_context():
+        return url_for('static', filename=filename)
+
+
+def test_manifest_salvato_senza_calcolare_hash(cartella, hash_calcolati):
+    manifest, _ = build_statici(str(cartella))
+    hash_calcolati.clear()
+
+    app = _crea_app(cartella)
+    assert app.extensions['manifest_statici'] == manifest
+    assert _url(app, 'scripts/lotti.js') == '/static/' + manifest['scripts/lotti.js']
+    risposta = app.test_client().get(_url(app, 'styles.css'))
+    assert risposta.status_code == 200
+    assert risposta.cache_control.immutable
+    assert hash_calcolati == []
+
+
+def test_senza_manifest_hash_al_primo_url_for(cartella, hash_calcolati):
+    app = _crea_app(cartella)
+    assert hash_calcolati == []
+
+    url = _url(app, 'scripts/lotti.js')
+    assert url == '/static/' + statici.costruisci_manifest(str(cartella))['scripts/lotti.js']
+    hash_calcolati.clear()
+    # L'hash di ogni file viene calcolato una sola volta
+    assert _url(app, 'scripts/lotti.js') == url
+    assert hash_calcolati == []
+    assert app.test_client().get(url).status_code == 200
+    assert hash_calcolati == []
+    # File che non esiste: l'URL resta quello senza hash
+    assert _url(app, 'manca.js') == '/static/manca.js'
+
+
+def test_url_con_hash_prima_di_url_for(cartella):
+    url = _url(_crea_app(cartella), 'scripts/lotti.js')
+
+    # Un altro worker riceve l'URL generato dal primo
+    cliente = _crea_app(cartella).test_client()
+    risposta = cliente.get(url)
+    assert risposta.status_code == 200
+    assert risposta.cache_control.immutable
+    assert risposta.headers['Vary'] == 'Accept-Encoding'
+
+
+def test_url_con_hash_sbagliato(cartella):
+    cliente = _crea_app(cartella).test_client()
+    assert cliente.get('/static/scripts/lotti.0123456789ab.js').status_code == 404
+    # Il file senza hash è servito normalmente, senza cache immutable
+    risposta = cliente.get('/static/scripts/lotti.js')
+    assert risposta.status_code == 200
+    assert not risposta.cache_control.immutable
+
+
+def test_debug_ignora_il_manifest_salvato(cartella):
+    build_statici(str(cartella))
+    (cartella / 'styles.css').write_text('body { color: red; }\n')
+
+    salvato = json.loads((cartella / NOME_MANIFEST).read_text())
+    assert _url(_crea_app(cartella), 'styles.css') == '/static/' + salvato['styles.css']
+    aggiornato = '/static/' + statici.costruisci_manifest(str(cartella))['styles.css']
+    assert aggiornato != '/static/' + salvato['styles.css']
+    assert _url(_crea_app(cartella, debug=True), 'styles.css') == aggiornato
@@ -0,0 +1,240 @@
+import hmac
+from datetime import datetime
+from flask import Blueprint, abort, current_app, flash, jsonify, redirect, render_template, request, stream_with_context, url_for
+from werkzeug.utils import secure_filename
+from accesso import admin_required, invalida_utente
+from archivio import ha_prenotazioni_archiviate
+from elenchi import pagina_elenco, suggerimenti, AUTOCOMPLETAMENTO
+from estensioni import limiter
+from immagini import salva_upload, accoda_varianti
+from metriche import testo_prometheus
+from models import db, Lotto, Prodotto, Produttore, User, Prenotazione
+from report import COLONNE, RIGHE_PAGINA_MAX, leggi_filtri, righe_report, stream_csv
+from serializzatori import json_response
+from settings import METRICHE_TOKEN
+
+# Amministrazione del database (solo per admin) e metriche
+bp = Blueprint('admin', __name__)
+
+# Configurazione per l'upload dei file (UPLOAD_FOLDER e MAX_CONTENT_LENGTH
+# sono nella configurazione dell'app, vedi create_app)
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# Salva l'immagine caricata con un nome ricavato dal suo contenuto e mette in
+# coda la generazione delle varianti ridimensionate. Restituisce il nome del
+# file nella cartella delle immagini (UPLOAD_FOLDER), o None se il file non è valido
+def save_image(file):
+    if file and file.filename != '' and allowed_file(file.filename):
+        estensione = secure_filename(file.filename).rsplit('.', 1)[1].lower()
+        filename = salva_upload(file, estensione)
+        accoda_varianti(filename, current_app._get_current_object())
+        return filename
+    return None
+
+# Route per gestire i produttori (aggiunta/modifica) (solo per admin)
+@bp.route('/gestisci_produttore/<int:id>', methods=['GET', 'POST'])
+@bp.route('/gestisci_produttore', defaults={'id': None}, methods=['GET', 'POST'])
+@admin_required
+def gestisci_produttore(id):
+    produttore = Produttore.query.get(id) if id else None
+    if request.method == 'POST':
+        if produttore:
+            produttore.nome_produttore = request.form['nome_produttore']
+            produttore.descrizione = request.form['descrizione']
+            produttore.indirizzo = request.form['indirizzo']
+            produttore.telefono = request.form['telefono']
+            produttore.email = request.form['email']
+            flash('Produttore aggiornato con successo', 'success')
+        else:
+            nuovo_produttore = Produttore(
+                nome_produttore=request.form['nome_produttore'],
+                descrizione=request.form['descrizione'],
+                indirizzo=request.form['indirizzo'],
+                telefono=request.form['telefono'],
+                email=request.form['email']
+            )
+            db.session.add(nuovo_produttore)
+            flash('Nuovo produttore aggiunto con successo', 'success')
+        
+        db.session.commit()
+        return redirect(url_for('admin.lista_produttori'))
+    
+    return render_template('gestisci_produttore.html', produttore=produttore)
+
+# Route per gestire i prodotti (aggiunta/modifica) (solo per admin)
+@bp.route('/gestisci_prodotto/<int:id>', methods=['GET', 'POST'])
+@bp.route('/gestisci_prodotto', defaults={'id': None}, methods=['GET', 'POST'])
+@admin_required
+def gestisci_prodotto(id):
+    prodotto = Prodotto.query.get(id) if id else None
+    if request.method == 'POST':
+        try:
+            nome_prodotto = request.form['nome_prodotto']
+            produttore_id = request.form['produttore_id']
+            
+            if prodotto:
+                prodotto.nome_prodotto = nome_prodotto
+                prodotto.produttore_id = produttore_id
+            else:
+                prodotto = Prodotto(nome_prodotto=nome_prodotto, produttore_id=produttore_id)
+                db.session.add(prodotto)
+            
+            if 'immagine' in request.files:
+                filename = save_image(request.files['immagine'])
+                if filename:
+                    prodotto.immagine = filename
+                    current_app.logger.info(f"Immagine salvata: {filename}")
+                else:
+                    current_app.logger.warning("File non valido o non selezionato")
+            
+            db.session.commit()
+            flash('Prodotto salvato con successo', 'success')
+            return redirect(url_for('admin.lista_prodotti'))
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Errore durante il salvataggio del prodotto: {str(e)}")
+            flash(f'Si è verificato un errore durante il salvataggio del prodotto: {str(e)}', 'error')
+    
+    return render_template('gestisci_prodotto.html', prodotto=prodotto)
+
+# Route per gestire i lotti (aggiunta/modifica) (solo per admin)
+@bp.route('/gestisci_lotto/<int:id>', methods=['GET', 'POST'])
+@bp.route('/gestisci_lotto', defaults={'id': None}, methods=['GET', 'POST'])
+@admin_required
+def gestisci_lotto(id):
+    lotto = Lotto.query.get(id) if id else None
+    if request.method == 'POST':
+        if lotto:
+            lotto.prodotto_id = request.form['prodotto_id']
+            lotto.data_consegna = datetime.strptime(request.form['data_consegna'], '%Y-%m-%d')
+            lotto.qta_unita_misura = request.form['qta_unita_misura']
+            lotto.qta_lotto = int(request.form['qta_lotto'])
+            lotto.prezzo_unitario = float(request.form['prezzo_unitario'])
+            lotto.sospeso = request.form['sospeso'] == 'true'
+            flash('Lotto aggiornato con successo', 'success')
+        else:
+            nuovo_lotto = Lotto(
+                prodotto_id=request.form['prodotto_id'],
+                data_consegna=datetime.strptime(request.form['data_consegna'], '%Y-%m-%d'),
+                qta_unita_misura=request.form['qta_unita_misura'],
+                qta_lotto=int(request.form['qta_lotto']),
+                prezzo_unitario=float(request.form['prezzo_unitario']),
+                sospeso=request.form['sospeso'] == 'true'
+            )
+            db.session.add(nuovo_lotto)
+            flash('Nuovo lotto aggiunto con successo', 'success')
+        
+        db.session.commit()
+        return redirect(url_for('admin.lista_lotti'))
+    
+    return render_template('gestisci_lotto.html', lotto=lotto)
+
+# Route per la lista dei produttori (solo per admin)
+@bp.route('/lista_produttori')
+@admin_required
+def lista_produttori():
+    return render_template('lista_produttori.html', produttori=pagina_elenco('produttori', request.args))
+
+# Route per la lista dei prodotti (solo per admin)
+@bp.route('/lista_prodotti')
+@admin_required
+def lista_prodotti():
+    return render_template('lista_prodotti.html', prodotti=pagina_elenco('prodotti', request.args))
+
+# Route per la lista dei lotti (solo per admin)
+@bp.route('/lista_lotti')
+@admin_required
+def lista_lotti():
+    return render_template('lista_lotti.html', lotti=pagina_elenco('lotti', request.args))
+
+# Route per i riepiloghi degli ordini per data di consegna e produttore (solo per admin).
+# Filtri opzionali nella query string: data_da, data_a, produttore_id e
+# archivio=1 per comprendere anche i lotti archiviati. La pagina mostra al
+# massimo RIGHE_PAGINA_MAX lotti, con il link al CSV completo
+@bp.route('/report')
+@admin_required
+def report():
+    try:
+        filtri = leggi_filtri(request.args)
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('admin.report'))
+    storico = request.args.get('archivio') == '1'
+    totali_lotti = list(righe_report('lotti', storico, RIGHE_PAGINA_MAX + 1, **filtri))
+    return render_template(
+        'report.html',
+        filtri=filtri,
+        storico=storico,
+        produttori=db.session.execute(
+            db.select(Produttore.id, Produttore.nome_produttore).order_by(Produttore.nome_produttore)).all(),
+        totali_produttori=list(righe_report('produttori', storico, **filtri)),
+        totali_lotti=totali_lotti[:RIGHE_PAGINA_MAX],
+        lotti_troncati=len(totali_lotti) > RIGHE_PAGINA_MAX,
+    )
+
+# Download in CSV dei riepiloghi ('lotti', 'produttori') e della lista di
+# ritiro per socio ('ritiro'), generati in streaming (solo per admin)
+@bp.route('/report/<nome>.csv')
+@admin_required
+def report_csv(nome):
+    if nome not in COLONNE:
+        return 'Report non trovato!', 404
+    try:
+        filtri = leggi_filtri(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    storico = request.args.get('archivio') == '1'
+    response = current_app.response_class(stream_with_context(stream_csv(nome, storico, **filtri)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=report-{nome}.csv'
+    return response
+
+# API per l'autocompletamento dei campi dei form di amministrazione (solo
+# per admin): /api/autocompleta/prodotti?q=mele -> [{"id": 4, "testo": "Mele Golden"}]
+@bp.route('/api/autocompleta/<tipo>')
+@admin_required
+def autocompleta(tipo):
+    if tipo not in AUTOCOMPLETAMENTO:
+        return jsonify({"error": "Tipo non valido"}), 404
+    return json_response(suggerimenti(tipo, request.args.get('q', '')[:100]))
+
+# Route per gestire gli utenti (solo per admin)
+@bp.route('/gestisci_utenti', methods=['GET', 'POST'])
+@admin_required
+def gestisci_utenti():
+    if request.method == 'POST':
+        user_id = request.form['user_id']
+        action = request.form['action']
+        user = User.query.get(user_id)
+        
+        if not user:
+            flash('Utente non trovato', 'danger')
+        elif action == 'update':
+            user.ruolo = request.form['ruolo']
+            db.session.commit()
+            invalida_utente(user.id)
+            flash('Ruolo aggiornato con successo', 'success')
+        elif action == 'delete':
+            if Prenotazione.query.filter_by(user_id=user_id).count() > 0 or ha_prenotazioni_archiviate(user.id):
+                flash('Impossibile eliminare l\'utente, ci sono delle prenotazioni!', 'danger')
+            else:
+                db.session.delete(user)
+                db.session.commit()
+                invalida_utente(int(user_id))
+                flash('Utente eliminato con successo', 'success')
+    
+    return render_template('gestisci_utenti.html', utenti=pagina_elenco('utenti', request.args))
+
+# Metriche in formato Prometheus (vedi metriche.py), con l'intestazione
+# 'Authorization: Bearer <token>' di settings.METRICHE_TOKEN. Se il token non
+# è impostato l'endpoint non esiste (404): le metriche non sono mai pubbliche
+@bp.route('/metrics')
+@limiter.exempt
+def metrics():
+    if not METRICHE_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICHE_TOKEN}'):
+        return 'Non autorizzato', 401
+    return current_app.response_class(testo_prometheus(), mimetype='text/plain; version=0.0.4')
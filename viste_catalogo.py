@@ -0,0 +1,101 @@
+from flask import Blueprint, current_app, jsonify, redirect, render_template, request, session, url_for
+from accesso import get_current_user, login_required
+from catalogo import get_catalogo_json, get_catalogo_html, get_pagina_lotti
+from disponibilita import get_disponibilita, iscrivi, stream_eventi
+from estensioni import limiter
+from models import db, Lotto, Prenotazione
+from paginazione import PARAMETRI_PAGINA
+from ricerca import cerca_lotti, RISULTATI_DEFAULT, RISULTATI_MAX
+from serializzatori import json_response
+
+# Catalogo dei lotti: home, API dei lotti e pagina del singolo lotto
+bp = Blueprint('catalogo', __name__)
+
+# Route per la home page
+@bp.route('/')
+def home():
+    user = get_current_user()
+    return render_template('home.html', user=user, catalogo=get_catalogo_html())
+
+# API per ottenere i lotti
+@bp.route('/api/lotti', methods=['GET'])
+def get_lotti():
+    order = request.args.get('order', 'asc')
+    if order not in ['asc', 'desc']:
+        return 'Parametro order non valido. Utilizzare "asc" o "desc".'
+
+    # Con 'limit', 'cursor' o 'fields' la risposta è paginata:
+    # {"items": [...], "next_cursor": "..."} (vedi catalogo.get_pagina_lotti)
+    if PARAMETRI_PAGINA & request.args.keys():
+        try:
+            return json_response(get_pagina_lotti(order, request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    # Il catalogo è lo stesso per tutti: risponde dalla cache con un ETag, e
+    # 'no-cache' obbliga il browser a rivalidare (304) per avere sempre la
+    # disponibilità aggiornata
+    etag, body = get_catalogo_json(order)
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Stream Server-Sent Events con la disponibilità dei lotti: un evento
+# 'istantanea' all'apertura, poi un evento 'disponibilita' con i soli lotti
+# cambiati dopo ogni prenotazione o modifica (vedi disponibilita.py). Con 503
+# (troppi client o stream disattivato) le pagine passano al polling
+@bp.route('/api/lotti/eventi', methods=['GET'])
+@limiter.limit("30 per minute")
+def eventi_lotti():
+    iscrizione = iscrivi(current_app._get_current_object())
+    if iscrizione is None:
+        return jsonify({"error": "Troppi client collegati, riprova più tardi."}), 503
+    response = current_app.response_class(stream_eventi(iscrizione), mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx: non accumulare gli eventi
+    return response
+
+# Disponibilità di tutti i lotti, per le pagine che non usano lo stream:
+# [{"id": 3, "qta": 12, "sospeso": false}, ...]. L'ETag è la versione del
+# catalogo: finché non cambia la risposta è 304
+@bp.route('/api/lotti/disponibilita', methods=['GET'])
+@limiter.limit("120 per minute")
+def disponibilita_lotti():
+    versione, lotti = get_disponibilita(current_app._get_current_object())
+    response = json_response(lotti)
+    response.set_etag(f'disponibilita-{versione}')
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# API di ricerca: lotti prenotabili dei prodotti che corrispondono al testo,
+# cercato come prefisso nel nome del prodotto e nei dati del produttore:
+#   /api/cerca?q=mele&limit=20 (vedi ricerca.cerca_lotti)
+# Il limite per minuto, più alto di quello di default, permette di cercare
+# mentre si scrive
+@bp.route('/api/cerca', methods=['GET'])
+@limiter.limit("120 per minute")
+def cerca():
+    limite = request.args.get('limit', RISULTATI_DEFAULT, type=int)
+    if not 1 <= limite <= RISULTATI_MAX:
+        return jsonify({"error": f"Il parametro limit deve essere tra 1 e {RISULTATI_MAX}"}), 400
+    return json_response(cerca_lotti(request.args.get('q', '')[:100], limite))
+
+# Route per visualizzare un singolo lotto
+@bp.route('/lotto/<int:id_lotto>', methods=['GET'])
+@login_required
+def mostra_lotto(id_lotto):
+    lotto = db.session.get(Lotto, id_lotto)
+    if not lotto:
+        return 'Lotto non trovato!', 404
+
+    prenot_utente = Prenotazione.query.filter_by(
+        user_id=session['user_id'],
+        lotto_id=id_lotto
+    ).first()
+
+    if prenot_utente:
+        return redirect(url_for('prenotazioni.aggiorna_prenotazione', id_prenotazione=prenot_utente.id))
+    else:
+        return render_template('lotto.html', lotto=lotto, user=get_current_user())
@@ -0,0 +1,193 @@
+from flask import Blueprint, flash, jsonify, redirect, render_template, request, session, url_for
+from sqlalchemy.orm import contains_eager, joinedload
+from accesso import get_current_user, login_required
+from estensioni import limiter
+from metriche import conta_prenotazione
+from models import db, opzioni_catalogo, Lotto, Prenotazione
+from paginazione import leggi_parametri, applica_keyset, pagina, PARAMETRI_PAGINA
+from prenotazioni import (prenota, modifica, esegui_batch, sincronizza, get_riga_prenotazione, get_versione_prenotazioni,
+                          totali_prenotazioni, BATCH_MAX, ESITO_OK, ESITO_ESAURITO, ESITO_NON_VALIDA, ESITO_DUPLICATA, ESITO_NON_TROVATA)
+from serializzatori import serializza, json_response
+
+# Prenotazioni dell'utente loggato: pagine e API
+bp = Blueprint('prenotazioni', __name__)
+
+# Route per creare una nuova prenotazione
+@bp.route('/lotto/<int:id_lotto>', methods=['POST'])
+@login_required
+def nuova_prenotazione(id_lotto):
+    try:
+        quantita = int(request.form.get('quantita'))
+    except ValueError:
+        flash('Quantità non valida!', 'warning')
+        return redirect(url_for('catalogo.mostra_lotto', id_lotto=id_lotto))
+
+    esito = prenota(id_lotto, session['user_id'], quantita)
+    if esito.stato == ESITO_NON_TROVATA:
+        flash('Lotto non trovato!', 'danger')
+        return redirect(url_for('catalogo.home'))
+    elif esito.stato == ESITO_ESAURITO:
+        flash(f'Quantità non disponibile. Massimo disponibile: {esito.qta_disponibile}', 'warning')
+        return redirect(url_for('catalogo.mostra_lotto', id_lotto=id_lotto))
+    elif esito.stato == ESITO_NON_VALIDA:
+        flash('Quantità non valida.', 'warning')
+        return redirect(url_for('catalogo.mostra_lotto', id_lotto=id_lotto))
+    elif esito.stato == ESITO_DUPLICATA:
+        flash('Hai già una prenotazione per questo lotto.', 'warning')
+    else:
+        flash('Prenotazione effettuata con successo!', 'success')
+
+    return redirect(url_for('prenotazioni.mostra_prenotazioni'))
+
+# Route per aggiornare una prenotazione esistente
+@bp.route('/prenotazione/<int:id_prenotazione>', methods=['GET', 'POST'])
+@login_required
+@limiter.limit("5 per minute")
+def aggiorna_prenotazione(id_prenotazione):
+    prenotazione = db.session.get(Prenotazione, id_prenotazione)
+    if not prenotazione or prenotazione.user_id != session['user_id']:
+        flash('Prenotazione non trovata o non autorizzata!', 'danger')
+        return redirect(url_for('prenotazioni.mostra_prenotazioni'))
+
+    if request.method == 'POST':
+        quantita = int(request.form.get('quantita'))
+        esito = modifica(id_prenotazione, session['user_id'], quantita)
+
+        if esito.stato != ESITO_OK:
+            flash('Quantità non valida.', 'warning')
+            return redirect(url_for('prenotazioni.aggiorna_prenotazione', id_prenotazione=id_prenotazione))
+
+        flash('Prenotazione aggiornata con successo!', 'success')
+        return redirect(url_for('prenotazioni.mostra_prenotazioni'))
+
+    return render_template('prenotazione.html', prenotazione=prenotazione, user=get_current_user())
+
+# Route per visualizzare tutte le prenotazioni dell'utente
+@bp.route('/prenotazioni')
+@login_required
+def mostra_prenotazioni():
+    return render_template('prenotazioni.html', user=get_current_user())
+
+# API per ottenere le prenotazioni dell'utente
+@bp.route('/api/prenotazioni', methods=['GET'])
+@login_required
+def get_prenotazioni():
+    # Con 'since' restituisce solo le prenotazioni cambiate o eliminate dopo
+    # quella versione, già appiattite e con i totali calcolati dal server
+    # (vedi prenotazioni.sincronizza); since=0 per il primo caricamento
+    if 'since' in request.args:
+        dal = request.args.get('since', type=int)
+        if dal is None or dal < 0:
+            return jsonify({"error": "Il parametro since deve essere un intero non negativo"}), 400
+        return json_response(sincronizza(session['user_id'], dal))
+
+    # Con 'limit', 'cursor' o 'fields' la risposta è paginata per
+    # (data di consegna del lotto, id prenotazione), come /api/lotti
+    if PARAMETRI_PAGINA & request.args.keys():
+        order = request.args.get('order', 'asc')
+        try:
+            limit, cursore, campi = leggi_parametri(request.args, Prenotazione)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        query = (
+            Prenotazione.query
+            .join(Prenotazione.rel_lotto)
+            .options(contains_eager(Prenotazione.rel_lotto).options(*opzioni_catalogo(con_prenotazioni=False)))
+            .filter(Prenotazione.user_id == session['user_id'])
+        )
+        prenotazioni = applica_keyset(query, Lotto.data_consegna, Prenotazione.id, order, limit, cursore).all()
+        return json_response(pagina(
+            prenotazioni, limit,
+            chiave=lambda p: (p.rel_lotto.data_consegna, p.id),
+            serializza=lambda p: serializza(p, campi),
+        ))
+
+    # Lotto, prodotto, produttore e utente di ogni prenotazione vengono letti
+    # con le JOIN della stessa SELECT, senza una query per prenotazione
+    prenotazioni = (
+        Prenotazione.query
+        .options(joinedload(Prenotazione.rel_lotto).options(*opzioni_catalogo(con_prenotazioni=False)),
+                 joinedload(Prenotazione.rel_user))
+        .filter_by(user_id=session['user_id'])
+        .all()
+    )
+    return json_response([serializza(prenotazione) for prenotazione in prenotazioni])
+
+# API per modificare una prenotazione
+@bp.route('/api/prenotazione/modifica', methods=['POST'])
+@login_required
+def modifica_prenotazione():
+    data = request.json
+    prenotazione = db.session.get(Prenotazione, data.get('id'))
+    if not prenotazione or prenotazione.user_id != session['user_id']:
+        return jsonify({"error": "Prenotazione non trovata"}), 404
+
+    try:
+        nuova_quantita = int(data.get('quantita'))
+    except ValueError:
+        return jsonify({"error": "La quantità deve essere un numero intero"}), 400
+
+    esito = modifica(prenotazione.id, session['user_id'], nuova_quantita)
+    if esito.stato == ESITO_NON_TROVATA:
+        return jsonify({"error": "Prenotazione non trovata"}), 404
+    if esito.stato != ESITO_OK:
+        return jsonify({"error": f"Quantità non valida. Massimo disponibile: {esito.qta_disponibile}"}), 400
+
+    # La riga aggiornata, i totali e la nuova versione permettono al client di
+    # aggiornarsi senza rileggere tutte le prenotazioni
+    return json_response({
+        "success": True, "message": "Quantità aggiornata con successo",
+        "prenotazione": get_riga_prenotazione(prenotazione.id, session['user_id']),
+        "versione": get_versione_prenotazioni(session['user_id'])[0],
+        **totali_prenotazioni(session['user_id']),
+    })
+
+# API per eliminare una prenotazione
+@bp.route('/api/prenotazione/elimina', methods=['POST'])
+@login_required
+def elimina_prenotazione():
+    data = request.json
+    prenotazione = db.session.get(Prenotazione, data.get('id'))
+    if not prenotazione or prenotazione.user_id != session['user_id']:
+        return jsonify({"error": "Prenotazione non trovata"}), 404
+
+    id_prenotazione = prenotazione.id
+    db.session.delete(prenotazione)
+    db.session.commit()
+    conta_prenotazione('elimina', ESITO_OK)
+
+    return json_response({
+        "success": True, "message": "Prenotazione eliminata con successo",
+        "id": id_prenotazione,
+        "versione": get_versione_prenotazioni(session['user_id'])[0],
+        **totali_prenotazioni(session['user_id']),
+    })
+
+# API per eseguire più operazioni sulle prenotazioni con una sola richiesta:
+#   {"atomico": true, "operazioni": [
+#       {"op": "crea", "lotto_id": 3, "quantita": 2},
+#       {"op": "modifica", "id": 10, "quantita": 5},
+#       {"op": "elimina", "id": 11}]}
+# Con "atomico" (default) le operazioni vengono applicate tutte o nessuna,
+# altrimenti solo quelle valide. La risposta contiene l'esito di ciascuna
+@bp.route('/api/prenotazioni/batch', methods=['POST'])
+@login_required
+@limiter.limit("10 per minute")
+def batch_prenotazioni():
+    data = request.get_json(silent=True) or {}
+    operazioni = data.get('operazioni')
+    if not isinstance(operazioni, list) or not operazioni or not all(isinstance(o, dict) for o in operazioni):
+        return jsonify({"error": "Il campo operazioni deve essere una lista non vuota di oggetti"}), 400
+    if len(operazioni) > BATCH_MAX:
+        return jsonify({"error": f"Al massimo {BATCH_MAX} operazioni per richiesta"}), 400
+    atomico = data.get('atomico', True) is not False
+
+    esiti = esegui_batch(session['user_id'], operazioni, atomico=atomico)
+    risultati = [
+        {"indice": i, "op": o.get('op'), "stato": e.stato, "id": e.prenotazione_id, "qta_disponibile": e.qta_disponibile}
+        for i, (o, e) in enumerate(zip(operazioni, esiti))
+    ]
+    successo = all(e.stato == ESITO_OK for e in esiti)
+    status = 409 if atomico and not successo else 200
+    return jsonify({"success": successo, "risultati": risultati}), status
@@ -0,0 +1,72 @@
+import re
+from flask import Blueprint, flash, redirect, render_template, request, session, url_for
+from accesso import login_required
+from estensioni import limiter
+from models import db, User
+from password import richiede_rehash
+
+# Login, registrazione e logout
+bp = Blueprint('utenti', __name__)
+
+# Funzione per convalidare la password
+def is_password_strong(password):
+    return (len(password) >= 8 and
+            re.search("[a-z]", password) and
+            re.search("[A-Z]", password) and
+            re.search("[0-9]", password) and
+            re.search("[!@#$%^&*(),.?\":{}|<>]", password))
+
+# Route per il login
+@bp.route('/login', methods=['GET', 'POST'])
+@limiter.limit("10 per minute")
+def login():
+    if request.method == 'POST':
+        email = request.form['email']
+        password = request.form['password']
+        user = User.query.filter_by(email=email).first()
+        if user and user.check_password(password):
+            # Se i parametri degli hash sono cambiati, aggiorna l'hash salvato
+            if richiede_rehash(user.password):
+                user.set_password(password)
+                db.session.commit()
+            session['user_id'] = user.id
+            flash('Login riuscito!', 'success')
+            return redirect(url_for('catalogo.home'))
+        else:
+            flash('Credenziali non valide!', 'danger')
+            return redirect(url_for('utenti.login'))
+    return render_template('login.html')
+
+# Route per la registrazione
+@bp.route('/registrazione', methods=['GET', 'POST'])
+@limiter.limit("5 per minute")
+def registrazione():
+    if request.method == 'POST':
+        if not is_password_strong(request.form['password']):
+            flash('La password non soddisfa i requisiti di sicurezza.', 'danger')
+            return redirect(url_for('utenti.registrazione'))
+
+        if User.query.filter_by(email=request.form['email']).first():
+            flash('Email già registrata. Utilizza un\'altra email.', 'danger')
+            return render_template('registrazione.html')
+
+        new_user = User(
+            nome=request.form['nome'],
+            cognome=request.form['cognome'],
+            telefono=request.form['telefono'],
+            email=request.form['email']
+        )
+        new_user.set_password(request.form['password'])
+        db.session.add(new_user)
+        db.session.commit()
+        flash('Registrazione effettuata con successo. Puoi effettuare il login.', 'success')
+        return redirect(url_for('utenti.login'))
+    return render_template('registrazione.html')
+
+# Route per il logout
+@bp.route('/logout')
+@login_required
+def logout():
+    session.pop('user_id', None)
+    flash('Logout effettuato con successo!', 'success')
+    return redirect(url_for('catalogo.home'))